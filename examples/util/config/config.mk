@@ -49,6 +49,14 @@ DATE := $(shell date +%F)
 # functions
 ####################
 
+# public function for parsing the model files of every component in ICDDB in
+# one process, writing the .sec files of each component to $1/<component>
+define make_parse_all_models
+	$(if ${TEMPLATE_PATH},,$(error TEMPLATE_PATH not defined))
+	$(if ${ICDDB},,$(error ICDDB not defined))
+	${TEMPLATE_PATH}/icddb/parseModelFile.py $(if ${JOBS},--jobs ${JOBS},) --all ${ICDDB} $1
+endef
+
 # private function for building generalized doxygen webpages
 define make_doxygen_gen
 	$(if ${DOXYGEN},,$(error DOXYGEN not defined))
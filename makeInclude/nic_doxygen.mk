@@ -51,6 +51,20 @@ define nic_doxygen_parse_model
 	${NIC_ROOT}/template/icddb/parseModelFile.py ${ICDDB} ${COMP} tmp
 endef
 
+# public function for parsing the model files of every component of a subsystem
+# in one process, e.g. to prepare the inputs of all its tech notes at once
+#	NIC_ROOT - path to head of NIC project
+#	ICDDB - path to head of subsystem model file project, e.g. ICD-Model-Files/NFIRAOS-Model-Files/
+#	SEC_ROOT - output directory, receives one directory of .sec files per component
+#	JOBS - number of parallel processes (optional, default number of CPUs)
+define nic_doxygen_parse_all_models
+	$(if ${NIC_ROOT},,$(error NIC_ROOT not defined))
+	$(if ${ICDDB},,$(error ICDDB not defined))
+	$(if ${SEC_ROOT},,$(error SEC_ROOT not defined))
+	# parse model files of all components
+	${NIC_ROOT}/template/icddb/parseModelFile.py $(if ${JOBS},--jobs ${JOBS},) --all ${ICDDB} ${SEC_ROOT}
+endef
+
 # public function for building PDF from doxygen output
 # 	DOC_TYPE - document type identifier using in file name, e.g. techNote, SBD
 #	COMP - component short name used in file name, e.g. dm-assembly
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# ******************************************************************************
+# ****         D A O   I N S T R U M E N T A T I O N   G R O U P           *****
+# *
+# * (c) 2019                               (c) 2019
+# * National Research Council              Conseil national de recherches
+# * Ottawa, Canada, K1A 0R6                Ottawa, Canada, K1A 0R6
+# * All rights reserved                    Tous droits reserves
+# *
+# * NRC disclaims any warranties,          Le CNRC denie toute garantie
+# * expressed, implied, or statutory, of   enoncee, implicite ou legale, de
+# * any kind with respect to the soft-     quelque nature que se soit, concer-
+# * ware, including without limitation     nant le logiciel, y compris sans
+# * any warranty of merchantability or     restriction toute garantie de valeur
+# * fitness for a particular purpose.      marchande u de pertinence pour un
+# * NRC shall not be liable in any event   usage particulier. Le CNRC ne pourra
+# * for any damages, whether direct or     en aucun cas etre tenu responsable
+# * indirect, special or general, conse-   de tout dommage, direct ou indirect,
+# * quential or incidental, arising from   particulier ou general, accessoire
+# * the use of the software.               ou fortuit, resultant de l'utili-
+# *                                        sation du logiciel.
+# *
+# *****************************************************************************
+
+
+"""Estimate the size and bandwidth of events from their models
+
+An event is assumed to carry a fixed header, then for each attribute its
+name and its value. Values take the sizes in type_sizes; strings and enums
+take string_size bytes (or the longest enum value); arrays take the
+product of their dimensions times the size of their items, with missing
+dimensions counted as one element; structs take the sum of their
+attributes.
+
+An event is published at its maxRate (or minRate if that's all the model
+gives), and a subscriber receives it at its requiredRate, limited to the
+rate it is published at. The estimates are for capacity planning: they
+do not depend on the event service's actual encoding, which should be
+reflected in the constants below.
+"""
+
+event_overhead = 64        # bytes: source prefix, event name, id and time
+attribute_overhead = 4     # bytes per attribute besides its name and value
+string_size = 32           # bytes assumed for strings without a maxLength
+type_sizes = {
+    'boolean': 1,
+    'byte': 1,
+    'short': 2,
+    'integer': 4,
+    'int': 4,
+    'long': 8,
+    'float': 4,
+    'double': 8,
+    'taiDate': 12,
+    'utcDate': 12,
+    'taiTime': 12,
+    'utcTime': 12,
+    'raDec': 16,
+    'eqCoord': 32,
+    'solarSystemCoord': 32,
+    'minorPlanetCoord': 64,
+    'cometCoord': 64,
+    'altAzCoord': 24,
+    'coord': 64
+    }
+
+# *****************************************************************************
+def value_size(elem):
+    """ Size of one value described by an attribute or array item model
+
+    Args:
+        elem (dict): attribute/item model with a type, enum or attributes
+
+    Returns:
+        int: estimated bytes
+    """
+    if 'enum' in elem:
+        return max([len(str(e)) for e in elem['enum']] or [string_size])
+    t = elem.get('type',None)
+    if t == 'array':
+        n = 1
+        for d in elem.get('dimensions',None) or ():
+            n *= int(d)
+        return n*value_size(elem.get('items',None) or {})
+    if t == 'struct' or 'attributes' in elem:
+        return sum(attribute_size(a) for a in elem.get('attributes',None) or ())
+    if t == 'string':
+        return int(elem.get('maxLength',string_size))
+    return type_sizes.get(t,8)
+
+# *****************************************************************************
+def attribute_size(attr):
+    """ Size of an attribute of an event, including its name
+
+    Args:
+        attr (dict): attribute model
+
+    Returns:
+        int: estimated bytes
+    """
+    return attribute_overhead+len(str(attr.get('name','')))+value_size(attr)
+
+# *****************************************************************************
+def event_size(event):
+    """ Size of an event
+
+    Args:
+        event (dict): event model from a publish model
+
+    Returns:
+        int: estimated bytes
+    """
+    return event_overhead+sum(attribute_size(a) for a in event.get('attributes',None) or ())
+
+# *****************************************************************************
+def as_rate(value):
+    """ Rate given in a model
+
+    Args:
+        value: maxRate, minRate or requiredRate value
+
+    Returns:
+        float: Hz, None if value isn't a number
+    """
+    try:
+        return float(value)
+    except (TypeError,ValueError):
+        return None
+
+# *****************************************************************************
+def event_rate(event):
+    """ Rate an event is published at
+
+    Args:
+        event (dict): event model from a publish model
+
+    Returns:
+        float: Hz, None if the model gives no rate
+    """
+    for key in ('maxRate','minRate'):
+        if key in event and as_rate(event[key]) is not None:
+            return as_rate(event[key])
+    return None
+
+# *****************************************************************************
+def received_rate(rate, required=None):
+    """ Rate a subscriber receives an event at
+
+    Args:
+        rate (float): rate the event is published at (None if unknown)
+        required (float): subscriber's requiredRate (None if not given)
+
+    Returns:
+        float: Hz, None if neither rate is known
+    """
+    if required is None:
+        return rate
+    if rate is None:
+        return required
+    return min(rate,required)
+
+# *****************************************************************************
+def format_bytes(n, per=''):
+    """ Human-readable size or bandwidth
+
+    Args:
+        n (float): bytes (None if unknown)
+        per (str): appended to the unit, e.g. '/s'
+
+    Returns:
+        str: e.g. '150 B', '1.2 kB/s', or '?' if n is None
+    """
+    if n is None:
+        return '?'
+    for unit in ('B','kB','MB','GB'):
+        if abs(n) < 999.5 or unit == 'GB':
+            break
+        n /= 1000
+    if unit == 'B':
+        return '%d %s%s' % (round(n),unit,per)
+    return '%.*f %s%s' % (1 if n < 100 else 0,n,unit,per)
+
+# *****************************************************************************
+def format_bandwidth(size, rate):
+    """ Human-readable bandwidth of an event
+
+    Args:
+        size (int): event size in bytes
+        rate (float): Hz (None if unknown)
+
+    Returns:
+        str: e.g. '1.5 kB/s (150 B at 10 Hz)', or '150 B per event' if the
+            rate is unknown
+    """
+    if rate is None:
+        return '%s per event' % format_bytes(size)
+    return '%s (%s at %g Hz)' % (format_bytes(size*rate,'/s'),format_bytes(size),rate)
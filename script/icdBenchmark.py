@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# ******************************************************************************
+# ****         D A O   I N S T R U M E N T A T I O N   G R O U P           *****
+# *
+# * (c) 2019                               (c) 2019
+# * National Research Council              Conseil national de recherches
+# * Ottawa, Canada, K1A 0R6                Ottawa, Canada, K1A 0R6
+# * All rights reserved                    Tous droits reserves
+# *
+# * NRC disclaims any warranties,          Le CNRC denie toute garantie
+# * expressed, implied, or statutory, of   enoncee, implicite ou legale, de
+# * any kind with respect to the soft-     quelque nature que se soit, concer-
+# * ware, including without limitation     nant le logiciel, y compris sans
+# * any warranty of merchantability or     restriction toute garantie de valeur
+# * fitness for a particular purpose.      marchande u de pertinence pour un
+# * NRC shall not be liable in any event   usage particulier. Le CNRC ne pourra
+# * for any damages, whether direct or     en aucun cas etre tenu responsable
+# * indirect, special or general, conse-   de tout dommage, direct ou indirect,
+# * quential or incidental, arising from   particulier ou general, accessoire
+# * the use of the software.               ou fortuit, resultant de l'utili-
+# *                                        sation du logiciel.
+# *
+# *****************************************************************************
+
+"""Time the ICD tools against synthetic ICDs of increasing size"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import icdProfile
+import icdRelationships as icd
+import icdSynthetic
+
+# benchmark defaults
+sizes = '5,20,80'       # components per subsystem at each size
+repeat = 3              # best of this many runs is recorded
+sample = 10             # components run through parseModelFile at each size
+threshold = 1.25        # slow-down ratio reported as a regression by --compare
+database = 'icds_benchmark'
+icddb = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..','template','icddb')
+
+# *****************************************************************************
+def timed(func, repeat):
+    """ Best wall time of several calls
+
+    Args:
+        func (callable): function to time, called without arguments
+        repeat (int): number of calls
+
+    Returns:
+        seconds (float): shortest call
+        result: return value of the last call
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter()-start
+        if best is None or seconds < best:
+            best = seconds
+    return best,result
+
+# *****************************************************************************
+def open_database(mongo, name):
+    """ Database the synthetic collections are written to and read from
+
+    Args:
+        mongo (str): MongoDB URI, None to use an in-memory mongomock server
+
+    Returns:
+        Database: pymongo or mongomock database
+    """
+    if mongo:
+        from pymongo import MongoClient
+        return MongoClient(mongo)[name]
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit('Error: install mongomock, or use --mongo to benchmark against a server')
+    return mongomock.MongoClient()[name]
+
+# *****************************************************************************
+def run_size(params, db, workdir, repeat, sample, jobs, fetch_jobs):
+    """ Benchmark the tools on one synthetic ICD
+
+    Args:
+        params (dict): icdSynthetic.synthetic_models() arguments
+        db (Database): database to write the collections to
+        workdir (str): directory for the model file tree and outputs
+        repeat (int): number of runs of each phase
+        sample (int): number of components run through parseModelFile
+        jobs (int): processes used to parse the model file tree
+        fetch_jobs (int): database queries in flight at once
+
+    Returns:
+        list: one dict per phase with phase, seconds, items, peak_rss_kib,
+            and the reason a phase could not run in skipped (seconds None)
+    """
+    results = []
+
+    def record(phase, seconds, items):
+        results.append({'phase':phase, 'seconds':round(seconds,6),
+            'items':items, 'peak_rss_kib':icdProfile.peak_rss()})
+        print('  %-24s %10.4f s %10d items' % (phase,seconds,items))
+
+    def skip(phase, reason):
+        results.append({'phase':phase, 'seconds':None, 'items':0,
+            'peak_rss_kib':None, 'skipped':reason})
+        print('  %-24s    skipped: %s' % (phase,reason))
+
+    docs = icdSynthetic.synthetic_models(**params)
+    modeldir = os.path.join(workdir,'models')
+    icdSynthetic.write_models(docs,modeldir)
+    icdSynthetic.write_database(docs,db,drop=True)
+
+    # read_database() connects by URI, which can't reach a mongomock server
+    icd.clients[None] = {db.name:db}
+
+    def read_database():
+        icd.clear_database()
+        icd.read_database(None,False,None,db.name,fetch_jobs)
+    seconds,r = timed(read_database,repeat)
+    record('read_database',seconds,len(icd.all_prefixes))
+
+    # the snapshot cache itself, without the database signature check
+    cachefile = os.path.join(workdir,'cache','snapshot.pickle')
+    icd.save_cache(cachefile,'benchmark')
+    def load_cache():
+        icd.clear_database()
+        icd.load_cache(cachefile,'benchmark')
+    seconds,r = timed(load_cache,repeat)
+    record('load_cache',seconds,len(icd.all_prefixes))
+
+    if icd.database_signature(db,fetch_jobs)[1] is not None:
+        cache_dir = os.path.join(workdir,'cache')
+        icd.read_database(cache_dir,False,None,db.name,fetch_jobs)
+        def read_cached():
+            icd.clear_database()
+            icd.read_database(cache_dir,False,None,db.name,fetch_jobs)
+        seconds,r = timed(read_cached,repeat)
+        record('read_database (cached)',seconds,len(icd.all_prefixes))
+    else:
+        skip('read_database (cached)','the server does not support collStats')
+
+    # a plot with the default options, as run by icdRelationships.py: the
+    # first run must save the snapshot that the second one restores
+    icd.cache_dir = os.path.join(workdir,'default-cache')
+    icd.mongo_uri = None
+    icd.database = db.name
+    icd.fetch_jobs = fetch_jobs
+    subsystem = min(d['subsystem'] for d in docs.values())
+    def read_icd():
+        icd.clear_database()
+        return icd.read_icd((),[subsystem],set())
+    if icd.database_signature(db,fetch_jobs)[1] is not None:
+        read_icd()
+        seconds,hit = timed(read_icd,repeat)
+        if not hit:
+            sys.exit('Error: a second default run did not restore the snapshot cache')
+        record('read_icd (warm)',seconds,len(icd.all_prefixes))
+    else:
+        skip('read_icd (warm)','the server does not support collStats')
+
+    def read_selected():
+        icd.clear_database()
+        icd.read_selected((),[subsystem],set(),None,db.name,fetch_jobs)
+    seconds,r = timed(read_selected,repeat)
+    record('read_selected',seconds,len(icd.all_prefixes))
+
+    def read_modeldir():
+        icd.clear_database()
+        icd.read_modeldir(modeldir,None,False,jobs)
+    seconds,r = timed(read_modeldir,repeat)
+    record('read_modeldir',seconds,len(icd.all_prefixes))
+
+    seconds,r = timed(icd.build_indexes,repeat)
+    record('build_indexes',seconds,len(icd.store.items))
+
+    primaries = icd.select_primaries((),['all'],set())
+    seconds,graph = timed(lambda: icd.build_graph(primaries),repeat)
+    record('build_graph',seconds,len(graph.cmd_pairs)+len(graph.ev_pairs))
+
+    opts = icd.default_options()
+    opts['missingcommands'] = True
+    opts['commandlabels'] = True
+    seconds,source = timed(lambda: icd.make_dot(graph,opts).source,repeat)
+    record('make_dot',seconds,len(source))
+
+    comps = sorted({(d['subsystem'],d['component']) for d in docs.values()})[:sample]
+    # --force and one output directory per component, so that every run
+    # parses and renders every component; the model cache is kept out of
+    # the user's and is emptied before each cold run
+    model_cache = os.path.join(workdir,'model-cache')
+    env = dict(os.environ,NIC_MODEL_CACHE=model_cache)
+    def parse_model_file():
+        for subsystem,component in comps:
+            d = icdSynthetic.component_dir(modeldir,subsystem,component)
+            outdir = os.path.join(workdir,'sec',subsystem,component)
+            os.makedirs(outdir,exist_ok=True)
+            subprocess.run([sys.executable,os.path.join(icddb,'parseModelFile.py'),
+                '--force',os.path.dirname(d),os.path.basename(d),outdir],
+                check=True,stdout=subprocess.DEVNULL,env=env)
+    def parse_model_file_cold():
+        shutil.rmtree(model_cache,ignore_errors=True)
+        parse_model_file()
+    seconds,r = timed(parse_model_file_cold,repeat)
+    record('parseModelFile (cold)',seconds,len(comps))
+    seconds,r = timed(parse_model_file,repeat)
+    record('parseModelFile (warm)',seconds,len(comps))
+
+    def gen_icd():
+        subprocess.run([sys.executable,os.path.join(icddb,'genIcd.py'),modeldir,
+            os.path.join(workdir,'command-model.conf'),
+            os.path.join(workdir,'subscribe-model.conf')],
+            check=True,stdout=subprocess.DEVNULL)
+    seconds,r = timed(gen_icd,repeat)
+    record('genIcd',seconds,len(icd.all_prefixes))
+
+    return results
+
+# *****************************************************************************
+def compare(results, baseline, threshold):
+    """ Compare benchmark results with earlier ones
+
+    Phases are matched on the number of components and the phase name.
+
+    Args:
+        results (dict): results of this run
+        baseline (dict): results of an earlier run
+        threshold (float): ratio of times reported as a regression
+
+    Returns:
+        int: number of regressions
+    """
+    before = {(r['components'],p['phase']):p['seconds']
+              for r in baseline['runs'] for p in r['phases']}
+    if baseline['params'] != results['params']:
+        print('Warning: baseline was generated with different parameters')
+    regressions = 0
+    print('%10s  %-24s %10s %10s %7s' % ('components','phase','before','after','ratio'))
+    for r in results['runs']:
+        for p in r['phases']:
+            key = (r['components'],p['phase'])
+            if p['seconds'] is None or before.get(key) is None:
+                continue
+            ratio = p['seconds']/before[key] if before[key] else float('inf')
+            flag = ''
+            if ratio > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print('%10d  %-24s %10.4f %10.4f %7.2f%s' % (r['components'],
+                p['phase'],before[key],p['seconds'],ratio,flag))
+    return regressions
+
+# *****************************************************************************
+# Entrypoint
+
+if __name__ == '__main__':
+
+    # parse the command line
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description="Time the ICD tools against synthetic ICDs of increasing size",
+        epilog="""For each size a synthetic ICD (see icdSynthetic.py) is written as a model
+file tree and as collections, then read_database, load_cache, read_database
+with a warm snapshot cache, a second default plot run of one subsystem
+(read_icd, which must restore the snapshot saved by the first), read_selected
+for one subsystem, read_modeldir, build_indexes, build_graph, make_dot,
+parseModelFile with an empty (cold) and a filled (warm) model cache, and
+genIcd are timed.
+The collections go to an in-memory mongomock server unless --mongo is given;
+every collection in --database is dropped first. mongomock does not
+support collStats, so the warm read_database and read_icd are reported as
+skipped.
+
+example:
+  icdBenchmark.py --output before.json
+  (change something)
+  icdBenchmark.py --output after.json --compare before.json
+""")
+    parser.add_argument("--sizes", default=sizes, nargs="?",
+        help="Comma-separated numbers of components per subsystem (default=%s)"%sizes )
+    parser.add_argument("--subsystems", default=icdSynthetic.subsystems, type=int, nargs="?",
+        help="Number of subsystems (default=%d)"%icdSynthetic.subsystems )
+    parser.add_argument("--events", default=icdSynthetic.events, type=int, nargs="?",
+        help="Events published by each component (default=%d)"%icdSynthetic.events )
+    parser.add_argument("--attributes", default=icdSynthetic.attributes, type=int, nargs="?",
+        help="Attributes of each event/arguments of each command (default=%d)"%icdSynthetic.attributes )
+    parser.add_argument("--commands", default=icdSynthetic.commands, type=int, nargs="?",
+        help="Commands received by each component (default=%d)"%icdSynthetic.commands )
+    parser.add_argument("--fanout", default=icdSynthetic.fanout, type=int, nargs="?",
+        help="Events subscribed to and commands sent by each component (default=%d)"%icdSynthetic.fanout )
+    parser.add_argument("--seed", default=icdSynthetic.seed, type=int, nargs="?",
+        help="Random seed (default=%d)"%icdSynthetic.seed )
+    parser.add_argument("--repeat", default=repeat, type=int, nargs="?",
+        help="Record the best of this many runs of each phase (default=%d)"%repeat )
+    parser.add_argument("--sample", default=sample, type=int, nargs="?",
+        help="Components run through parseModelFile at each size (default=%d)"%sample )
+    parser.add_argument("--jobs", default=icd.jobs, type=int, nargs="?",
+        help="Number of processes used to parse model files (default=%d)"%icd.jobs )
+    parser.add_argument("--fetchjobs", default=icd.fetch_jobs, type=int, nargs="?",
+        help="Number of database queries in flight at once (default=%d)"%icd.fetch_jobs )
+    parser.add_argument("--mongo", default=None, nargs="?",
+        help="Benchmark against the MongoDB server at this URI instead of mongomock")
+    parser.add_argument("--database", default=database, nargs="?",
+        help="Database used with --mongo, its collections are dropped (default=%s)"%database )
+    parser.add_argument("--workdir", default=None, nargs="?",
+        help="Keep the generated files here instead of a temporary directory")
+    parser.add_argument("--output", default=None, nargs="?",
+        help="Write the results to this JSON file")
+    parser.add_argument("--compare", default=None, nargs="?",
+        help="Compare with the results in this JSON file, exit 1 on regressions")
+    parser.add_argument("--threshold", default=threshold, type=float, nargs="?",
+        help="Slow-down ratio reported as a regression (default=%g)"%threshold )
+
+    args = parser.parse_args()
+
+    if args.mongo and args.database == 'icds':
+        sys.exit('Error: refusing to drop the icds database, use another --database')
+
+    params = {'subsystems':args.subsystems, 'events':args.events,
+        'attributes':args.attributes, 'commands':args.commands,
+        'fanout':args.fanout, 'seed':args.seed}
+    icd.report_unresolved = False
+    db = open_database(args.mongo,args.database)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='icdBenchmark-')
+
+    results = {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': 'mongodb' if args.mongo else 'mongomock',
+        'repeat': args.repeat,
+        'sample': args.sample,
+        'jobs': args.jobs,
+        'fetchjobs': args.fetchjobs,
+        'params': params,
+        'runs': []
+        }
+    try:
+        for size in [int(s) for s in args.sizes.split(',') if s]:
+            n = size*args.subsystems
+            print('%d components (%d per subsystem)' % (n,size))
+            sizedir = os.path.join(workdir,'size%d' % size)
+            shutil.rmtree(sizedir,ignore_errors=True)
+            phases = run_size(dict(params,components=size),db,sizedir,
+                args.repeat,args.sample,args.jobs,args.fetchjobs)
+            results['runs'].append({'components':n, 'per_subsystem':size,
+                'phases':phases})
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir,ignore_errors=True)
+
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results,baseline,args.threshold):
+            sys.exit(1)
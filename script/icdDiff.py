@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# ******************************************************************************
+# ****         D A O   I N S T R U M E N T A T I O N   G R O U P           *****
+# *
+# * (c) 2019                               (c) 2019
+# * National Research Council              Conseil national de recherches
+# * Ottawa, Canada, K1A 0R6                Ottawa, Canada, K1A 0R6
+# * All rights reserved                    Tous droits reserves
+# *
+# * NRC disclaims any warranties,          Le CNRC denie toute garantie
+# * expressed, implied, or statutory, of   enoncee, implicite ou legale, de
+# * any kind with respect to the soft-     quelque nature que se soit, concer-
+# * ware, including without limitation     nant le logiciel, y compris sans
+# * any warranty of merchantability or     restriction toute garantie de valeur
+# * fitness for a particular purpose.      marchande u de pertinence pour un
+# * NRC shall not be liable in any event   usage particulier. Le CNRC ne pourra
+# * for any damages, whether direct or     en aucun cas etre tenu responsable
+# * indirect, special or general, conse-   de tout dommage, direct ou indirect,
+# * quential or incidental, arising from   particulier ou general, accessoire
+# * the use of the software.               ou fortuit, resultant de l'utili-
+# *                                        sation du logiciel.
+# *
+# *****************************************************************************
+
+
+"""Compare the relationships in two snapshots of the TMT software ICD"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+from graphviz import Digraph
+
+import icdRelationships as icd
+
+# diff defaults
+jsonfile = None
+imagefile = None
+dotfile = None
+showplot = False
+cache_dir = icd.cache_dir
+jobs = icd.jobs
+
+addcol = 'darkgreen'    # added components/relationships
+removecol = 'red'       # removed components/relationships
+changecol = 'blue'      # components whose model changed
+othercol = 'dimgrey'    # unchanged components at the end of a changed edge
+
+# what a component declares, as keys of component_facts() entries
+fact_keys = ['publish.events', 'publish.telemetry', 'publish.alarms',
+    'subscribe.events', 'subscribe.telemetry', 'command.receive', 'command.send']
+
+# *****************************************************************************
+def component_facts():
+    """ Describe each component of the ICD currently loaded into the globals
+
+    Returns:
+        dict: prefix -> dict with the component 'type' and, for each of
+            fact_keys, the set of full item names
+    """
+    facts = {}
+    def entry(p):
+        if p not in facts:
+            facts[p] = {k:set() for k in fact_keys}
+            facts[p]['type'] = icd.component_types.get(p)
+        return facts[p]
+
+    for p in icd.all_prefixes:
+        entry(p)
+    for pubtype,items in icd.pub_dict.items():
+        for item,p in items.items():
+            entry(p)['publish.'+pubtype].add(item)
+    for p,items in icd.sub_dict.items():
+        for subtype,subscribed in items.items():
+            entry(p)['subscribe.'+subtype].update(subscribed)
+    for p,cmds in icd.cmd_comp_dict.items():
+        for cmdtype,names in cmds.items():
+            entry(p)['command.'+cmdtype].update(names)
+    return facts
+
+# *****************************************************************************
+def facts_hash(facts):
+    """ Content hash of one component's facts
+
+    Args:
+        facts (dict): one entry of component_facts()
+
+    Returns:
+        str: hex digest
+    """
+    h = hashlib.sha1(str(facts['type']).encode())
+    for k in fact_keys:
+        h.update(('\n'+k+':'+','.join(sorted(facts[k]))).encode())
+    return h.hexdigest()
+
+# *****************************************************************************
+class Snapshot:
+    """ Relationships of one ICD snapshot, indexed by component
+
+    Only plain dicts and sets are kept, so a snapshot stays valid after
+    the icdRelationships globals are cleared to load another one.
+
+    Attributes:
+        source (str): where the snapshot was read from
+        facts (dict): output of component_facts()
+        hashes (dict): prefix -> facts_hash()
+        publishers (dict): event -> publishing component
+        receivers (dict): command -> receiving component
+        subscribers (dict): event -> set of subscribing components
+        senders (dict): command -> set of sending components
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.facts = component_facts()
+        self.hashes = {p:facts_hash(f) for p,f in self.facts.items()}
+        self.publishers = dict(icd.pub_dict['events'])
+        self.receivers = dict(icd.cmd_dict)
+        self.subscribers = {}
+        self.senders = {}
+        for p,f in self.facts.items():
+            for ev in f['subscribe.events']:
+                self.subscribers.setdefault(ev,set()).add(p)
+            for cmd in f['command.send']:
+                self.senders.setdefault(cmd,set()).add(p)
+
+    def edges(self, p):
+        """ Relationships between a component and other components
+
+        Args:
+            p (str): component prefix
+
+        Returns:
+            set: (kind ('command' or 'event'), tail, head, item) tuples
+        """
+        f = self.facts.get(p)
+        if f is None:
+            return set()
+        edges = set()
+        for ev in f['subscribe.events']:
+            if ev in self.publishers:
+                edges.add(('event',self.publishers[ev],p,ev))
+        for ev in f['publish.events']:
+            for subscriber in self.subscribers.get(ev,()):
+                edges.add(('event',p,subscriber,ev))
+        for cmd in f['command.send']:
+            if cmd in self.receivers:
+                edges.add(('command',p,self.receivers[cmd],cmd))
+        for cmd in f['command.receive']:
+            for sender in self.senders.get(cmd,()):
+                edges.add(('command',sender,p,cmd))
+        return edges
+
+# *****************************************************************************
+def read_snapshot(source, mongo=None, cache_dir=None, refresh_cache=False,
+                  jobs=1, fetch_jobs=1):
+    """ Load an ICD snapshot
+
+    Args:
+        source (str): a model file tree, a snapshot cache file (*.pickle,
+            see icdRelationships.save_cache()), a mongodb:// URI including
+            the database name, or the name of a database on the mongo
+            server
+        mongo (str): MongoDB URI for database names (None for localhost)
+        cache_dir (str): directory for the snapshot cache (None to disable)
+        refresh_cache (bool): ignore any existing snapshot and rewrite it
+        jobs (int): number of model file parsers
+        fetch_jobs (int): number of database queries in flight at once
+
+    Returns:
+        Snapshot: the snapshot
+    """
+    icd.clear_database()
+    if os.path.isdir(source):
+        icd.read_modeldir(source,cache_dir,refresh_cache,jobs)
+    elif source.endswith('.pickle'):
+        with open(source,'rb') as f:
+            icd.restore(pickle.load(f)['snapshot'])
+    elif source.startswith(('mongodb://','mongodb+srv://')):
+        from pymongo.uri_parser import parse_uri
+        name = parse_uri(source)['database']
+        if not name:
+            raise Exception('No database name in '+source)
+        icd.read_database(cache_dir,refresh_cache,source,name,fetch_jobs)
+    else:
+        icd.read_database(cache_dir,refresh_cache,mongo,source,fetch_jobs)
+    return Snapshot(source)
+
+# *****************************************************************************
+def diff(old, new):
+    """ Differences between two snapshots
+
+    Only components whose content hash differs are compared. A
+    relationship exists when one component declares an item and another
+    refers to it, so it can only change if one of its ends changed.
+
+    Args:
+        old (Snapshot): earlier snapshot
+        new (Snapshot): later snapshot
+
+    Returns:
+        dict: report with the old and new sources, the number of
+            unchanged components, the added and removed components, the
+            type and item changes of each changed component, and the
+            added and removed relationships
+    """
+    added = sorted(new.facts.keys() - old.facts.keys())
+    removed = sorted(old.facts.keys() - new.facts.keys())
+    changed = sorted(p for p in old.facts.keys() & new.facts.keys()
+                     if old.hashes[p] != new.hashes[p])
+
+    changes = {}
+    for p in changed:
+        o,n = old.facts[p],new.facts[p]
+        c = {}
+        if o['type'] != n['type']:
+            c['type'] = [o['type'],n['type']]
+        for k in fact_keys:
+            if o[k] != n[k]:
+                c[k] = {'added':sorted(n[k]-o[k]), 'removed':sorted(o[k]-n[k])}
+        changes[p] = c
+
+    old_edges = set()
+    new_edges = set()
+    for p in added+removed+changed:
+        old_edges |= old.edges(p)
+        new_edges |= new.edges(p)
+
+    def edge_list(edges):
+        return [{'kind':kind, 'from':tail, 'to':head, 'item':item}
+                for kind,tail,head,item in sorted(edges)]
+
+    return {
+        'old': old.source,
+        'new': new.source,
+        'unchanged': len(old.facts)-len(removed)-len(changed),
+        'components': {
+            'added': [{'prefix':p, 'type':new.facts[p]['type']} for p in added],
+            'removed': [{'prefix':p, 'type':old.facts[p]['type']} for p in removed],
+            'changed': changes
+            },
+        'relationships': {
+            'added': edge_list(new_edges-old_edges),
+            'removed': edge_list(old_edges-new_edges)
+            }
+        }
+
+# *****************************************************************************
+def differences(report):
+    """ Number of differences in a report
+
+    Args:
+        report (dict): output of diff()
+
+    Returns:
+        int: components added, removed or changed plus relationships added
+            or removed
+    """
+    c = report['components']
+    r = report['relationships']
+    return len(c['added'])+len(c['removed'])+len(c['changed'])+\
+        len(r['added'])+len(r['removed'])
+
+# *****************************************************************************
+def format_report(report):
+    """ Human-readable form of a report
+
+    Args:
+        report (dict): output of diff()
+
+    Returns:
+        str: the report
+    """
+    c = report['components']
+    lines = ['--- %s' % report['old'], '+++ %s' % report['new'],
+        '%d components added, %d removed, %d changed, %d unchanged' %
+        (len(c['added']),len(c['removed']),len(c['changed']),report['unchanged'])]
+
+    if c['added'] or c['removed']:
+        lines.append('')
+        lines.append('Components:')
+        for comp in c['added']:
+            lines.append('+ %s (%s)' % (comp['prefix'],comp['type']))
+        for comp in c['removed']:
+            lines.append('- %s (%s)' % (comp['prefix'],comp['type']))
+
+    for p,changes in sorted(c['changed'].items()):
+        lines.append('')
+        lines.append('Component %s:' % p)
+        if 'type' in changes:
+            lines.append('  type %s -> %s' % tuple(changes['type']))
+        for k in fact_keys:
+            if k in changes:
+                for item in changes[k]['added']:
+                    lines.append('+ %-20s %s' % (k,item))
+                for item in changes[k]['removed']:
+                    lines.append('- %-20s %s' % (k,item))
+
+    for status,sign in (('added','+'),('removed','-')):
+        edges = report['relationships'][status]
+        if edges:
+            lines.append('')
+            lines.append('Relationships %s:' % status)
+            for e in edges:
+                lines.append('%s %-7s %s -> %s: %s' %
+                    (sign,e['kind'],e['from'],e['to'],e['item']))
+    return '\n'.join(lines)+'\n'
+
+# *****************************************************************************
+def make_dot(report, layout=icd.layout):
+    """ Graph of the changed components and relationships
+
+    Added components and relationships are drawn in addcol, removed ones
+    in removecol, and other changed components in changecol. Unchanged
+    components only appear at the end of a changed relationship. Command
+    edges are solid and event edges dashed, with one edge per pair of
+    components, kind and status, labelled with the items.
+
+    Args:
+        report (dict): output of diff()
+        layout (str): graphviz layout engine
+
+    Returns:
+        Digraph: the graph
+    """
+    c = report['components']
+    colours = {}
+    for comp in c['added']:
+        colours[comp['prefix']] = addcol
+    for comp in c['removed']:
+        colours[comp['prefix']] = removecol
+    for p in c['changed']:
+        colours[p] = changecol
+
+    edges = {}
+    for status,col in (('added',addcol),('removed',removecol)):
+        for e in report['relationships'][status]:
+            key = (e['from'],e['to'],e['kind'],col)
+            edges.setdefault(key,[]).append(e['item'].split('.')[-1])
+            for p in (e['from'],e['to']):
+                colours.setdefault(p,othercol)
+
+    dot = Digraph()
+    dot.graph_attr['layout'] = layout
+    dot.graph_attr['overlap'] = icd.overlap
+    dot.graph_attr['label'] = '%s -> %s' % (report['old'],report['new'])
+    dot.node_attr['fontsize'] = icd.node_fontsize
+    dot.edge_attr['fontsize'] = icd.edge_fontsize
+    for p,col in sorted(colours.items()):
+        dot.node(p,p,color=col,fontcolor=col,
+            style='dashed' if col == othercol else 'bold')
+    for (tail,head,kind,col),items in sorted(edges.items()):
+        dot.edge(tail,head,label='\n'.join(sorted(items)),color=col,
+            fontcolor=col,style='solid' if kind == 'command' else 'dashed')
+    return dot
+
+# *****************************************************************************
+# Entrypoint
+
+if __name__ == '__main__':
+
+    # parse the command line
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description="Report the commands, events and relationships added, removed or rewired between two ICD snapshots",
+        epilog="""A snapshot is a model file tree, a snapshot cache file (*.pickle), a
+mongodb:// URI including the database name, or the name of a database on
+the --mongo server. The exit status is 0 if the snapshots are equivalent,
+1 if they differ.
+
+example:
+  icdDiff.py ICD-Model-Files-1.0 ICD-Model-Files-1.1 --jsonfile diff.json \\
+      --imagefile diff
+  icdDiff.py icds_release_1 icds --mongo mongodb://icdserver
+""")
+    parser.add_argument("old", help="Earlier snapshot")
+    parser.add_argument("new", help="Later snapshot")
+    parser.add_argument("--jsonfile", default=jsonfile, nargs="?",
+        help="Also write the report as JSON to this file, - for JSON on stdout only (default=%s)"%str(jsonfile) )
+    parser.add_argument("--imagefile", default=imagefile, nargs="?",
+        help="Plot the differences to this image file (default=%s)"%str(imagefile) )
+    parser.add_argument("--dotfile", default=dotfile, nargs="?",
+        help="Write the dot source of the plot to this file (default=%s)"%str(dotfile) )
+    parser.add_argument("--showplot", default=str(showplot), nargs="?",
+        help="Display the plot of the differences (default=%s)"%str(showplot) )
+    parser.add_argument('--layout', default=icd.layout, choices=icd.possible_layouts, nargs="?",
+        help="Dot layout engine (default=%s)"%icd.layout)
+    parser.add_argument("--mongo", default=icd.mongo_uri, nargs="?",
+        help="URI of the MongoDB server for snapshots given as database names (default=%s)"%str(icd.mongo_uri) )
+    parser.add_argument("--fetchjobs", default=icd.fetch_jobs, type=int, nargs="?",
+        help="Number of database queries in flight at once (default=%d)"%icd.fetch_jobs )
+    parser.add_argument("--jobs", default=jobs, type=int, nargs="?",
+        help="Number of model file parsers run at once (default=%d)"%jobs )
+    parser.add_argument("--cache-dir", default=cache_dir, nargs="?",
+        help="Directory for the database snapshot cache, empty to disable (default=%s)"%cache_dir )
+    parser.add_argument("--refresh-cache", action="store_true",
+        help="Ignore and rewrite the database snapshot cache")
+
+    args = parser.parse_args()
+    showplot = icd.str2bool(args.showplot)
+
+    # unresolved references show up as differences instead
+    icd.report_unresolved = False
+
+    old = read_snapshot(args.old,args.mongo,args.cache_dir,args.refresh_cache,
+        args.jobs,args.fetchjobs)
+    new = read_snapshot(args.new,args.mongo,args.cache_dir,args.refresh_cache,
+        args.jobs,args.fetchjobs)
+    report = diff(old,new)
+
+    if args.jsonfile == '-':
+        json.dump(report,sys.stdout,indent=1)
+        print()
+    else:
+        sys.stdout.write(format_report(report))
+        if args.jsonfile:
+            with open(args.jsonfile,'w') as f:
+                json.dump(report,f,indent=1)
+
+    if showplot or args.imagefile or args.dotfile:
+        icd.render(make_dot(report,args.layout),args.imagefile,args.dotfile,showplot)
+
+    sys.exit(1 if differences(report) else 0)
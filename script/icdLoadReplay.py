@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+# ******************************************************************************
+# ****         D A O   I N S T R U M E N T A T I O N   G R O U P           *****
+# *
+# * (c) 2019                               (c) 2019
+# * National Research Council              Conseil national de recherches
+# * Ottawa, Canada, K1A 0R6                Ottawa, Canada, K1A 0R6
+# * All rights reserved                    Tous droits reserves
+# *
+# * NRC disclaims any warranties,          Le CNRC denie toute garantie
+# * expressed, implied, or statutory, of   enoncee, implicite ou legale, de
+# * any kind with respect to the soft-     quelque nature que se soit, concer-
+# * ware, including without limitation     nant le logiciel, y compris sans
+# * any warranty of merchantability or     restriction toute garantie de valeur
+# * fitness for a particular purpose.      marchande u de pertinence pour un
+# * NRC shall not be liable in any event   usage particulier. Le CNRC ne pourra
+# * for any damages, whether direct or     en aucun cas etre tenu responsable
+# * indirect, special or general, conse-   de tout dommage, direct ou indirect,
+# * quential or incidental, arising from   particulier ou general, accessoire
+# * the use of the software.               ou fortuit, resultant de l'utili-
+# *                                        sation du logiciel.
+# *
+# *****************************************************************************
+
+
+"""Replay the declared event load of an ICD against a local Redis server
+
+The CSW event service is a Redis server (see CSW_Services_QuickStart.md):
+each event is PUBLISHed on a channel named after its full name
+(prefix.event), and also SET under that key so that the latest value can
+be read. This tool publishes every selected event at its declared rate,
+with a payload of the declared attribute shapes, while every component
+that subscribes to it listens on its channel. It then reports, per event,
+the achieved publish rate, the rate each subscriber received it at, the
+messages dropped and the publish-to-receive latency percentiles.
+
+Publishers and subscribers run as asyncio tasks, split over a pool of
+processes. Redis is spoken to directly (RESP), so no client library is
+needed.
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import json
+import sys
+import time
+
+import icdBandwidth
+import icdRelationships as icd
+
+# replay defaults
+host = '127.0.0.1'
+port = 6379             # event_master_port in CSW_Services_QuickStart.md
+duration = 10.0         # seconds of publishing
+warmup = 1.0            # seconds for subscribers to subscribe before publishing
+drain = 1.0             # seconds subscribers keep listening after publishing
+processes = 1
+setvalue = True         # also SET each event, as the event service does
+
+# *****************************************************************************
+def sample_value(elem):
+    """ A value of the shape described by an attribute or array item model
+
+    Args:
+        elem (dict): attribute/item model (see icdBandwidth.value_size())
+
+    Returns:
+        value that JSON can encode
+    """
+    if 'enum' in elem:
+        return str(elem['enum'][0]) if elem['enum'] else ''
+    t = elem.get('type',None)
+    if t == 'array':
+        value = sample_value(elem.get('items',None) or {})
+        for d in reversed(list(elem.get('dimensions',None) or [1])):
+            value = [value]*int(d)
+        return value
+    if t == 'struct' or 'attributes' in elem:
+        return {str(a.get('name','')):sample_value(a) for a in elem.get('attributes',None) or ()}
+    if t == 'string':
+        return 'x'*int(elem.get('maxLength',icdBandwidth.string_size))
+    if t == 'boolean':
+        return False
+    if t in ('byte','short','integer','int','long'):
+        return 0
+    if t in ('float','double'):
+        return 0.5
+    return 'x'*icdBandwidth.type_sizes.get(t,8)
+
+# *****************************************************************************
+def sample_payload(event):
+    """ Payload of an event, without the replay header
+
+    Args:
+        event (dict): event model from a publish model
+
+    Returns:
+        bytes: JSON object of attribute name -> sample value
+    """
+    values = {str(a.get('name','')):sample_value(a)
+              for a in event.get('attributes',None) or ()}
+    return json.dumps(values,separators=(',',':')).encode()
+
+# *****************************************************************************
+def replay_plan(collections, docs, components, subsystems):
+    """ Events to publish and subscriptions to listen to
+
+    Must be called after the docs have been parsed into the
+    icdRelationships globals.
+
+    Args:
+        collections (dict): output of icdRelationships.classify_collections()
+        docs (dict): collection name -> model document
+        components (iterable): component prefixes whose events are published
+        subsystems (iterable): subsystems whose events are published ('all'
+            for every subsystem)
+
+    Returns:
+        events (dict): full event name -> {rate, payload}, for the events
+            with a rate
+        subscribers (dict): subscriber prefix -> {full event name:
+            requiredRate or None}, for the events above
+        norate (list): full names of selected events with no rate
+    """
+    publishers = icd.select_primaries(components,subsystems,())
+    events = {}
+    norate = []
+    # the projected documents of the database do not hold the subsystem
+    # and component, so they are taken from the collection names
+    for name,subsystem,component in collections['publish']:
+        if name not in docs:
+            continue
+        p,failed = icd.prefix(subsystem,component)
+        if failed or p not in publishers:
+            continue
+        for event in docs[name].get('publish',{}).get('events',()):
+            ev = p+'.'+event['name']
+            rate = icdBandwidth.event_rate(event)
+            if rate is None or rate <= 0:
+                norate.append(ev)
+            else:
+                events[ev] = {'rate':rate, 'payload':sample_payload(event)}
+
+    subscribers = {}
+    for p,items in icd.sub_dict.items():
+        for ev in items.get('events',()):
+            if ev in events:
+                subscribers.setdefault(p,{})[ev] = icd.required_rates.get(p,{}).get(ev)
+    return events,subscribers,norate
+
+# *****************************************************************************
+def command(*args):
+    """ Encode a Redis command
+
+    Args:
+        args (str or bytes): command name and arguments
+
+    Returns:
+        bytes: the command in RESP
+    """
+    out = [b'*%d\r\n' % len(args)]
+    for a in args:
+        if isinstance(a,str):
+            a = a.encode()
+        out.append(b'$%d\r\n%s\r\n' % (len(a),a))
+    return b''.join(out)
+
+# *****************************************************************************
+async def read_reply(reader):
+    """ Read one Redis reply
+
+    Args:
+        reader (StreamReader): connection to the server
+
+    Returns:
+        bytes, int or list: the reply (an Exception instance for errors)
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError('Redis server closed the connection')
+    kind,rest = line[:1],line[1:-2]
+    if kind == b'+':
+        return rest
+    if kind == b'-':
+        return Exception(rest.decode())
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        n = int(rest)
+        if n < 0:
+            return None
+        return (await reader.readexactly(n+2))[:-2]
+    if kind == b'*':
+        n = int(rest)
+        return None if n < 0 else [await read_reply(reader) for _ in range(n)]
+    raise ConnectionError('Unexpected reply from Redis server: %r' % line)
+
+# *****************************************************************************
+async def publish_events(events, host, port, start, end, setvalue):
+    """ Publish events at their rates over one connection
+
+    Each message starts with "<sequence number> <time.time_ns()> " so that
+    subscribers can count drops and measure latency.
+
+    Args:
+        events (dict): full event name -> {rate, payload}
+        host (str): Redis host
+        port (int): Redis port
+        start (float): time.time() to start publishing at
+        end (float): time.time() to stop publishing at
+        setvalue (bool): also SET each event
+
+    Returns:
+        dict: full event name -> {sent, late (messages sent more than a
+            period behind schedule), errors}
+    """
+    reader,writer = await asyncio.open_connection(host,port)
+    stats = {ev:{'sent':0, 'late':0, 'errors':0} for ev in events}
+    replies = [0]
+    errors = []
+
+    async def read_replies():
+        # replies come back in order, and are only checked for errors
+        while True:
+            r = await read_reply(reader)
+            replies[0] += 1
+            if isinstance(r,Exception):
+                errors.append(r)
+
+    async def publish(ev, rate, payload):
+        s = stats[ev]
+        period = 1.0/rate
+        seq = 0
+        while True:
+            due = start+seq*period
+            if due >= end:
+                break
+            delay = due-time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > period:
+                s['late'] += 1
+            message = b'%d %d %s' % (seq,time.time_ns(),payload)
+            writer.write(command('PUBLISH',ev,message))
+            if setvalue:
+                writer.write(command('SET',ev,message))
+            await writer.drain()
+            s['sent'] += 1
+            seq += 1
+
+    reading = asyncio.ensure_future(read_replies())
+    await asyncio.gather(*(publish(ev,e['rate'],e['payload']) for ev,e in events.items()))
+    expected = sum(s['sent'] for s in stats.values())*(2 if setvalue else 1)
+    while replies[0] < expected and not reading.done():
+        await asyncio.sleep(0.01)
+    reading.cancel()
+    writer.close()
+    if errors:
+        print('Error: Redis replied',errors[0],'(%d errors)' % len(errors))
+    return stats
+
+# *****************************************************************************
+async def subscribe_events(subscriber, events, host, port, end):
+    """ Receive events as one subscriber until a deadline
+
+    Args:
+        subscriber (str): subscriber prefix
+        events (iterable): full event names
+        host (str): Redis host
+        port (int): Redis port
+        end (float): time.time() to stop listening at
+
+    Returns:
+        dict: full event name -> {received, gaps (messages missed between
+            those received), latencies (seconds)}
+    """
+    reader,writer = await asyncio.open_connection(host,port)
+    events = sorted(events)
+    writer.write(command('SUBSCRIBE',*events))
+    await writer.drain()
+    stats = {ev:{'received':0, 'gaps':0, 'latencies':[]} for ev in events}
+    last = {}
+    while True:
+        timeout = end-time.time()
+        if timeout <= 0:
+            break
+        try:
+            r = await asyncio.wait_for(read_reply(reader),timeout)
+        except asyncio.TimeoutError:
+            break
+        if not isinstance(r,list) or r[0] != b'message':
+            continue
+        now = time.time_ns()
+        ev = r[1].decode()
+        seq,sent,_ = r[2].split(b' ',2)
+        seq = int(seq)
+        s = stats[ev]
+        s['received'] += 1
+        s['latencies'].append((now-int(sent))/1e9)
+        if ev in last and seq > last[ev]+1:
+            s['gaps'] += seq-last[ev]-1
+        last[ev] = seq
+    writer.close()
+    return stats
+
+# *****************************************************************************
+def run_group(events, subscribers, host, port, start, end, setvalue):
+    """ Run some publishers and subscribers in this process
+
+    Args:
+        events (dict): events to publish (see replay_plan())
+        subscribers (dict): subscriptions to listen to (see replay_plan())
+        host (str): Redis host
+        port (int): Redis port
+        start (float): time.time() to start publishing at
+        end (float): time.time() to stop publishing at
+        setvalue (bool): also SET each event
+
+    Returns:
+        published (dict): output of publish_events()
+        received (dict): subscriber -> output of subscribe_events()
+    """
+    async def main():
+        subs = [subscribe_events(p,evs,host,port,end+drain)
+                for p,evs in sorted(subscribers.items())]
+        pubs = [publish_events(events,host,port,start,end,setvalue)] if events else []
+        results = await asyncio.gather(*(pubs+subs))
+        published = results[0] if events else {}
+        received = dict(zip(sorted(subscribers),results[len(pubs):]))
+        return published,received
+    return asyncio.run(main())
+
+# *****************************************************************************
+def percentile(values, q):
+    """ Value below which a fraction q of the values lie
+
+    Args:
+        values (list): sorted values
+        q (float): 0 to 1
+
+    Returns:
+        float: the percentile (None if there are no values)
+    """
+    if not values:
+        return None
+    return values[min(len(values)-1,int(q*len(values)))]
+
+# *****************************************************************************
+def replay(events, subscribers, host=host, port=port, duration=duration,
+           processes=processes, setvalue=setvalue):
+    """ Publish and subscribe to events and measure what happened
+
+    Publishers and subscribers are dealt out to processes groups, each
+    running its own event loop and connections.
+
+    Args:
+        events (dict): events to publish (see replay_plan())
+        subscribers (dict): subscriptions to listen to (see replay_plan())
+        host (str): Redis host
+        port (int): Redis port
+        duration (float): seconds of publishing
+        processes (int): number of processes
+        setvalue (bool): also SET each event
+
+    Returns:
+        dict: full event name -> {rate (declared), achieved (Hz), bytes
+            (payload), sent, late, subscribers: {prefix -> {required,
+            received (Hz), dropped, p50, p95, p99 (latency in seconds)}}}
+    """
+    processes = max(1,processes)
+    groups = [({},{}) for _ in range(processes)]
+    for i,ev in enumerate(sorted(events)):
+        groups[i % processes][0][ev] = events[ev]
+    for i,p in enumerate(sorted(subscribers)):
+        groups[(i+len(events)) % processes][1][p] = subscribers[p]
+    groups = [g for g in groups if g[0] or g[1]]
+
+    start = time.time()+warmup+0.5*(len(groups) > 1)
+    end = start+duration
+    args = [(g[0],g[1],host,port,start,end,setvalue) for g in groups]
+    if len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=len(groups)) as pool:
+            results = list(pool.map(run_group,*zip(*args)))
+    else:
+        results = [run_group(*a) for a in args]
+
+    published = {}
+    received = {}
+    for pub,rec in results:
+        published.update(pub)
+        received.update(rec)
+
+    report = {}
+    for ev,e in sorted(events.items()):
+        s = published.get(ev,{'sent':0,'late':0})
+        r = report[ev] = {'rate':e['rate'], 'achieved':s['sent']/duration,
+            'bytes':len(e['payload']), 'sent':s['sent'], 'late':s['late'],
+            'subscribers':{}}
+        for p,evs in sorted(subscribers.items()):
+            if ev not in evs:
+                continue
+            got = received.get(p,{}).get(ev,{'received':0,'latencies':[]})
+            latencies = sorted(got['latencies'])
+            r['subscribers'][p] = {'required':evs[ev],
+                'received':got['received']/duration,
+                'dropped':max(0,s['sent']-got['received']),
+                'p50':percentile(latencies,0.5),
+                'p95':percentile(latencies,0.95),
+                'p99':percentile(latencies,0.99)}
+    return report
+
+# *****************************************************************************
+def format_report(report, norate=()):
+    """ Human-readable form of a replay report
+
+    Args:
+        report (dict): output of replay()
+        norate (iterable): events that could not be replayed
+
+    Returns:
+        str: the report as a table
+    """
+    def ms(t):
+        return '-' if t is None else '%.2f' % (t*1000)
+
+    # headers, event rows and subscriber rows share these column widths
+    widths = (44,8,8,9,11,8,8)
+    def row(cells, flag=''):
+        line = '%-*s' % (widths[0],cells[0])
+        for width,cell in zip(widths[1:],cells[1:]):
+            line += ' %*s' % (width,cell)
+        return line+' '+flag if flag else line
+
+    lines = [row(('event / subscriber','rate','achieved','payload','bandwidth','late')),
+        row(('','required','received','dropped','p50 ms','p95 ms','p99 ms'))]
+    for ev,r in report.items():
+        lines.append(row((ev,'%g' % r['rate'],'%.1f' % r['achieved'],
+            icdBandwidth.format_bytes(r['bytes']),
+            icdBandwidth.format_bytes(r['bytes']*r['achieved'],'/s'),'%d' % r['late'])))
+        for p,s in r['subscribers'].items():
+            # a subscriber requiring more than the declared rate can only
+            # expect the declared rate
+            expected = icdBandwidth.received_rate(r['rate'],s['required'])
+            short = s['required'] is not None and s['received'] < 0.95*expected
+            lines.append(row(('  '+p,
+                '-' if s['required'] is None else '%g' % s['required'],
+                '%.1f' % s['received'],'%d' % s['dropped'],
+                ms(s['p50']),ms(s['p95']),ms(s['p99'])),
+                'SHORT' if short else ''))
+    for ev in norate:
+        lines.append('%-44s no maxRate/minRate, not published' % ev)
+    return '\n'.join(lines)+'\n'
+
+# *****************************************************************************
+# Entrypoint
+
+if __name__ == '__main__':
+
+    # parse the command line
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description="Replay the declared event load of an ICD against a local Redis server",
+        epilog="""Only use a Redis server dedicated to testing: the events are really
+published and SET there.
+
+example:
+  redis-server --port 6379 &
+  icdLoadReplay.py --subsystems nfiraos --modeldir ICD-Model-Files --duration 30
+""")
+    parser.add_argument("--components", type=str, nargs="?",
+        help="Comma-separated list of components whose events are published")
+    parser.add_argument("--subsystems", type=str, nargs="?",
+        help="Comma-separated list of subsystems whose events are published ('all' for all)")
+    parser.add_argument("--host", default=host, nargs="?",
+        help="Redis host (default=%s)"%host )
+    parser.add_argument("--port", default=port, type=int, nargs="?",
+        help="Redis port (default=%d)"%port )
+    parser.add_argument("--duration", default=duration, type=float, nargs="?",
+        help="Seconds of publishing (default=%g)"%duration )
+    parser.add_argument("--processes", default=processes, type=int, nargs="?",
+        help="Number of processes the publishers and subscribers are spread over (default=%d)"%processes )
+    parser.add_argument("--setvalue", default=str(setvalue), nargs="?",
+        help="Also SET each event, as the event service does (default=%s)"%str(setvalue) )
+    parser.add_argument("--jsonfile", default=None, nargs="?",
+        help="Also write the report as JSON to this file")
+    parser.add_argument("--mongo", default=icd.mongo_uri, nargs="?",
+        help="URI of the MongoDB server holding the ICD (default=%s)"%str(icd.mongo_uri) )
+    parser.add_argument("--database", default=icd.database, nargs="?",
+        help="Name of the ICD database (default=%s)"%icd.database )
+    parser.add_argument("--fetchjobs", default=icd.fetch_jobs, type=int, nargs="?",
+        help="Number of database queries in flight at once (default=%d)"%icd.fetch_jobs )
+    parser.add_argument("--modeldir", default=None, nargs="?",
+        help="Read a model file tree instead of the icds database")
+    parser.add_argument("--jobs", default=icd.jobs, type=int, nargs="?",
+        help="Number of model file parsers run at once (default=%d)"%icd.jobs )
+
+    args = parser.parse_args()
+
+    components = set(args.components.split(',')) if args.components else set()
+    subsystems = set(args.subsystems.split(',')) if args.subsystems else set()
+    if not components and not subsystems:
+        print("Need to specify at least --components or --subsystems. For help:\n"+\
+            "  icdLoadReplay.py -h")
+        sys.exit(0)
+
+    # the full event models are needed for the payloads, so they are
+    # read directly rather than through the snapshot cache
+    if args.modeldir:
+        collections,docs = icd.load_model_files(icd.find_model_files(args.modeldir),args.jobs)
+    else:
+        db = icd.connect(args.mongo)[args.database]
+        collections = icd.classify_collections(db.list_collection_names())
+        docs = icd.fetch_models(db,collections,args.fetchjobs)
+    icd.parse_models(collections,docs)
+
+    events,subscribers,norate = replay_plan(collections,docs,components,subsystems)
+    if not events:
+        print('No events with a rate to publish')
+        sys.exit(1)
+    print('Publishing %d events to %d subscribers for %g s...' %
+        (len(events),len(subscribers),args.duration))
+    report = replay(events,subscribers,args.host,args.port,args.duration,
+        args.processes,icd.str2bool(args.setvalue))
+
+    sys.stdout.write(format_report(report,norate))
+    if args.jsonfile:
+        with open(args.jsonfile,'w') as f:
+            json.dump(report,f,indent=1)
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# ******************************************************************************
+# ****         D A O   I N S T R U M E N T A T I O N   G R O U P           *****
+# *
+# * (c) 2019                               (c) 2019
+# * National Research Council              Conseil national de recherches
+# * Ottawa, Canada, K1A 0R6                Ottawa, Canada, K1A 0R6
+# * All rights reserved                    Tous droits reserves
+# *
+# * NRC disclaims any warranties,          Le CNRC denie toute garantie
+# * expressed, implied, or statutory, of   enoncee, implicite ou legale, de
+# * any kind with respect to the soft-     quelque nature que se soit, concer-
+# * ware, including without limitation     nant le logiciel, y compris sans
+# * any warranty of merchantability or     restriction toute garantie de valeur
+# * fitness for a particular purpose.      marchande u de pertinence pour un
+# * NRC shall not be liable in any event   usage particulier. Le CNRC ne pourra
+# * for any damages, whether direct or     en aucun cas etre tenu responsable
+# * indirect, special or general, conse-   de tout dommage, direct ou indirect,
+# * quential or incidental, arising from   particulier ou general, accessoire
+# * the use of the software.               ou fortuit, resultant de l'utili-
+# *                                        sation du logiciel.
+# *
+# *****************************************************************************
+
+"""Phase timing and memory instrumentation for the ICD tools
+
+Profiling is switched on with a tool's --profile option or the NIC_PROFILE
+environment variable, which take the values below. icdRelationships.py
+takes --profile true/false like its other boolean options, and leaves it
+to NIC_PROFILE to send the report elsewhere.
+
+    true, 1, text or -   human-readable report on stderr
+    json                 JSON report on stderr
+    FILE                 report appended to FILE (one JSON object per line
+                         if FILE ends in .json or .jsonl, otherwise text),
+                         so that every tool run by a build can share one
+    false, 0 or empty    no profiling
+
+A report lists, for each phase, the number of calls, the wall time, the
+number of items processed and the peak RSS of the process at the end of
+the phase, and is written when the tool exits.
+
+Tools mark their phases with phase() or instrument(). When profiling is
+disabled phase() returns a shared do-nothing context manager and
+instrument() leaves the functions untouched, so nothing is measured.
+"""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    # not available on Windows: peak RSS is not reported
+    resource = None
+
+enabled = False    # set by configure()
+target = None      # where the report goes (see module docstring)
+tool = None        # name of the profiled tool
+started = None     # time.perf_counter() when profiling was enabled
+phases = {}        # phase name->Phase, in order of first use
+lock = threading.Lock()
+local = threading.local()  # .stack: phases running in this thread
+
+# *****************************************************************************
+def peak_rss(who=None):
+    """ Peak resident set size so far
+
+    Args:
+        who (int): resource.RUSAGE_SELF (default) or RUSAGE_CHILDREN
+
+    Returns:
+        int: peak RSS in KiB (None if it can't be measured)
+    """
+    if resource is None:
+        return None
+    if who is None:
+        who = resource.RUSAGE_SELF
+    rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024    # bytes rather than KiB
+    return rss
+
+# *****************************************************************************
+class Phase:
+    """ Accumulated measurements of one phase
+
+    Attributes:
+        name (str): phase name
+        calls (int): number of times the phase ran
+        seconds (float): total wall time
+        items (int): number of items processed (see items())
+        peak_rss (int): largest peak RSS (KiB) seen at the end of the phase
+    """
+    __slots__ = ('name','calls','seconds','items','peak_rss')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0
+        self.peak_rss = None
+
+    def asdict(self):
+        return {'name':self.name, 'calls':self.calls,
+            'seconds':round(self.seconds,6), 'items':self.items,
+            'peak_rss_kib':self.peak_rss}
+
+# *****************************************************************************
+class Timer:
+    """ Context manager timing one run of a phase """
+    __slots__ = ('phase','began')
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        if not hasattr(local,'stack'):
+            local.stack = []
+        local.stack.append(self.phase)
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.began
+        rss = peak_rss()
+        # normally the innermost phase, unless a run was abandoned without
+        # calling stop()
+        i = len(local.stack)-1-local.stack[::-1].index(self.phase)
+        del local.stack[i]
+        with lock:
+            self.phase.calls += 1
+            self.phase.seconds += seconds
+            if rss is not None and (self.phase.peak_rss is None or
+                                    rss > self.phase.peak_rss):
+                self.phase.peak_rss = rss
+        return False
+
+    def start(self):
+        """ Start timing, for code that can't be wrapped in a with block
+
+        Returns:
+            Timer: self, whose stop() ends the run
+        """
+        return self.__enter__()
+
+    def stop(self):
+        """ End a run begun with start() """
+        self.__exit__(None,None,None)
+
+    def add(self, n):
+        """ Count items processed by this run of the phase
+
+        Args:
+            n (int): number of items
+        """
+        with lock:
+            self.phase.items += n
+
+# *****************************************************************************
+class NullTimer:
+    """ Context manager standing in for Timer when profiling is disabled """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def add(self, n):
+        pass
+
+null_timer = NullTimer()
+
+# *****************************************************************************
+def phase(name):
+    """ Time a block of code as a phase
+
+        with icdProfile.phase('render') as p:
+            ...
+            p.add(len(nodes))
+
+    Args:
+        name (str): phase name
+
+    Returns:
+        Timer: context manager (null_timer when profiling is disabled)
+    """
+    if not enabled:
+        return null_timer
+    with lock:
+        if name not in phases:
+            phases[name] = Phase(name)
+        p = phases[name]
+    return Timer(p)
+
+# *****************************************************************************
+def items(n):
+    """ Count items processed by the innermost phase running in this thread
+
+    Args:
+        n (int): number of items
+    """
+    if enabled and getattr(local,'stack',None):
+        with lock:
+            local.stack[-1].items += n
+
+# *****************************************************************************
+def profiled(func, name=None, count=None):
+    """ Wrap a function so that each call is timed as a phase
+
+    Args:
+        func (callable): function to wrap
+        name (str): phase name (default func.__name__)
+        count (callable): called with the function's return value to give
+            the number of items it processed (None to count nothing)
+
+    Returns:
+        callable: the wrapper
+    """
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with phase(name) as p:
+            result = func(*args, **kwargs)
+            if count is not None:
+                p.add(count(result))
+        return result
+    return wrapper
+
+# *****************************************************************************
+def instrument(namespace, names, counts=None):
+    """ Replace functions in a module namespace with profiled() wrappers
+
+    Nothing is replaced unless profiling is enabled, so the functions cost
+    nothing extra otherwise. Must be called after configure().
+
+    Args:
+        namespace (dict): module namespace, e.g. globals()
+        names (iterable): names of the functions, also used as phase names
+        counts (dict): function name -> count argument of profiled()
+    """
+    if not enabled:
+        return
+    counts = counts or {}
+    for name in names:
+        namespace[name] = profiled(namespace[name],name,counts.get(name))
+
+# *****************************************************************************
+def configure(value=None, name=None, worker=False):
+    """ Enable profiling if requested
+
+    Args:
+        value (str): --profile value (see module docstring); if None the
+            NIC_PROFILE environment variable is used
+        name (str): tool name for the report (default the script name)
+        worker (bool): measure only, in a pool worker whose measurements
+            are passed back to the parent with collect() and merge()
+
+    Returns:
+        bool: True if profiling is enabled
+    """
+    global enabled, target, tool, started
+    if value is None:
+        value = os.environ.get('NIC_PROFILE','')
+    if value.lower() in ('','0','false','n'):
+        return enabled
+    if value.lower() in ('1','true','y','-'):
+        value = 'text'
+    if not enabled and not worker:
+        atexit.register(write_report)
+    enabled = True
+    target = value
+    tool = name or os.path.basename(sys.argv[0])
+    started = time.perf_counter()
+    return enabled
+
+# *****************************************************************************
+def strip_option(argv):
+    """ Remove a --profile[=VALUE] option from a command line
+
+    For tools that parse sys.argv by position.
+
+    Args:
+        argv (list): command line, modified in place
+
+    Returns:
+        str: the option value ('1' if none was given), None if absent
+    """
+    for i,arg in enumerate(argv):
+        if arg == '--profile' or arg.startswith('--profile='):
+            del argv[i]
+            return arg.partition('=')[2] or '1'
+    return None
+
+# *****************************************************************************
+def report():
+    """ Measurements so far
+
+    Returns:
+        dict: tool, pid, seconds (since profiling was enabled), peak RSS
+            of the process and its children (KiB), and the list of phases
+    """
+    with lock:
+        return {
+            'tool': tool,
+            'pid': os.getpid(),
+            'argv': sys.argv[1:],
+            'seconds': round(time.perf_counter()-started,6),
+            'peak_rss_kib': peak_rss(),
+            'children_peak_rss_kib': peak_rss(resource.RUSAGE_CHILDREN)
+                if resource else None,
+            'phases': [p.asdict() for p in phases.values()]
+            }
+
+# *****************************************************************************
+def collect():
+    """ Phases measured so far, which are then forgotten
+
+    Pool workers exit without running atexit handlers, so a worker returns
+    its measurements with its results for the parent to merge(). Calling
+    it before a job also drops anything inherited from a forked parent.
+
+    Returns:
+        list: Phase.asdict() of each phase
+    """
+    with lock:
+        measured = [p.asdict() for p in phases.values()]
+        phases.clear()
+    return measured
+
+# *****************************************************************************
+def merge(measured):
+    """ Add measurements from collect() in another process to the phases
+
+    The times of workers running in parallel add up, so a phase can take
+    longer in total than the phase that ran the pool.
+
+    Args:
+        measured (list): Phase.asdict() of each phase
+    """
+    if not enabled:
+        return
+    with lock:
+        for m in measured:
+            if m['name'] not in phases:
+                phases[m['name']] = Phase(m['name'])
+            p = phases[m['name']]
+            p.calls += m['calls']
+            p.seconds += m['seconds']
+            p.items += m['items']
+            rss = m['peak_rss_kib']
+            if rss is not None and (p.peak_rss is None or rss > p.peak_rss):
+                p.peak_rss = rss
+
+# *****************************************************************************
+def format_report(r):
+    """ Human-readable form of a report
+
+    Args:
+        r (dict): output of report()
+
+    Returns:
+        str: the report as a table
+    """
+    def mib(kib):
+        return '-' if kib is None else '%.1f' % (kib/1024)
+
+    lines = ['profile: %s %s: %.3f s, peak RSS %s MiB (children %s MiB)' %
+        (r['tool'],' '.join(r['argv']),r['seconds'],mib(r['peak_rss_kib']),
+         mib(r['children_peak_rss_kib']))]
+    lines.append('  %-24s %8s %10s %10s %10s' %
+        ('phase','calls','wall (s)','items','RSS (MiB)'))
+    for p in r['phases']:
+        lines.append('  %-24s %8d %10.3f %10d %10s' % (p['name'],p['calls'],
+            p['seconds'],p['items'],mib(p['peak_rss_kib'])))
+    return '\n'.join(lines)+'\n'
+
+# *****************************************************************************
+def write_report():
+    """ Write the report to wherever configure() was asked to send it """
+    if not enabled:
+        return
+    r = report()
+    if target == 'text':
+        sys.stderr.write(format_report(r))
+    elif target == 'json':
+        sys.stderr.write(json.dumps(r)+'\n')
+    else:
+        with open(target,'a') as f:
+            if target.endswith(('.json','.jsonl')):
+                f.write(json.dumps(r)+'\n')
+            else:
+                f.write(format_report(r))
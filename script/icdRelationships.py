@@ -25,10 +25,22 @@
 """Generate diagram of relationships stored in TMT software ICD database"""
 
 import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from graphviz import Digraph
+import json
+import math
+import hashlib
+import html
+import icdBandwidth
+import icdProfile
+import os
+import pickle
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 import re
 import sys
+import xml.etree.ElementTree as ET
 
 # plotting defaults
 subsystem_colours = {
@@ -45,6 +57,8 @@ noevcol = 'red'          # missing event colour
 
 possible_layouts = ['dot','fdp','sfdp','twopi','neato','circo','patchwork']
 layout = 'dot'
+hint_layouts = ['neato','fdp','sfdp']   # layouts that use pos hints
+pinnable_layouts = ['neato','fdp']      # layouts that can pin nodes in place
 ratio = '0.5'
 node_fontsize = '20'
 edge_fontsize = '10'
@@ -53,14 +67,47 @@ groupsubsystems = True
 showplot = True
 imagefile = None
 dotfile = None
+jsonfile = None
+graphmlfile = None
+csrdir = None
+htmlfile = None
+lintfile = None
 missingevents = True    # plot missing events?
 missingcommands = False # plot missing commands?
 commandlabels = False   # show command labels?
 eventlabels = True      # show event labels?
 splines = True          # use splines for edges?
 overlap = 'scale'
+cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME',
+    os.path.join(os.path.expanduser('~'),'.cache')),'nic')
+refresh_cache = False
+strict_cache = False    # validate the snapshot cache with dbHash? (see collection_hashes())
+profile = False         # report time and memory per phase? (see icdProfile)
+mongo_uri = None        # MongoDB server holding the ICD (None for localhost)
+database = 'icds'       # name of the ICD database
+fetch_jobs = 8          # collection fetches in flight at once
+selective = True        # only read the collections needed for the primaries?
+modeldir = None
+jobs = os.cpu_count() or 1
 possible_types = ['HCD', 'Assembly', 'Sequencer', 'Application']
 omittypes = set(['HCD'])
+batch = None
+rendercache = True      # skip graphviz if the dot source is unchanged?
+positions = None        # node positions file for incremental layouts
+possible_aggregates = ['none','subsystem','type']
+aggregate = 'none'      # collapse components into subsystem/type nodes?
+expand = set()          # subsystems whose components are never collapsed
+expanddegree = 0        # never collapse components with more neighbours (0=off)
+hops = 0                # follow relationships this many hops (0=direct only)
+bandwidth = False       # label event edges and components with bytes/s?
+possible_directions = ['up','down','both']
+direction = 'down'      # direction to follow relationships in for hops
+
+# plotting defaults above that may be changed for each plot
+plot_options = ['layout', 'ratio', 'splines', 'overlap', 'groupsubsystems',
+    'missingevents', 'missingcommands', 'commandlabels', 'eventlabels',
+    'omittypes', 'aggregate', 'expand', 'expanddegree', 'hops', 'direction',
+    'bandwidth']
 
 # suffixes for dummy nodes
 suffix_nocmd = '.cmd_no_sender'
@@ -77,216 +124,2431 @@ pub_dict = {          # mapping from events,telemetry,alarms->producers
 sub_dict = {}         # mapping from component prefixes->all subscribed items
 cmd_comp_dict = {}    # commands received/sent by component
 cmd_dict = {}         # mapping of all commands to the components that receive them
+component_types = {}  # dictionary using prefix as key for component types
+unresolved = {}       # model name->list of references that could not be resolved
+event_info = {}       # event/telemetry item->(size in bytes, published rate in Hz or None)
+required_rates = {}   # subscriber prefix->item->requiredRate
+
+# names of the globals above that are saved in the snapshot cache
+database_globals = ['prefix_dict', 'all_prefixes', 'pub_dict', 'sub_dict',
+    'cmd_comp_dict', 'cmd_dict', 'component_types', 'unresolved', 'event_info',
+    'required_rates']
+cache_version = 3     # increment whenever the parsed structures change
+report_unresolved = True  # print unresolved references while parsing?
+clients = {}          # MongoDB URI->shared MongoClient (see connect())
+
+# interned form of the above built once in build_indexes()
+store = None          # IcdStore
+
+# *****************************************************************************
+def prefix(subsystem,component):
+    """ Establish prefix given subsystem and component
+
+    Model files specify subsystem and component names. However,
+    these do not necessarily need to match the prefix
+    of a component. That mapping is provided by the component-model.conf
+    which specifies the component prefix. This routine makes
+    use of the global prefix_dict to get the prefix
+
+    Args:
+        subsystem (str): subsystem name from model files
+        component (str): component name from model files
+
+    Returns:
+        pref (str): The prefix if successful, error message if it failed
+        failed (bool): Flag is True if it failed
+    """
+    pref = None
+    failed = None
+    if subsystem not in prefix_dict:
+        failed = "Error: don't know subsystem "+subsystem
+    elif component not in prefix_dict[subsystem]:
+        failed = "Error: "+component+" not in subsystem "+subsystem
+    else:
+         pref = prefix_dict[subsystem][component]
+    return pref,failed
+
+# *****************************************************************************
+# Collections in the database correspond to individual model files and are
+# named (subsystem).(component).(modelfiletype). This expression classifies
+# a collection name in a single match.
+collection_re = re.compile(r'(\w+)\.(.*)\.(component|publish|subscribe|command)')
+
+# model file names in a model file tree and the corresponding model type
+modelfile_types = {
+    'component-model.conf': 'component',
+    'publish-model.conf': 'publish',
+    'subscribe-model.conf': 'subscribe',
+    'command-model.conf': 'command'
+}
+
+# model file types in the order in which they must be parsed (the prefixes
+# from the component models are needed to resolve all of the others)
+model_types = ['component', 'publish', 'subscribe', 'command']
+
+# Fields that are actually needed from each type of model file. Everything
+# else (descriptions, attribute schemas etc.) is left on the server.
+model_projections = {
+    'component': {
+        '_id':0, 'prefix':1, 'componentType':1
+        },
+    'publish': {
+        '_id':0, 'publish.events.name':1, 'publish.telemetry.name':1,
+        'publish.alarms.name':1,
+        # for icdBandwidth
+        'publish.events.maxRate':1, 'publish.events.minRate':1,
+        'publish.events.attributes.name':1, 'publish.events.attributes.type':1,
+        'publish.events.attributes.enum':1, 'publish.events.attributes.items':1,
+        'publish.events.attributes.dimensions':1,
+        'publish.events.attributes.maxLength':1,
+        'publish.events.attributes.attributes':1,
+        'publish.telemetry.maxRate':1, 'publish.telemetry.minRate':1,
+        'publish.telemetry.attributes.name':1, 'publish.telemetry.attributes.type':1,
+        'publish.telemetry.attributes.enum':1, 'publish.telemetry.attributes.items':1,
+        'publish.telemetry.attributes.dimensions':1,
+        'publish.telemetry.attributes.maxLength':1,
+        'publish.telemetry.attributes.attributes':1
+        },
+    'subscribe': {
+        '_id':0,
+        'subscribe.events.subsystem':1, 'subscribe.events.component':1,
+        'subscribe.events.name':1, 'subscribe.events.requiredRate':1,
+        'subscribe.telemetry.subsystem':1, 'subscribe.telemetry.component':1,
+        'subscribe.telemetry.name':1, 'subscribe.telemetry.requiredRate':1
+        },
+    'command': {
+        '_id':0, 'send.subsystem':1, 'send.component':1, 'send.name':1,
+        'receive.name':1
+        }
+}
+
+# *****************************************************************************
+def classify_collections(collection_names):
+    """ Sort collection names by model file type
+
+    Args:
+        collection_names (iterable): names of collections in the database
+
+    Returns:
+        dict: model file type -> list of (name, subsystem, component)
+    """
+    collections = {t:[] for t in model_types}
+    for name in sorted(collection_names):
+        match = collection_re.match(name)
+        if match:
+            subsystem,component,modeltype = match.groups()
+            collections[modeltype].append((name,subsystem,component))
+    return collections
+
+# *****************************************************************************
+def connect(uri=None):
+    """ Client for a MongoDB server, shared by everything that reads it
+
+    A client keeps a pool of connections, so one is created per server
+    and reused rather than connecting for every read.
+
+    Args:
+        uri (str): MongoDB URI (None for the default localhost server)
+
+    Returns:
+        MongoClient: the client
+    """
+    if uri not in clients:
+        clients[uri] = MongoClient(uri)
+    return clients[uri]
+
+# *****************************************************************************
+def fetch_chunk(db, stages):
+    """ Fetch the projected model documents of some collections in one query
+
+    Args:
+        db (Database): pymongo database
+        stages (list): (name, projection, query) for each collection
+
+    Returns:
+        dict: collection name -> projected model document
+    """
+    def pipeline(name, projection, query):
+        return [{'$match':query},
+                {'$limit':1},
+                {'$project':projection},
+                {'$addFields':{'_collection':{'$literal':name}}}]
+
+    first = pipeline(*stages[0])
+    for stage in stages[1:]:
+        first.append({'$unionWith':{'coll':stage[0],'pipeline':pipeline(*stage)}})
+    docs = {}
+    for d in db[stages[0][0]].aggregate(first):
+        docs[d.pop('_collection')] = d
+    return docs
+
+# *****************************************************************************
+def fetch_models(db, collections, jobs=1, queries=None):
+    """ Fetch the projected model document from each collection
+
+    The collections are split into jobs chunks that are fetched
+    concurrently, each with a single aggregation that chains its
+    collections together with $unionWith, projecting only the fields
+    listed in model_projections. The whole fetch therefore takes about one
+    round trip. Servers that do not support $unionWith (older than MongoDB
+    4.4, or mongomock) fall back to one projected find_one() per
+    collection, with at most jobs in flight at once.
+
+    A query may be given for any collection, in which case its document is
+    only returned if it matches. The matching is done by the server.
+
+    Args:
+        db (Database): pymongo database
+        collections (dict): output of classify_collections()
+        jobs (int): maximum number of concurrent queries
+        queries (dict): collection name -> query
+
+    Returns:
+        dict: collection name -> projected model document
+    """
+    queries = queries or {}
+    stages = [(name,model_projections[modeltype],queries.get(name,{}))
+              for modeltype in model_types
+              for name,subsystem,component in collections[modeltype]]
+    if not stages:
+        return {}
+
+    jobs = max(1,min(jobs,len(stages)))
+    size = -(-len(stages)//jobs)
+    chunks = [stages[i:i+size] for i in range(0,len(stages),size)]
+    docs = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        try:
+            for chunk in pool.map(lambda c: fetch_chunk(db,c),chunks):
+                docs.update(chunk)
+        except (OperationFailure, NotImplementedError):
+            docs = {}
+            # each query gets its own projection, which some drivers modify
+            for name,d in pool.map(lambda s: (s[0],db[s[0]].find_one(s[2],dict(s[1]))),stages):
+                if d is not None:
+                    docs[name] = d
+    return docs
+
+# *****************************************************************************
+def unresolved_reference(model, item, failed):
+    """ Record a subsystem/component that could not be resolved to a prefix
+
+    Args:
+        model (str): name of the model (collection) containing the reference
+        item (str): subsystem.component.name of the referenced item, or None
+            if the model itself could not be resolved
+        failed (str): error message from prefix()
+    """
+    if model not in unresolved:
+        unresolved[model] = []
+    unresolved[model].append({'item':item,'error':failed})
+    if report_unresolved:
+        print(model+':',failed,'('+item+')' if item else '')
+
+# *****************************************************************************
+def parse_models(collections, docs):
+    """ Populate globals from model documents
+
+    Populate the following globals:
+    prefix_dict, all_prefixes, pub_dict, sub_dict, cmd_comp_dict, cmd_dict,
+    component_types, unresolved, event_info, required_rates
+
+    Args:
+        collections (dict): output of classify_collections()
+        docs (dict): collection name -> model document
+    """
+
+    # Dictionary maps subsystem -> component -> prefix
+    # We get the prefixes out of the component-model files
+    for name,subsystem,component in collections['component']:
+        if name not in docs:
+            continue
+        datadict = docs[name]
+        component_prefix = datadict['prefix']
+        component_type = datadict['componentType'] #HCD, Assembly, Sequencer, Application
+
+        if subsystem not in prefix_dict:
+            prefix_dict[subsystem] = {}
+
+        prefix_dict[subsystem][component] = component_prefix
+        component_types[component_prefix] = component_type
+        all_prefixes.add(component_prefix)
+        #print("Found: ", subsystem, component, component_prefix)
+
+    # Dictionary of all events, telemetry, alarms pointing to
+    # components that publish them
+    # Extract this information from the publish-model files
+    for name,subsystem,component in collections['publish']:
+        if name not in docs:
+            continue
+        p,failed = prefix(subsystem,component)
+        if failed:
+            unresolved_reference(name,None,failed)
+            continue
+
+        d = docs[name]
+        if 'publish' in d:
+            publish = d['publish']
+
+            for pubtype in ['events','telemetry','alarms']:
+                if pubtype in publish:
+                    for item in publish[pubtype]:
+                        pub_dict[pubtype][p+'.'+item['name']] = p
+                        if pubtype != 'alarms':
+                            event_info[p+'.'+item['name']] = (
+                                icdBandwidth.event_size(item),
+                                icdBandwidth.event_rate(item))
+
+    # Dictionary of all events, telemetry subscribed to by each component
+    # Extract this information from the subscribe-model files
+    for name,subsystem,component in collections['subscribe']:
+        if name not in docs:
+            continue
+        p,failed = prefix(subsystem,component)
+        if failed:
+            unresolved_reference(name,None,failed)
+            continue
+
+        d = docs[name]
+        if 'subscribe' in d:
+            subscribe = d['subscribe']
+
+            for subtype in ['events','telemetry']:
+                if subtype in subscribe:
+                    for item in subscribe[subtype]:
+                        if p not in sub_dict:
+                            sub_dict[p] = {}
+                        if subtype not in sub_dict[p]:
+                            sub_dict[p][subtype] = set()
+                        pubprefix,failed = prefix(item['subsystem'],item['component'])
+                        if failed:
+                            # Can't identify the publisher
+                            pubprefix = item['subsystem']+'.'+item['component']
+                            unresolved_reference(name,pubprefix+'.'+item['name'],failed)
+                        sub_dict[p][subtype].add(pubprefix+'.'+item['name'])
+                        rate = icdBandwidth.as_rate(item.get('requiredRate'))
+                        if rate is not None:
+                            required_rates.setdefault(p,{})[pubprefix+'.'+item['name']] = rate
+                        #print(p,"subscribes to",pubprefix+'.'+item['name'])
+
+    # Dictionaries containing mapping of components->commands received and sent, and commands->components that receive
+    # Extract this information from the command-model files
+    for name,subsystem,component in collections['command']:
+        if name not in docs:
+            continue
+        p,failed = prefix(subsystem,component)
+        if failed:
+            unresolved_reference(name,None,failed)
+            continue
+
+        command = docs[name]
+
+        for cmdtype in ['send','receive']:
+            if cmdtype in command:
+                for item in command[cmdtype]:
+                    if p not in cmd_comp_dict:
+                        cmd_comp_dict[p] = {}
+                    if cmdtype not in cmd_comp_dict[p]:
+                        cmd_comp_dict[p][cmdtype] = set()
+
+                    if cmdtype == 'send':
+                        cmdprefix,failed = prefix(item['subsystem'],item['component'])
+                        if failed:
+                            unresolved_reference(name,item['subsystem']+'.'+
+                                item['component']+'.'+item['name'],failed)
+                    else:
+                        cmdprefix = p
+
+                    if not cmdprefix:
+                        continue
+                    itemName = cmdprefix+'.'+item['name']
+
+                    if cmdtype == 'receive':
+                        cmd_dict[itemName] = p
+
+                    cmd_comp_dict[p][cmdtype].add(itemName)
+
+# *****************************************************************************
+def collection_hashes(db, jobs=1, strict=None):
+    """ Cheaply establish a signature for each ICD collection
+
+    Each model collection is identified by its UUID, which changes when the
+    collection is dropped and recreated, and by the document count and data
+    size from collStats. The UUIDs come with the collection names in a
+    single listCollections round trip, and the collStats requests are made
+    with at most jobs in flight at once. No document is read.
+
+    In strict mode the dbHash command is used instead. It returns an md5
+    checksum of the contents of every collection in a single round trip,
+    so it also catches edits that keep the size unchanged, but the server
+    reads every document under a lock to compute it, which costs about as
+    much as fetching them. If the server does not support it the default
+    signature is used. Only collections matching collection_re are
+    included.
+
+    Args:
+        db (Database): pymongo database
+        jobs (int): maximum number of concurrent collStats requests
+        strict (bool): use dbHash (None for strict_cache)
+
+    Returns:
+        names (list): all collection names in the database
+        hashes (dict): collection name -> signature, or None if it could
+            not be established
+    """
+    if strict is None:
+        strict = strict_cache
+    if strict:
+        try:
+            hashes = db.command('dbHash')['collections']
+            return list(hashes),{n:h for n,h in hashes.items() if collection_re.match(n)}
+        except (OperationFailure, NotImplementedError):
+            pass
+
+    try:
+        infos = list(db.list_collections())
+        names = [info['name'] for info in infos]
+        uuids = {info['name']:str(info.get('info',{}).get('uuid','')) for info in infos}
+    except (OperationFailure, NotImplementedError):
+        names = db.list_collection_names()
+        uuids = {}
+    models = [name for name in names if collection_re.match(name)]
+
+    def stats(name):
+        stats = db.command({'collStats':name})
+        return name,'%s:%d:%d' % (uuids.get(name,''),stats['count'],stats['size'])
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1,jobs)) as pool:
+            return names,dict(pool.map(stats,models))
+    except (OperationFailure, NotImplementedError):
+        return names,None
+
+# *****************************************************************************
+def database_signature(db, jobs=1):
+    """ Cheaply identify the current state of the ICD collections
+
+    Args:
+        db (Database): pymongo database
+        jobs (int): maximum number of concurrent requests
+
+    Returns:
+        names (list): all collection names in the database
+        signature (str): hex digest of collection_hashes(), or None if it
+            could not be established
+    """
+    names,hashes = collection_hashes(db,jobs)
+    if hashes is None:
+        return names,None
+
+    h = hashlib.sha1(str(cache_version).encode())
+    for name in sorted(hashes):
+        h.update(('\n%s:%s' % (name,hashes[name])).encode())
+    return names,h.hexdigest()
+
+# *****************************************************************************
+def snapshot():
+    """ Return the database globals as a dictionary
+
+    Returns:
+        dict: global name -> value for each name in database_globals
+    """
+    return {name:globals()[name] for name in database_globals}
+
+# *****************************************************************************
+def restore(snap):
+    """ Replace the database globals with the contents of a snapshot
+
+    The globals are updated in place so that existing references remain
+    valid.
+
+    Args:
+        snap (dict): output of snapshot()
+    """
+    for name in database_globals:
+        g = globals()[name]
+        g.clear()
+        g.update(snap[name])
+
+# *****************************************************************************
+def clear_database():
+    """ Empty the database globals """
+    restore({
+        'prefix_dict': {},
+        'all_prefixes': set(),
+        'pub_dict': {'events':{}, 'telemetry':{}, 'alarms':{}},
+        'sub_dict': {},
+        'cmd_comp_dict': {},
+        'cmd_dict': {},
+        'component_types': {},
+        'unresolved': {},
+        'event_info': {},
+        'required_rates': {}
+        })
+
+# *****************************************************************************
+def load_cache(filename, signature):
+    """ Restore the database globals from a snapshot cache file
+
+    Args:
+        filename (str): cache file
+        signature (str): signature the cached snapshot must match
+
+    Returns:
+        bool: True if the cache was valid and has been restored
+    """
+    try:
+        with open(filename,'rb') as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return False
+    if cached.get('signature') != signature:
+        return False
+    restore(cached['snapshot'])
+    return True
+
+# *****************************************************************************
+def save_cache(filename, signature):
+    """ Write the database globals to a snapshot cache file
+
+    The file is written to a temporary name and moved into place so that
+    a concurrent reader never sees a partial file.
+
+    Args:
+        filename (str): cache file
+        signature (str): signature identifying the snapshot
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(filename)),exist_ok=True)
+    tmpname = '%s.%d.tmp' % (filename,os.getpid())
+    with open(tmpname,'wb') as f:
+        pickle.dump({'signature':signature,'snapshot':snapshot()},f,
+            protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpname,filename)
+
+# *****************************************************************************
+def read_models(loader, cachefile, signature, refresh_cache):
+    """ Populate the database globals, going through the snapshot cache
+
+    Args:
+        loader (callable): returns (collections, docs) for parse_models()
+        cachefile (str): snapshot cache file (None to disable)
+        signature (str): current signature of the source (None to disable)
+        refresh_cache (bool): ignore any existing snapshot and rewrite it
+
+    Returns:
+        bool: True if the globals were restored from the snapshot cache
+    """
+    use_cache = cachefile and signature
+    if use_cache and not refresh_cache and load_cache(cachefile,signature):
+        return True
+
+    collections,docs = loader()
+    parse_models(collections, docs)
+
+    if use_cache:
+        save_cache(cachefile,signature)
+    return False
+
+# *****************************************************************************
+# read database
+def read_database(cache_dir=None, refresh_cache=False, uri=None, name='icds',
+                  jobs=1):
+    """ Read information from the database into globals
+
+    Connect to the database and populate the following globals:
+    prefix_dict, all_prefixes, pub_dict, sub_dict, cmd_comp_dict, cmd_dict
+
+    The collection names are classified in a single pass, and only the
+    fields needed to build the relationships are fetched, with up to jobs
+    queries in flight at once over one pooled client (see fetch_models()).
+
+    If cache_dir is supplied the parsed globals are saved there, and are
+    restored on subsequent calls instead of reading the collections as long
+    as database_signature() is unchanged.
+
+    Args:
+        cache_dir (str): directory for the snapshot cache (None to disable)
+        refresh_cache (bool): ignore any existing snapshot and rewrite it
+        uri (str): MongoDB URI (None for the default localhost server)
+        name (str): name of the ICD database
+        jobs (int): maximum number of concurrent queries
+
+    Returns:
+        bool: True if the globals were restored from the snapshot cache
+    """
+
+    db = connect(uri)[name]
+
+    if cache_dir:
+        names,signature = database_signature(db,jobs)
+    else:
+        names,signature = db.list_collection_names(),None
+
+    def loader():
+        collections = classify_collections(names)
+        return collections,fetch_models(db,collections,jobs)
+
+    cachefile = None
+    if cache_dir:
+        # one snapshot per server and database
+        key = hashlib.sha1(('%s/%s' % (uri or '',name)).encode()).hexdigest()
+        cachefile = os.path.join(cache_dir,'icds-'+key[:16]+'.pickle')
+    return read_models(loader,cachefile,signature,refresh_cache)
+
+# *****************************************************************************
+def read_selected(components, subsystems, omittypes, uri=None, name='icds',
+                  jobs=1):
+    """ Read only the parts of the database needed to plot some primaries
+
+    Populate the same globals as read_database(), but only with what
+    build_graph() needs for the primaries chosen by select_primaries():
+
+    1. every component model, for the prefixes that resolve references
+    2. the publish, subscribe and command models of the primaries
+    3. the subscribe and command models of other components that refer
+       to a primary, selected by the server
+    4. the publish and command models of the components the primaries
+       subscribe to or send commands to, and the publish models of the
+       components found in 3, so that what every component of the graph
+       publishes is known (see print_bandwidth())
+
+    The result is not complete enough for impact_graph(), lint() or any
+    other primaries, and is not saved in the snapshot cache, so read_icd()
+    only uses it when the cache is disabled.
+
+    Args:
+        components (iterable): component prefixes
+        subsystems (iterable): subsystems whose components are all primaries
+        omittypes (set): component types that are not primaries
+        uri (str): MongoDB URI (None for the default localhost server)
+        name (str): name of the ICD database
+        jobs (int): maximum number of concurrent queries
+    """
+    db = connect(uri)[name]
+    collections = classify_collections(db.list_collection_names())
+
+    def load(names, queries=None):
+        selected = {t:[c for c in collections[t] if c[0] in names] for t in model_types}
+        docs = fetch_models(db,selected,jobs,queries)
+        parse_models(selected,docs)
+        return docs
+
+    load({c[0] for c in collections['component']})
+    owner = {p:(subsystem,component) for subsystem,comps in prefix_dict.items()
+             for component,p in comps.items()}
+    primaries = {owner[p] for p in select_primaries(components,subsystems,omittypes)
+                 if p in owner}
+    if not primaries:
+        return
+
+    # the primaries' own models, and everything that refers to them
+    refs = [{'subsystem':subsystem,'component':component}
+            for subsystem,component in sorted(primaries)]
+    queries = {}
+    names = set()
+    for modeltype in ('publish','subscribe','command'):
+        for collection,subsystem,component in collections[modeltype]:
+            names.add(collection)
+            if (subsystem,component) in primaries:
+                continue
+            if modeltype == 'subscribe':
+                queries[collection] = {'$or':[{'subscribe.events':{'$elemMatch':r}}
+                                              for r in refs]}
+            elif modeltype == 'command':
+                queries[collection] = {'$or':[{'send':{'$elemMatch':r}} for r in refs]}
+            else:
+                names.discard(collection)
+    docs = load(names,queries)
+
+    # publishers and receivers the primaries refer to
+    wanted = set()
+    for subsystem,component in primaries:
+        d = docs.get(subsystem+'.'+component+'.subscribe',{})
+        for item in d.get('subscribe',{}).get('events',()):
+            wanted.add(item['subsystem']+'.'+item['component']+'.publish')
+        d = docs.get(subsystem+'.'+component+'.command',{})
+        for item in d.get('send',()):
+            wanted.add(item['subsystem']+'.'+item['component']+'.command')
+            wanted.add(item['subsystem']+'.'+item['component']+'.publish')
+    # and what the subscribers and senders found above publish
+    for modeltype in ('subscribe','command'):
+        for collection,subsystem,component in collections[modeltype]:
+            if collection in docs:
+                wanted.add(subsystem+'.'+component+'.publish')
+    load(wanted.difference(docs))
+
+# *****************************************************************************
+def find_model_files(modeldir):
+    """ Find all of the model files in a model file tree
+
+    Hidden directories and files are skipped.
+
+    Args:
+        modeldir (str): root of the model file tree
+
+    Returns:
+        list: model file paths, sorted
+    """
+    files = []
+    for root, dirs, names in os.walk(modeldir):
+        dirs[:] = [d for d in dirs if not d[0] == '.']
+        for name in names:
+            if name in modelfile_types:
+                files.append(os.path.join(root,name))
+    return sorted(files)
+
+# *****************************************************************************
+def parse_model_file(filename):
+    """ Parse a HOCON model file into plain python types
+
+    This runs in the worker processes of read_modeldir() so the result
+    must be picklable.
+
+    Args:
+        filename (str): model file
+
+    Returns:
+        filename (str): the model file
+        model (dict): parsed contents, or None on failure
+        failed (str): error message if it failed
+    """
+    # pyhocon is only needed when reading model files directly
+    from pyhocon import ConfigFactory
+    try:
+        model = ConfigFactory.parse_file(filename).as_plain_ordered_dict()
+    except Exception as e:
+        return filename,None,str(e)
+    return filename,model,None
+
+# *****************************************************************************
+def parse_model_files(files, jobs=1):
+    """ Parse many model files, in a pool of jobs processes
+
+    Args:
+        files (list): model files
+        jobs (int): number of parser processes
+
+    Returns:
+        list: output of parse_model_file() for each file
+    """
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(parse_model_file,files,
+                chunksize=max(1,len(files)//(4*jobs))))
+    return [parse_model_file(f) for f in files]
+
+# *****************************************************************************
+def model_file_collection(filename, model):
+    """ Give a parsed model file the name it would have as a collection
+
+    A prefix is added to component models that do not define one.
+
+    Args:
+        filename (str): model file
+        model (dict): parsed contents
+
+    Returns:
+        (name, subsystem, component, modeltype), or None if the file does
+        not identify its subsystem and component
+    """
+    modeltype = modelfile_types[os.path.basename(filename)]
+    if 'subsystem' not in model or 'component' not in model:
+        print('Error: no subsystem/component in',filename)
+        return None
+    subsystem = model['subsystem']
+    component = model['component']
+    if modeltype == 'component' and 'prefix' not in model:
+        model['prefix'] = subsystem.lower()+'.'+component
+    name = subsystem+'.'+component+'.'+modeltype
+    return name,subsystem,component,modeltype
+
+# *****************************************************************************
+def load_model_files(files, jobs=1):
+    """ Parse model files into the form read from the database
+
+    Args:
+        files (list): model files (see find_model_files())
+        jobs (int): number of parser processes
+
+    Returns:
+        collections (dict): as from classify_collections()
+        docs (dict): collection name -> model document
+    """
+    collections = {t:[] for t in model_types}
+    docs = {}
+    for filename,model,failed in parse_model_files(files,jobs):
+        if failed:
+            print('Error: unable to parse',filename,failed)
+            continue
+        c = model_file_collection(filename,model)
+        if c:
+            name,subsystem,component,modeltype = c
+            collections[modeltype].append((name,subsystem,component))
+            docs[name] = model
+    return collections,docs
+
+# *****************************************************************************
+def read_modeldir(modeldir, cache_dir=None, refresh_cache=False, jobs=1):
+    """ Read information from a model file tree into globals
+
+    Populate the same globals as read_database(), but straight from a
+    checkout of the model files instead of the icds database. The files
+    are parsed in a pool of jobs processes.
+
+    The snapshot cache is validated against the paths, sizes and
+    modification times of the model files.
+
+    Args:
+        modeldir (str): root of the model file tree
+        cache_dir (str): directory for the snapshot cache (None to disable)
+        refresh_cache (bool): ignore any existing snapshot and rewrite it
+        jobs (int): number of parser processes
+
+    Returns:
+        bool: True if the globals were restored from the snapshot cache
+    """
+    files = find_model_files(modeldir)
+
+    h = hashlib.sha1(str(cache_version).encode())
+    for filename in files:
+        st = os.stat(filename)
+        h.update(('\n%s:%d:%d' % (filename,st.st_size,st.st_mtime_ns)).encode())
+    signature = h.hexdigest()
+
+    def loader():
+        return load_model_files(files,jobs)
+
+    cachefile = None
+    if cache_dir:
+        key = hashlib.sha1(os.path.abspath(modeldir).encode()).hexdigest()
+        cachefile = os.path.join(cache_dir,'modeldir-'+key[:16]+'.pickle')
+    return read_models(loader,cachefile,signature,refresh_cache)
+
+# *****************************************************************************
+def read_icd(components, subsystems, omittypes, complete=False):
+    """ Populate the database globals as the command line options ask
+
+    From modeldir if it is set, otherwise from the database. With the
+    snapshot cache enabled (cache_dir) the whole database is read on a
+    miss and saved, so that the next run restores it; read_selected() is
+    only used when the cache is disabled, selective is set and the plot
+    does not need the complete ICD.
+
+    Args:
+        components (iterable): component prefixes
+        subsystems (iterable): subsystems whose components are all primaries
+        omittypes (set): component types that are not primaries
+        complete (bool): the complete ICD is needed (--lint, --batch, --hops
+            or all subsystems)
+
+    Returns:
+        bool: True if the globals were restored from the snapshot cache
+    """
+    if modeldir:
+        return read_modeldir(modeldir,cache_dir,refresh_cache,jobs)
+    if selective and not (cache_dir or complete):
+        read_selected(components,subsystems,omittypes,mongo_uri,database,fetch_jobs)
+        return False
+    return read_database(cache_dir,refresh_cache,mongo_uri,database,fetch_jobs)
+
+# *****************************************************************************
+class Interner:
+    """ Two-way mapping between names and consecutive integer IDs
+
+    Attributes:
+        ids (dict): name -> ID
+        names (list): ID -> name
+    """
+    __slots__ = ('ids','names')
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        """ ID of a name, allocating the next ID if it is new
+
+        Args:
+            name (str): name to look up
+
+        Returns:
+            int: ID of the name
+        """
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+# *****************************************************************************
+class Adjacency:
+    """ Compressed rows of (item, component) entries for each component
+
+    The entries of component i are items[j] and others[j] for j in
+    range(indptr[i],indptr[i+1]).
+
+    Attributes:
+        indptr (array): row offsets (number of components + 1)
+        items (array): command/event IDs
+        others (array): ID of the component at the other end of each
+            item, -1 if there is none
+    """
+    __slots__ = ('indptr','items','others')
+
+    def __init__(self, rows, entries):
+        """ Build the rows from unordered entries
+
+        Args:
+            rows (int): number of components
+            entries (list): (component, item, other) ID tuples
+        """
+        offsets = [0]*(rows+1)
+        for row,item,other in entries:
+            offsets[row+1] += 1
+        for i in range(rows):
+            offsets[i+1] += offsets[i]
+        self.indptr = array('i',offsets)
+        self.items = array('i',[0])*len(entries)
+        self.others = array('i',[0])*len(entries)
+        for row,item,other in entries:
+            j = offsets[row]
+            offsets[row] += 1
+            self.items[j] = item
+            self.others[j] = other
+
+    def row(self, i):
+        """ Entries of a component
+
+        Args:
+            i (int): component ID
+
+        Returns:
+            iterable: (item, other) ID pairs
+        """
+        start,end = self.indptr[i],self.indptr[i+1]
+        return zip(self.items[start:end],self.others[start:end])
+
+# *****************************************************************************
+class IcdStore:
+    """ Interned, integer-indexed relationships from the database globals
+
+    Every component prefix and command/event name is interned once, and
+    the relationships are held in Adjacency rows indexed by component ID,
+    so graphs are built from integers alone. Strings are only looked up
+    again when a graph is written out.
+
+    Attributes:
+        comps (Interner): component prefixes (all_prefixes first, in
+            sorted order, then any other prefix that is referenced)
+        items (Interner): full (prefix.name) command/event names
+        labels (Interner): short command/event names
+        item_label (array): item ID -> label ID
+        known (array): component ID -> 1 if the prefix is in all_prefixes
+        cmd_out (Adjacency): sender -> (command, receiver)
+        cmd_in (Adjacency): receiver -> (command, sender)
+        ev_out (Adjacency): publisher -> (event, subscriber)
+        ev_in (Adjacency): subscriber -> (event, publisher)
+        cmd_unsent (Adjacency): receiver -> (command nobody sends, -1)
+        cmd_unknown (Adjacency): sender -> (command nobody receives, -1)
+        ev_unpublished (Adjacency): subscriber -> (event nobody publishes, -1)
+    """
+    __slots__ = ('comps','items','labels','item_label','known','cmd_out',
+        'cmd_in','ev_out','ev_in','cmd_unsent','cmd_unknown','ev_unpublished')
+
+    def __init__(self):
+        self.comps = Interner()
+        self.items = Interner()
+        self.labels = Interner()
+        self.item_label = array('i')
+        for p in sorted(all_prefixes):
+            self.comps.intern(p)
+        comp = self.comps.intern
+
+        cmd_out = []
+        cmd_unknown = []
+        for p,cmds in cmd_comp_dict.items():
+            sender = comp(p)
+            for cmd in cmds.get('send',()):
+                if cmd in cmd_dict:
+                    cmd_out.append((sender,self.item(cmd),comp(cmd_dict[cmd])))
+                else:
+                    cmd_unknown.append((sender,self.item(cmd),-1))
+        sent = {cmd for sender,cmd,receiver in cmd_out}
+        cmd_unsent = []
+        for p,cmds in cmd_comp_dict.items():
+            for cmd in cmds.get('receive',()):
+                i = self.item(cmd)
+                if i not in sent:
+                    cmd_unsent.append((comp(p),i,-1))
+
+        ev_out = []
+        ev_in = []
+        ev_unpublished = []
+        publishers = pub_dict['events']
+        for p,items in sub_dict.items():
+            subscriber = comp(p)
+            for ev in items.get('events',()):
+                i = self.item(ev)
+                if ev in publishers:
+                    publisher = comp(publishers[ev])
+                    ev_out.append((publisher,i,subscriber))
+                    if publishers[ev] in all_prefixes:
+                        ev_in.append((subscriber,i,publisher))
+                else:
+                    ev_unpublished.append((subscriber,i,-1))
+
+        n = len(self.comps)
+        self.known = array('b',[1])*len(all_prefixes)+array('b',[0])*(n-len(all_prefixes))
+        self.cmd_out = Adjacency(n,cmd_out)
+        self.cmd_in = Adjacency(n,[(r,i,s) for s,i,r in cmd_out])
+        self.ev_out = Adjacency(n,ev_out)
+        self.ev_in = Adjacency(n,ev_in)
+        self.cmd_unsent = Adjacency(n,cmd_unsent)
+        self.cmd_unknown = Adjacency(n,cmd_unknown)
+        self.ev_unpublished = Adjacency(n,ev_unpublished)
+
+    def item(self, name):
+        """ ID of a command/event, interning its short name as well
+
+        Args:
+            name (str): full (prefix.name) name
+
+        Returns:
+            int: item ID
+        """
+        i = self.items.intern(name)
+        if i == len(self.item_label):
+            self.item_label.append(self.labels.intern(name.split('.')[-1]))
+        return i
+
+    def label(self, i):
+        """ Short name of a command/event
+
+        Args:
+            i (int): item ID
+
+        Returns:
+            str: name without the prefix
+        """
+        return self.labels.names[self.item_label[i]]
+
+    def component(self, p):
+        """ ID of a component in the database
+
+        Args:
+            p (str): component prefix
+
+        Returns:
+            int: component ID, None if p is not in all_prefixes
+        """
+        i = self.comps.ids.get(p)
+        if i is None or not self.known[i]:
+            return None
+        return i
+
+# *****************************************************************************
+def build_indexes():
+    """ Build the interned relationship store from the database globals
+
+    The parsed dicts remain the form that is cached and linted; store is
+    rebuilt from them and is what graphs are built from.
+    Must be called after read_database().
+    """
+    global store
+    store = IcdStore()
+
+# *****************************************************************************
+def neighbours(p):
+    """ Components that share a command or event with a component
+
+    Args:
+        p (str): component prefix
+
+    Returns:
+        set: prefixes of the senders/receivers/publishers/subscribers
+    """
+    i = store.comps.ids.get(p)
+    if i is None:
+        return set()
+    names = store.comps.names
+    return {names[other] for adj in (store.cmd_out,store.cmd_in,
+        store.ev_out,store.ev_in) for item,other in adj.row(i)}
+
+# *****************************************************************************
+class RelationshipGraph:
+    """ Relationships between primary components and their neighbours
+
+    Edges are accumulated with add_primary(), which only visits the
+    relationships of the supplied component through the rows of the
+    store built by build_indexes().
+
+    Nodes are integer IDs in names and commands/events are item IDs in
+    store; name() and store.label() give the strings used for output.
+
+    Attributes:
+        store (IcdStore): store the graph was built from
+        names (Interner): node names (store.comps unless aggregated)
+        cmd_pairs (dict): (sender,receiver) -> set of commands
+        ev_pairs (dict): (publisher,subscriber) -> set of events
+        nodes (set): all nodes that will be plotted
+        primary_nodes (set): nodes for which full information is provided
+        cmd_no_sender (dict): node -> commands that nobody sends
+        ev_no_publisher (dict): node -> subscribed events nobody publishes
+        groups (dict): node -> label for nodes standing for several
+            components (see aggregate_graph())
+        members (dict): node -> prefixes of the components an aggregated
+            node stands for (see aggregate_graph())
+    """
+
+    def __init__(self, names=None):
+        self.store = store
+        self.names = store.comps if names is None else names
+        self.cmd_pairs = {}
+        self.ev_pairs = {}
+        self.nodes = set()
+        self.primary_nodes = set()
+        self.cmd_no_sender = {}
+        self.ev_no_publisher = {}
+        self.groups = {}
+        self.members = {}
+
+    def name(self, node):
+        """ Name of a node
+
+        Args:
+            node (int): node ID
+
+        Returns:
+            str: component prefix or group name
+        """
+        return self.names.names[node]
+
+    def sorted_nodes(self, nodes):
+        """ Nodes in order of their names
+
+        Args:
+            nodes (iterable): node IDs
+
+        Returns:
+            list: node IDs
+        """
+        return sorted(nodes,key=self.name)
+
+    def sorted_pairs(self, pairs):
+        """ Edges in order of their node names
+
+        Args:
+            pairs (dict): cmd_pairs or ev_pairs
+
+        Returns:
+            list: ((tail,head),items) tuples
+        """
+        return sorted(pairs.items(),
+            key=lambda e: (self.name(e[0][0]),self.name(e[0][1])))
+
+    def _add_cmd(self, sender, receiver, cmd):
+        pair = (sender,receiver)
+        if pair not in self.cmd_pairs:
+            self.cmd_pairs[pair] = set()
+        self.cmd_pairs[pair].add(cmd)
+
+    def _add_ev(self, publisher, subscriber, ev):
+        pair = (publisher,subscriber)
+        if pair not in self.ev_pairs:
+            self.ev_pairs[pair] = set()
+        self.ev_pairs[pair].add(ev)
+
+    def add_upstream(self, p):
+        """ Add edges for the commands and events a component receives
+
+        Args:
+            p (int): component ID
+
+        Returns:
+            set: the senders and publishers
+        """
+        self.nodes.add(p)
+        neighbours = set()
+
+        # *************************************************
+        # edges for all commands sent to component
+        for cmd,sender in self.store.cmd_in.row(p):
+            self._add_cmd(sender,p,cmd)
+            neighbours.add(sender)
+
+        # *************************************************
+        # events that this component subscribes to
+        for ev,publisher in self.store.ev_in.row(p):
+            self._add_ev(publisher,p,ev)
+            neighbours.add(publisher)
+
+        self.nodes.update(neighbours)
+        return neighbours
+
+    def add_downstream(self, p):
+        """ Add edges for the commands and events a component sends
+
+        Args:
+            p (int): component ID
+
+        Returns:
+            set: the receivers and subscribers
+        """
+        self.nodes.add(p)
+        neighbours = set()
+
+        # *************************************************
+        # edges for all commands sent from component
+        for cmd,receiver in self.store.cmd_out.row(p):
+            self._add_cmd(p,receiver,cmd)
+            neighbours.add(receiver)
+        for cmd,other in self.store.cmd_unknown.row(p):
+            print('Error: command',self.store.items.names[cmd],'not in cmd_dict')
+
+        # *************************************************
+        # events that other components subscribe to from
+        # this component
+        for ev,subscriber in self.store.ev_out.row(p):
+            self._add_ev(p,subscriber,ev)
+            neighbours.add(subscriber)
+
+        self.nodes.update(neighbours)
+        return neighbours
+
+    def add_missing(self, p):
+        """ Record the commands and events of a component with no other end
+
+        Args:
+            p (int): component ID
+        """
+        # *************************************************
+        # identify commands that no one sends to this component
+        diff = {cmd for cmd,other in self.store.cmd_unsent.row(p)}
+        if diff:
+            self.cmd_no_sender[p] = diff
+
+        # *************************************************
+        # identify required events that no one publishes
+        diff = {ev for ev,other in self.store.ev_unpublished.row(p)}
+        if diff:
+            self.ev_no_publisher[p] = diff
+
+    def add_primary(self, p):
+        """ Add a primary component and all of its direct relationships
+
+        Args:
+            p (int): component ID
+        """
+        self.primary_nodes.add(p)
+        self.add_upstream(p)
+        self.add_downstream(p)
+        self.add_missing(p)
+
+# *****************************************************************************
+def lint():
+    """ Check the interfaces of every component in the database
+
+    Errors:
+        unpublished: subscribed events/telemetry that nobody publishes
+        unknown_commands: sent commands the receiver does not accept
+        unresolved: references to unknown subsystems/components
+
+    Warnings:
+        unsent_commands: accepted commands that nobody sends
+        orphan_events: published events that nobody subscribes to
+
+    Each check is a set difference over the whole database.
+
+    Returns:
+        dict: the name of each check above -> {prefix (or model name for
+            unresolved): sorted list of items}, plus 'errors' and
+            'warnings' giving the total number of items
+    """
+    published = {t:pub_dict[t].keys() for t in ('events','telemetry')}
+    subscribed = {t:set() for t in ('events','telemetry')}
+    unpublished = {}
+    for p,items in sub_dict.items():
+        missing = set()
+        for t in ('events','telemetry'):
+            if t in items:
+                subscribed[t] |= items[t]
+                missing |= items[t] - published[t]
+        if missing:
+            unpublished[p] = sorted(missing)
+
+    sent = set()
+    unknown_commands = {}
+    for p,cmds in cmd_comp_dict.items():
+        if 'send' in cmds:
+            sent |= cmds['send']
+            missing = cmds['send'] - cmd_dict.keys()
+            if missing:
+                unknown_commands[p] = sorted(missing)
+
+    unsent_commands = {}
+    for cmd in cmd_dict.keys() - sent:
+        unsent_commands.setdefault(cmd_dict[cmd],[]).append(cmd)
+
+    orphan_events = {}
+    for ev in published['events'] - subscribed['events']:
+        orphan_events.setdefault(pub_dict['events'][ev],[]).append(ev)
+
+    report = {
+        'unpublished': unpublished,
+        'unknown_commands': unknown_commands,
+        'unresolved': {m:sorted(r['item'] or r['error'] for r in refs)
+                       for m,refs in unresolved.items()},
+        'unsent_commands': {p:sorted(c) for p,c in unsent_commands.items()},
+        'orphan_events': {p:sorted(e) for p,e in orphan_events.items()}
+        }
+    for key in report:
+        report[key] = dict(sorted(report[key].items()))
+    report['errors'] = sum(len(v) for k in ('unpublished','unknown_commands',
+        'unresolved') for v in report[k].values())
+    report['warnings'] = sum(len(v) for k in ('unsent_commands',
+        'orphan_events') for v in report[k].values())
+    return report
+
+# *****************************************************************************
+def aggregate_graph(graph, mode, expand=(), expanddegree=0):
+    """ Collapse the components of a graph into one node per group
+
+    With mode 'subsystem' all components of a subsystem become a single
+    node, and with mode 'type' there is one node for each component type
+    (HCD, Assembly...) in each subsystem. Components of the subsystems in
+    expand, and components with more than expanddegree neighbours, are
+    kept as they are. The edges between groups carry all of the commands
+    or events between their members; edges internal to a group are
+    dropped.
+
+    Args:
+        graph (RelationshipGraph): relationships to aggregate
+        mode (str): one of possible_aggregates
+        expand (iterable): subsystems that are not collapsed
+        expanddegree (int): components with more neighbours are not
+            collapsed (0 to collapse regardless of degree)
+
+    Returns:
+        RelationshipGraph: the aggregated graph (graph itself if mode is
+            'none')
+    """
+    if mode == 'none':
+        return graph
+
+    neighbours = {}
+    if expanddegree:
+        for pairs in (graph.cmd_pairs,graph.ev_pairs):
+            for a,b in pairs:
+                neighbours.setdefault(a,set()).add(b)
+                neighbours.setdefault(b,set()).add(a)
+
+    expand = set(expand)
+    names = Interner()
+    group = {}
+    members = {}
+    kept = set()
+    for node in graph.nodes:
+        name = graph.name(node)
+        subsystem = name.split('.')[0]
+        if subsystem in expand or \
+            (expanddegree and len(neighbours.get(node,())) > expanddegree):
+            g = names.intern(name)
+            kept.add(g)
+        elif mode == 'type':
+            g = names.intern(subsystem+'.['+component_types.get(name,'unknown')+']')
+        else:
+            g = names.intern(subsystem)
+        group[node] = g
+        if g not in members:
+            members[g] = set()
+        members[g].add(node)
+
+    agg = RelationshipGraph(names)
+    agg.store = graph.store
+    for g,nodes in members.items():
+        agg.nodes.add(g)
+        agg.members[g] = {p for n in nodes
+                          for p in graph.members.get(n,(graph.name(n),))}
+        if not graph.primary_nodes.isdisjoint(nodes):
+            agg.primary_nodes.add(g)
+        if g not in kept:
+            agg.groups[g] = '%s\n(%d)' % (names.names[g].replace('.[',' ').rstrip(']'),len(nodes))
+
+    for pairs,aggpairs in ((graph.cmd_pairs,agg.cmd_pairs),
+                           (graph.ev_pairs,agg.ev_pairs)):
+        for (a,b),items in pairs.items():
+            pair = (group[a],group[b])
+            if pair[0] == pair[1] and pair[0] in agg.groups:
+                continue
+            if pair not in aggpairs:
+                aggpairs[pair] = set()
+            aggpairs[pair].update(items)
+
+    for missing,aggmissing in ((graph.cmd_no_sender,agg.cmd_no_sender),
+                               (graph.ev_no_publisher,agg.ev_no_publisher)):
+        for p,items in missing.items():
+            g = group[p]
+            if g not in aggmissing:
+                aggmissing[g] = set()
+            aggmissing[g].update(items)
+
+    return agg
+
+# *****************************************************************************
+def edge_attrs(graph, tail, head, items, showlabels):
+    """ Label and attributes for an edge carrying commands or events
+
+    Edges between ordinary components are labelled with the item names.
+    Edges to or from an aggregated node are labelled with the number of
+    items instead, and weighted by it.
+
+    Args:
+        graph (RelationshipGraph): relationships being plotted
+        tail (int): source node (None for a dummy node)
+        head (int): destination node
+        items (set): IDs of the commands/events on the edge
+        showlabels (bool): label the edge?
+
+    Returns:
+        label (str): edge label (None for no label)
+        attrs (dict): any other edge attributes
+    """
+    label = None
+    attrs = {}
+    if tail in graph.groups or head in graph.groups:
+        n = len(items)
+        if showlabels:
+            label = str(n)
+        attrs['penwidth'] = '%.1f' % (1+math.log2(n))
+        attrs['weight'] = str(n)
+    elif showlabels:
+        label = '\n'.join(sorted(graph.store.label(i) for i in items))
+    return label,attrs
+
+# *****************************************************************************
+def item_bandwidth(subscriber, ev):
+    """ Bandwidth of an event received by a subscriber (see icdBandwidth)
+
+    Args:
+        subscriber (str): subscriber prefix
+        ev (str): full event name
+
+    Returns:
+        float: bytes/s, None if the event's size or rate is unknown
+    """
+    if ev not in event_info:
+        return None
+    size,rate = event_info[ev]
+    rate = icdBandwidth.received_rate(rate,required_rates.get(subscriber,{}).get(ev))
+    return None if rate is None else size*rate
+
+# *****************************************************************************
+def graph_bandwidth(graph):
+    """ Event bandwidth of each edge and node of a graph
+
+    Subscribers that are aggregated nodes are assumed to receive every
+    event at the rate it is published at.
+
+    Args:
+        graph (RelationshipGraph): relationships being plotted
+
+    Returns:
+        edges (dict): (publisher,subscriber) -> (bytes/s, number of events
+            whose bandwidth is unknown and not counted)
+        nodes (dict): node -> [bytes/s received, bytes/s sent, unknown
+            received, unknown sent] for every node with events
+    """
+    full = graph.store.items.names
+    edges = {}
+    nodes = {}
+    for (publisher,subscriber),items in graph.ev_pairs.items():
+        total = 0.0
+        unknown = 0
+        for i in items:
+            bw = item_bandwidth(graph.name(subscriber),full[i])
+            if bw is None:
+                unknown += 1
+            else:
+                total += bw
+        edges[publisher,subscriber] = (total,unknown)
+        for node,k in ((subscriber,0),(publisher,1)):
+            n = nodes.setdefault(node,[0.0,0.0,0,0])
+            n[k] += total
+            n[k+2] += unknown
+    return edges,nodes
+
+# *****************************************************************************
+def format_bandwidth(bw, unknown=0):
+    """ Bandwidth label
+
+    Args:
+        bw (float): bytes/s
+        unknown (int): number of events not counted in bw
+
+    Returns:
+        str: e.g. "1.2 kB/s", with "+?" if some events weren't counted
+    """
+    return icdBandwidth.format_bytes(bw,'/s')+('+?' if unknown else '')
+
+# *****************************************************************************
+def print_bandwidth(graph):
+    """ List the event bandwidth of each component in a graph, busiest first
+
+    For each component: what it publishes whether or not anyone
+    subscribes, what it sends to and receives from the other components
+    in the graph, and the number of events whose size or rate is unknown.
+    The rows of aggregated nodes add up their members.
+
+    Args:
+        graph (RelationshipGraph): relationships being plotted
+    """
+    published = {}
+    for ev,p in pub_dict['events'].items():
+        size,rate = event_info.get(ev,(0,None))
+        if rate is not None:
+            published[p] = published.get(p,0.0)+size*rate
+    _,nodes = graph_bandwidth(graph)
+    rows = []
+    for node in graph.nodes:
+        received,sent,unknown_in,unknown_out = nodes.get(node,(0.0,0.0,0,0))
+        # an aggregated node publishes what its members do
+        pub = sum(published.get(p,0.0)
+                  for p in graph.members.get(node,(graph.name(node),)))
+        rows.append((graph.name(node),pub,received,sent,unknown_in+unknown_out))
+    rows.sort(key=lambda r:(-max(r[1:4]),r[0]))
+    print('Event bandwidth (bytes/s):')
+    print('  %-40s %12s %12s %12s %8s' % ('component','published','received','sent','unknown'))
+    for name,pub,received,sent,unknown in rows:
+        print('  %-40s %12s %12s %12s %8d' % (name,icdBandwidth.format_bytes(pub,'/s'),
+            icdBandwidth.format_bytes(received,'/s'),icdBandwidth.format_bytes(sent,'/s'),unknown))
+
+# *****************************************************************************
+def define_nodes(g, graph, nodes, col, shortlabel, opts, hints=None, bandwidth=None):
+    """ Define nodes in a graph
+
+    Add supplied nodes to the supplied graph.
+    Primary nodes and secondary nodes have a different style.
+    The subroutine will also create dummy nodes corresponding to
+    any node that has missing commands/events.
+
+    This routine may be called on a subgraph.
+
+    Args:
+        g (Digraph): graph object for which nodes are being defined
+        graph (RelationshipGraph): relationships being plotted
+        nodes (iterable): list of node IDs
+        col (str): colour for the nodes
+        shortlabel (bool): if true just component label instead of full prefix
+        opts (dict): plot options (see default_options())
+        hints (dict): node name -> graphviz pos attribute (see make_dot())
+        bandwidth (dict): nodes output of graph_bandwidth(), to add the
+            bytes/s received and sent to the labels (None for no bandwidth)
+    """
+    def at(name):
+        if hints and name in hints:
+            return {'pos':hints[name]}
+        return {}
+
+    for node in graph.sorted_nodes(nodes):
+            # Create nodes for components 
+            name = graph.name(node)
+            parts = name.split('.')  
+            component = '.'.join(parts[1:])
+            if shortlabel:
+                label = component
+            else:
+                label = name
+            if node in graph.groups:
+                label = graph.groups[node]
+            if bandwidth and node in bandwidth:
+                received,sent,unknown_in,unknown_out = bandwidth[node]
+                label += '\nin %s, out %s' % (format_bandwidth(received,unknown_in),
+                                              format_bandwidth(sent,unknown_out))
+            if node in graph.primary_nodes:
+                style='bold'
+            else:
+                style='dashed'
+            if node in graph.groups:
+                g.node(name,label,fontcolor=col,color=col,
+                    style=style,shape='box',**at(name))
+            else:
+                g.node(name,label,fontcolor=col,color=col,style=style,**at(name))
+
+            # Create dummy node for commands nobody sends
+            if opts['missingcommands'] and node in graph.cmd_no_sender:
+                g.node(name+suffix_nocmd,'?',fontcolor=nocmdcol,color=nocmdcol,
+                    **at(name+suffix_nocmd))
+
+            # Create dummy node for required events nobody sends
+            if opts['missingevents'] and node in graph.ev_no_publisher:
+                g.node(name+suffix_noev,'?',fontcolor=noevcol,color=noevcol,
+                    **at(name+suffix_noev))
+
+# *****************************************************************************
+def default_options():
+    """ Plot options taken from the current module defaults
+
+    Returns:
+        dict: option name -> value for each name in plot_options
+    """
+    return {name:globals()[name] for name in plot_options}
+
+# *****************************************************************************
+def select_primaries(components, subsystems, omittypes):
+    """ Establish the set of primary components
+
+    Args:
+        components (iterable): component prefixes
+        subsystems (iterable): subsystems whose components are all added
+            ('all' for every subsystem)
+        omittypes (set): component types that are not primaries
+
+    Returns:
+        set: primary component prefixes
+    """
+    primaries = set(components)
+
+    # Add components from user-specified subsystems
+    if subsystems:
+        subsystems = set(subsystems)
+        if 'all' in subsystems:
+            subsystems = {p.split('.')[0] for p in all_prefixes}
+        for p in all_prefixes:
+            subsystem = p.split('.')[0]
+            if subsystem in subsystems:
+                primaries.add(p)
+
+    # Remove primary components if they are in omittypes
+    if omittypes:
+        primaries = {c for c in primaries if component_types.get(c) not in omittypes}
+
+    return primaries
+
+# *****************************************************************************
+def build_graph(primaries):
+    """ Establish all of the relationships of the primary components
+
+    Args:
+        primaries (iterable): primary component prefixes
+
+    Returns:
+        RelationshipGraph: relationships required to make the plot
+    """
+    graph = RelationshipGraph()
+    for p in primaries:
+        i = store.component(p)
+        if i is None:
+            print("Error: don't know",p)
+            continue
+        graph.add_primary(i)
+    return graph
+
+# *****************************************************************************
+def impact_graph(primaries, hops, direction):
+    """ Establish everything within a number of hops of the primaries
+
+    A breadth-first search follows commands from sender to receiver and
+    events from publisher to subscriber ('down'), the reverse ('up') or
+    both. Only the components that are reached are expanded, so the cost
+    is proportional to the size of the visited subgraph.
+
+    Args:
+        primaries (iterable): primary component prefixes
+        hops (int): maximum number of hops
+        direction (str): one of possible_directions
+
+    Returns:
+        graph (RelationshipGraph): the visited components and the edges
+            followed to reach them
+        distance (dict): prefix -> number of hops from the primaries
+    """
+    graph = RelationshipGraph()
+    distance = {}
+    frontier = []
+    for p in sorted(primaries):
+        i = store.component(p)
+        if i is None:
+            print("Error: don't know",p)
+            continue
+        graph.nodes.add(i)
+        graph.primary_nodes.add(i)
+        graph.add_missing(i)
+        distance[i] = 0
+        frontier.append(i)
+
+    for hop in range(1,hops+1):
+        reached = []
+        for p in frontier:
+            neighbours = set()
+            if direction in ('down','both'):
+                neighbours.update(graph.add_downstream(p))
+            if direction in ('up','both'):
+                neighbours.update(graph.add_upstream(p))
+            for n in neighbours:
+                if n not in distance:
+                    distance[n] = hop
+                    reached.append(n)
+        frontier = reached
+
+    return graph,{graph.name(n):d for n,d in distance.items()}
+
+# *****************************************************************************
+def relationship_graph(components, subsystems, opts):
+    """ Establish the relationships to plot for a set of plot options
+
+    The graph is not aggregated (see aggregate_graph()).
+
+    Args:
+        components (iterable): component prefixes
+        subsystems (iterable): subsystems whose components are all primaries
+        opts (dict): plot options (see default_options())
+
+    Returns:
+        graph (RelationshipGraph): relationships to plot
+        distance (dict): prefix -> hops from the primaries if opts['hops']
+            is set, otherwise None
+    """
+    primaries = select_primaries(components,subsystems,opts['omittypes'])
+    if opts['hops']:
+        graph,distance = impact_graph(primaries,opts['hops'],opts['direction'])
+    else:
+        graph,distance = build_graph(primaries),None
+    return graph,distance
+
+# *****************************************************************************
+def make_dot(graph, opts, hints=None):
+    """ Create the graphviz graph for a set of relationships
+
+    Nodes, edges and labels are emitted in sorted order so that the dot
+    source only changes when the relationships or options change.
+
+    Args:
+        graph (RelationshipGraph): relationships to plot
+        opts (dict): plot options (see default_options())
+        hints (dict): node name -> graphviz pos attribute, "x,y" in points
+            as a starting position or "x,y!" to pin the node there (only
+            used by hint_layouts, see make_pinned_dot())
+
+    If opts['bandwidth'] is set, event edges are labelled with their
+    bytes/s (see graph_bandwidth()) and drawn and weighted by it, and
+    components are labelled with the bytes/s they receive and send.
+
+    Returns:
+        Digraph: the graph
+    """
+
+    # ***************************************************************
+    # from graph.nodes create a dictionary of nodes in each subsystem
+    all_subsystems = {}
+    for node in graph.nodes:
+        subsystem=graph.name(node).split('.')[0]
+        if subsystem not in all_subsystems:
+            all_subsystems[subsystem] = set()
+        all_subsystems[subsystem].add(node)
+
+    # ***************************************************************
+    # Create the graph
+
+    # Graph initialization
+    dot = Digraph()
+    dot.graph_attr['layout']=opts['layout']
+    dot.graph_attr['splines']=str(opts['splines'])
+    dot.graph_attr['overlap']=opts['overlap']
+    #dot.graph_attr['sep']='+20'
+    dot.graph_attr['ratio']=opts['ratio']
+    if hints:
+        # positions are in points, as graphviz reports them
+        dot.graph_attr['inputscale']='72'
+    dot.node_attr['fontsize']=node_fontsize
+    dot.edge_attr['fontsize']=edge_fontsize
+
+
+    ev_bandwidth,node_bandwidth = graph_bandwidth(graph) if opts['bandwidth'] else (None,None)
+
+    # Define all of the nodes
+    for subsystem,nodes in sorted(all_subsystems.items()):
+        if subsystem in subsystem_colours:
+            col = subsystem_colours[subsystem]
+            shortlabel = True
+        else:
+            # use a single colour for subsystems
+            # that don't have a specific colour,
+            # and also revert to specifying
+            # full prefix for nodes in those
+            # subsystems instead of the short name
+            col = subsystem_colours['others']
+            shortlabel = False
+
+        if opts['groupsubsystems']:
+            # Group nodes by subsystem
+            with dot.subgraph(name='cluster_'+subsystem) as c:
+                c.attr(label=subsystem)
+                c.attr(color=col)
+                c.attr(fontcolor=col)
+                c.attr(fontsize=subsystem_fontsize)
+                c.attr(style='rounded')
+                c.attr(penwidth='3')
+                c.attr(labelloc='b')
+
+                define_nodes(c,graph,nodes,col,shortlabel,opts,hints,node_bandwidth)
+        else:
+            # No grouping
+            define_nodes(dot,graph,nodes,col,shortlabel,opts,hints,node_bandwidth)
+            
+
+    # One edge for each unique command sender,receiver listing all commands in label
+    dot.attr('edge',fontcolor=cmdcol)
+    dot.attr('edge',color=cmdcol)
+    for (sender,receiver),cmds in graph.sorted_pairs(graph.cmd_pairs):
+        cmd_str,attrs = edge_attrs(graph,sender,receiver,cmds,opts['commandlabels'])
+        dot.edge(graph.name(sender),graph.name(receiver),label=cmd_str,**attrs)
+
+    # One edge showing all commands nobody sends to each component,
+    # using dummy nodes as the source
+    if opts['missingcommands']:
+        dot.attr('edge',fontcolor=nocmdcol)
+        dot.attr('edge',color=nocmdcol)
+        for p in graph.sorted_nodes(graph.cmd_no_sender):
+            cmd_str,attrs = edge_attrs(graph,None,p,graph.cmd_no_sender[p],opts['commandlabels'])
+            dot.edge(graph.name(p)+suffix_nocmd,graph.name(p),label=cmd_str,**attrs)
+
+    # One edge for each unique event publisher,receiver listing all items as the label
+    dot.attr('edge',fontcolor=evcol)
+    dot.attr('edge',color=evcol)
+    #dot.attr('edge',style='dotted')
+    for (publisher,receiver),events in graph.sorted_pairs(graph.ev_pairs):
+        ev_str,attrs = edge_attrs(graph,publisher,receiver,events,opts['eventlabels'])
+        if ev_bandwidth:
+            bw,unknown = ev_bandwidth[publisher,receiver]
+            bw_str = format_bandwidth(bw,unknown)
+            ev_str = bw_str if ev_str is None else ev_str+'\n'+bw_str
+            # one step per decade above 1 kB/s
+            steps = max(0,math.log10(bw/1000)) if bw > 0 else 0
+            attrs['penwidth'] = '%.1f' % (1+steps)
+            attrs['weight'] = str(1+int(steps))
+        dot.edge(graph.name(publisher),graph.name(receiver),label=ev_str,**attrs)
+
+    # One edge showing all events components need but nobody publishes,
+    # using dummy nodes as the source
+    if opts['missingevents']:
+        dot.attr('edge',fontcolor=nocmdcol)
+        dot.attr('edge',color=nocmdcol)
+        for p in graph.sorted_nodes(graph.ev_no_publisher):
+            ev_str,attrs = edge_attrs(graph,None,p,graph.ev_no_publisher[p],opts['eventlabels'])
+            dot.edge(graph.name(p)+suffix_noev,graph.name(p),label=ev_str,style='dashed',**attrs)
+
+    return dot
+
+# *****************************************************************************
+def node_signatures(graph, opts):
+    """ Hash of everything that could change where a node is placed
+
+    A node's signature covers the nodes it is connected to and the items
+    on those edges, so it changes whenever the node gains or loses an
+    edge, event or command. Dummy nodes share the signature of the node
+    they point at.
+
+    Args:
+        graph (RelationshipGraph): relationships being plotted
+        opts (dict): plot options (see default_options())
+
+    Returns:
+        dict: node name -> signature (hex string) for every node plotted
+    """
+    entries = {node:[] for node in graph.nodes}
+    for kind,pairs in (('cmd',graph.cmd_pairs),('ev',graph.ev_pairs)):
+        for (tail,head),items in pairs.items():
+            labels = sorted(graph.store.label(i) for i in items)
+            entries[tail].append((kind,'out',graph.name(head),labels))
+            entries[head].append((kind,'in',graph.name(tail),labels))
+    missing = []
+    if opts['missingcommands']:
+        missing.append(('nocmd',suffix_nocmd,graph.cmd_no_sender))
+    if opts['missingevents']:
+        missing.append(('noev',suffix_noev,graph.ev_no_publisher))
+    for kind,_,nodes in missing:
+        for node,items in nodes.items():
+            entries[node].append((kind,sorted(graph.store.label(i) for i in items)))
+
+    signatures = {}
+    for node,e in entries.items():
+        h = hashlib.sha1(json.dumps(sorted(e)).encode())
+        signatures[graph.name(node)] = h.hexdigest()[:16]
+    for _,suffix,nodes in missing:
+        for node in nodes:
+            name = graph.name(node)
+            signatures[name+suffix] = signatures[name]
+    return signatures
+
+# *****************************************************************************
+def read_positions(filename, layout):
+    """ Read node positions saved by write_positions()
+
+    Args:
+        filename (str): positions file
+        layout (str): layout engine the positions must come from
+
+    Returns:
+        dict: node name -> (position (list of x,y in points), signature);
+            empty if the file doesn't exist or is for another layout
+    """
+    try:
+        with open(filename) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError,ValueError) as e:
+        print('Warning: ignoring node positions in %s: %s' % (filename,e))
+        return {}
+    if saved.get('layout') != layout:
+        print('Warning: node positions in %s are from layout %s, not %s; laying out from scratch' %
+            (filename,saved.get('layout'),layout))
+        return {}
+    return {name:(node['pos'],node['sig']) for name,node in saved['nodes'].items()}
+
+# *****************************************************************************
+def write_positions(filename, layout, positions, signatures):
+    """ Save node positions for the next incremental layout
+
+    Args:
+        filename (str): positions file
+        layout (str): layout engine that produced the positions
+        positions (dict): node name -> (x,y) in points
+        signatures (dict): output of node_signatures(); only these nodes
+            are saved
+    """
+    nodes = {name:{'pos':list(pos),'sig':signatures[name]}
+             for name,pos in sorted(positions.items()) if name in signatures}
+    tmp = filename+'.tmp'
+    with open(tmp,'w') as f:
+        json.dump({'layout':layout,'nodes':nodes},f,indent=1)
+    os.replace(tmp,filename)
 
-# global information built when preparing for plot
-cmd_pairs = {}        # each entry points to list of events between each unique publisher&receiver
-ev_pairs = {}         # each entry points to list of events between each unique publisher&receiver
-all_nodes = set()     # a set of all nodes that will be plotted
-primary_nodes = set() # nodes for which full information is provided
-cmd_no_sender = {}    # dictionary using prefix as key for commands that nobody sends
-ev_no_publisher = {}  # dictionary using prefix as key for events component subscribes to, nobody publishes
-component_types = {}  # dictionary using prefix as key for component types
+# *****************************************************************************
+def layout_positions(dot):
+    """ Lay out a graph and read back where graphviz put each node
+
+    Args:
+        dot (Digraph): the graph
+
+    Returns:
+        dict: node name -> (x,y) in points
+    """
+    with icdProfile.phase('dot.layout') as p:
+        laid_out = json.loads(dot.pipe(format='json0'))
+        p.add(len(dot.body))
+    positions = {}
+    for o in laid_out.get('objects',[]):
+        # clusters are objects too, but have a bounding box instead of pos
+        if 'pos' in o and 'nodes' not in o:
+            x,y = o['pos'].split(',')
+            positions[o['name']] = (float(x),float(y))
+    return positions
 
 # *****************************************************************************
-def prefix(subsystem,component):
-    """ Establish prefix given subsystem and component
+def make_pinned_dot(graph, opts, posfile):
+    """ Create the graphviz graph, reusing node positions from a previous plot
 
-    Model files specify subsystem and component names. However,
-    these do not necessarily need to match the prefix
-    of a component. That mapping is provided by the component-model.conf
-    which specifies the component prefix. This routine makes
-    use of the global prefix_dict to get the prefix
+    Nodes from the previous layout whose signature (see node_signatures())
+    hasn't changed are pinned where they were, nodes that changed start
+    from where they were, and graphviz only has to place new nodes, so
+    the layout is faster and the diagram stays stable between revisions.
+    The resulting positions are saved back to posfile, and the returned
+    graph has every node pinned so that rendering it repeats the layout
+    exactly. Nothing is laid out if no node changed.
+
+    Only the layouts in hint_layouts use positions; sfdp can't pin nodes
+    so they are only starting positions there.
 
     Args:
-        subsystem (str): subsystem name from model files
-        component (str): component name from model files
+        graph (RelationshipGraph): relationships to plot
+        opts (dict): plot options (see default_options())
+        posfile (str): positions file, created if it doesn't exist
 
     Returns:
-        pref (str): The prefix if successful, error message if it failed
-        failed (bool): Flag is True if it failed
+        Digraph: the graph
     """
-    pref = None
-    failed = None
-    if subsystem not in prefix_dict:
-        failed = "Error: don't know subsystem "+subsystem
-    elif component not in prefix_dict[subsystem]:
-        failed = "Error: "+component+" not in subsystem "+subsystem
+    layout = opts['layout']
+    if layout not in hint_layouts:
+        print('Warning: layout %s ignores node positions, use one of %s' %
+            (layout,', '.join(hint_layouts)))
+        return make_dot(graph,opts)
+    pin = '!' if layout in pinnable_layouts else ''
+
+    previous = read_positions(posfile,layout)
+    signatures = node_signatures(graph,opts)
+    hints = {}
+    for name,sig in signatures.items():
+        if name in previous:
+            pos,oldsig = previous[name]
+            hints[name] = '%g,%g' % tuple(pos) + (pin if sig == oldsig else '')
+
+    if previous.keys() == signatures.keys() and \
+       all(previous[name][1] == sig for name,sig in signatures.items()):
+        positions = {name:pos for name,(pos,_) in previous.items()}
     else:
-         pref = prefix_dict[subsystem][component]
-    return pref,failed
+        positions = layout_positions(make_dot(graph,opts,hints))
+        write_positions(posfile,layout,positions,signatures)
+
+    dot = make_dot(graph,opts,{name:'%g,%g!' % tuple(pos)
+                               for name,pos in positions.items()})
+    if layout not in pinnable_layouts:
+        dot.graph_attr['layout'] = 'neato'
+    return dot
 
 # *****************************************************************************
-# read database
-def read_database():
-    """ Read information from the database into globals
+def render_hash(dot):
+    """ Hash identifying the output graphviz would produce for a graph
 
-    Connect to the database and populate the following globals:
-    prefix_dict, all_prefixes, pub_dict, sub_dict, cmd_comp_dict, cmd_dict
+    Args:
+        dot (Digraph): the graph
+
+    Returns:
+        str: hex digest of the layout engine, output format and dot source
     """
+    h = hashlib.sha256()
+    for s in (dot.engine, dot.format, dot.source):
+        h.update(s.encode())
+        h.update(b'\0')
+    return h.hexdigest()
 
-    client = MongoClient()
-    db = client['icds']
+# *****************************************************************************
+def render(dot, imagefile=None, dotfile=None, showplot=False, cache=False):
+    """ Render a graph and/or write out its dot source
 
-    # Each collection corresponds to an individual model file. The
-    # name of each collection is of the form:
-    #  (subsystem).(component).(modelfiletype)
-    collection_names = set(db.list_collection_names())
+    If cache is True the hash of the dot source (see render_hash()) is
+    stored alongside the image, and graphviz is skipped when the image
+    already exists with a matching hash. The dotfile is only rewritten if
+    its contents change. If there is no image, display or dotfile either,
+    a warning that no plot was generated is printed.
 
-    # Dictionary maps subsystem -> component -> prefix
-    for name in collection_names:
-        # We get the prefixes out of the component-model files
-        match = re.match('(\w+)\.(.*)\.component',name)
-        if match:
-            subsystem=match.group(1)
-            component=match.group(2)
+    Args:
+        dot (Digraph): the graph
+        imagefile (str): image file name without extension (None to skip)
+        dotfile (str): dot source file (None to skip)
+        showplot (bool): display the plot in a window
+        cache (bool): reuse an existing image rendered from the same source
+    """
+    if dotfile:
+        source = dot.source
+        try:
+            with open(dotfile) as f:
+                unchanged = cache and f.read() == source
+        except OSError:
+            unchanged = False
+        if not unchanged:
+            with open(dotfile,'w') as f:
+                f.write(source)
 
-            collection = db[name]
-            cursor = collection.find()
-            datadict = cursor.next()
-            component_prefix = datadict['prefix']
-            component_type = datadict['componentType'] #HCD, Assembly, Sequencer, Application
+    if showplot or imagefile:
+        hashfile = None
+        if cache and imagefile and not showplot:
+            outfile = imagefile+'.'+dot.format
+            hashfile = outfile+'.sha256'
+            key = render_hash(dot)
+            try:
+                with open(hashfile) as f:
+                    if f.read().strip() == key and os.path.exists(outfile):
+                        return
+            except OSError:
+                pass
+        with icdProfile.phase('dot.render') as p:
+            dot.render(cleanup=True,view=showplot,filename=imagefile)
+            p.add(len(dot.body))
+        if hashfile:
+            with open(hashfile,'w') as f:
+                f.write(key+'\n')
+    elif not dotfile:
+        print("Neither --showplot nor --imagefile specified, no plot generated")
 
-            if subsystem not in prefix_dict:
-                prefix_dict[subsystem] = {}
+# *****************************************************************************
+def graph_model(graph):
+    """ Describe a graph using plain python types
 
-            prefix_dict[subsystem][component] = component_prefix
-            component_types[component_prefix] = component_type
-            all_prefixes.add(component_prefix)
-            #print("Found: ", subsystem, component, component_prefix)
+    Commands and events on edges are given by their short names, and
+    missing commands/events by their full names.
 
-    # Dictionary of all events, telemetry, alarms pointing to
-    # components that publish them
-    for name in collection_names:
-        # Extract this information from the publish-model files
-        match = re.match('(\w+)\.(.*)\.publish',name)
-        if match:
-            subsystem=match.group(1)
-            component=match.group(2)
-            p,failed = prefix(subsystem,component)
-            if failed:
-                print('pub events',name,failed)
-                continue
-            
-            collection = db[name]
-            cursor = collection.find()
-            d = cursor.next()
-            if 'publish' in d:
-                publish = d['publish']
-
-                for pubtype in ['events','telemetry','alarms']:
-                    if pubtype in publish:
-                        for item in publish[pubtype]:
-                            pub_dict[pubtype][p+'.'+item['name']] = p
-                        
-    # Dictionary of all events, telemetry subscribed to by each component
-    for name in collection_names:
-        # Extract this information from the subscribe-model files
-        match = re.match('(\w+)\.(.*)\.subscribe',name)
-        if match:
-            subsystem=match.group(1)
-            component=match.group(2)
-            p,failed = prefix(subsystem,component)
-            if failed:
-                print('sub events',name,failed)
-                continue
-            
-            collection = db[name]
-            cursor = collection.find()
-            d = cursor.next()
-            if 'subscribe' in d:
-                subscribe = d['subscribe']
-
-                for subtype in ['events','telemetry']:
-                    if subtype in subscribe:
-                        for item in subscribe[subtype]:
-                            if p not in sub_dict:
-                                sub_dict[p] = {}
-                            if subtype not in sub_dict[p]:
-                                sub_dict[p][subtype] = set()
-                            pubprefix,failed = prefix(item['subsystem'],item['component'])
-                            if failed:
-                                # Can't identify the publisher
-                                print("event not published for",p,failed)
-                                pubprefix = item['subsystem']+'.'+item['component']
-                            sub_dict[p][subtype].add(pubprefix+'.'+item['name'])
-                            #print(p,"subscribes to",pubprefix+'.'+item['name'])
+    Args:
+        graph (RelationshipGraph): relationships to describe
 
-    # Dictionaries containing mapping of components->commands received and sent, and commands->components that receive
-    for name in collection_names:
-        # Extract this information from the command-model files
-        match = re.match('(\w+)\.(.*)\.command',name)
-        if match:
-            subsystem=match.group(1)
-            component=match.group(2)
-            p,failed = prefix(subsystem,component)
-            if failed:
-                print('commands',name,failed)
-                continue
-            
-            collection = db[name]
-            cursor = collection.find()
-            command = cursor.next()
-        
-            for cmdtype in ['send','receive']:
-                if cmdtype in command:
-                    for item in command[cmdtype]:
-                        if p not in cmd_comp_dict:
-                            cmd_comp_dict[p] = {}
-                        if cmdtype not in cmd_comp_dict[p]:
-                            cmd_comp_dict[p][cmdtype] = set()
-
-                        if cmdtype == 'send':
-                            cmdprefix,failed = prefix(item['subsystem'],item['component'])
-                        else:
-                            cmdprefix = p
-
-                        if not cmdprefix:
-                            continue
-                        itemName = cmdprefix+'.'+item['name']
-
-                        if cmdtype == 'receive':
-                            cmd_dict[itemName] = p
-
-                        cmd_comp_dict[p][cmdtype].add(itemName)
-                        
-# *****************************************************************************
-def define_nodes(g, nodes, col, shortlabel):
-    """ Define nodes in a graph
+    Returns:
+        dict: with keys
+            nodes: list of {id, subsystem, type, primary, group}
+            commands: list of {sender, receiver, items}
+            events: list of {publisher, subscriber, items, bytes_per_s,
+                uncounted} (see graph_bandwidth())
+            cmd_no_sender: prefix -> list of commands nobody sends
+            ev_no_publisher: prefix -> list of events nobody publishes
+    """
+    name = graph.name
+    label = graph.store.label
+    full = graph.store.items.names
+    nodes = []
+    for node in graph.sorted_nodes(graph.nodes):
+        nodes.append({
+            'id': name(node),
+            'subsystem': name(node).split('.')[0],
+            'type': component_types.get(name(node)),
+            'primary': node in graph.primary_nodes,
+            'group': graph.groups.get(node)
+            })
+    commands = [{'sender':name(a),'receiver':name(b),
+                 'items':sorted(label(i) for i in items)}
+                for (a,b),items in graph.sorted_pairs(graph.cmd_pairs)]
+    ev_bandwidth,_ = graph_bandwidth(graph)
+    events = [{'publisher':name(a),'subscriber':name(b),
+               'items':sorted(label(i) for i in items),
+               'bytes_per_s':ev_bandwidth[a,b][0],
+               'uncounted':ev_bandwidth[a,b][1]}
+              for (a,b),items in graph.sorted_pairs(graph.ev_pairs)]
+    return {
+        'nodes': nodes,
+        'commands': commands,
+        'events': events,
+        'cmd_no_sender': {name(p):sorted(full[i] for i in graph.cmd_no_sender[p])
+            for p in graph.sorted_nodes(graph.cmd_no_sender)},
+        'ev_no_publisher': {name(p):sorted(full[i] for i in graph.ev_no_publisher[p])
+            for p in graph.sorted_nodes(graph.ev_no_publisher)}
+        }
 
-    Add supplied nodes to the supplied graph.
-    Primary nodes and secondary nodes have a different style.
-    The subroutine will also create dummy nodes corresponding to
-    any node that has missing commands/events.
+# *****************************************************************************
+def write_json(graph, filename):
+    """ Write a graph as JSON (see graph_model())
 
-    This routine may be called on a subgraph.
+    Args:
+        graph (RelationshipGraph): relationships to write
+        filename (str): output file
+    """
+    with open(filename,'w') as f:
+        json.dump(graph_model(graph),f,indent=1)
+
+# *****************************************************************************
+def write_graphml(graph, filename):
+    """ Write a graph as GraphML
+
+    Nodes carry subsystem, type and primary data, plus the commands and
+    events nobody sends/publishes to them. Every command and event edge
+    carries its kind, the newline-separated item names and their count.
 
     Args:
-        g (Digraph): graph object for which nodes are being defined
-        nodes (iterable): list of node prefixes
-        col (str): colour for the nodes
-        shortlabel (bool): if true just component label instead of full prefix
+        graph (RelationshipGraph): relationships to write
+        filename (str): output file
     """
-    for node in nodes:
-            # Create nodes for components 
-            parts = node.split('.')  
-            component = '.'.join(parts[1:])
-            if shortlabel:
-                label = component
-            else:
-                label = node
-            if node in primary_nodes:
-                style='bold'
-            else:
-                style='dashed'
-            g.node(node,label,fontcolor=col,color=col,style=style)
+    model = graph_model(graph)
+
+    root = ET.Element('graphml',xmlns='http://graphml.graphdrawing.org/xmlns')
+    keys = [('subsystem','node','string'), ('type','node','string'),
+            ('primary','node','boolean'), ('group','node','string'),
+            ('cmd_no_sender','node','string'), ('ev_no_publisher','node','string'),
+            ('kind','edge','string'), ('items','edge','string'),
+            ('count','edge','int')]
+    for name,domain,datatype in keys:
+        ET.SubElement(root,'key',{'id':name,'for':domain,
+            'attr.name':name,'attr.type':datatype})
+    g = ET.SubElement(root,'graph',id='icd',edgedefault='directed')
+
+    def data(parent, key, value):
+        ET.SubElement(parent,'data',key=key).text = value
+
+    for node in model['nodes']:
+        n = ET.SubElement(g,'node',id=node['id'])
+        data(n,'subsystem',node['subsystem'])
+        if node['type']:
+            data(n,'type',node['type'])
+        data(n,'primary','true' if node['primary'] else 'false')
+        if node['group']:
+            data(n,'group',node['group'])
+        for key in ('cmd_no_sender','ev_no_publisher'):
+            if node['id'] in model[key]:
+                data(n,key,'\n'.join(model[key][node['id']]))
+
+    for kind,tail,head in (('commands','sender','receiver'),
+                           ('events','publisher','subscriber')):
+        for i,edge in enumerate(model[kind]):
+            e = ET.SubElement(g,'edge',{'id':'%s%d' % (kind[0],i),
+                'source':edge[tail],'target':edge[head]})
+            data(e,'kind',kind[:-1])
+            data(e,'items','\n'.join(edge['items']))
+            data(e,'count',str(len(edge['items'])))
+
+    ET.ElementTree(root).write(filename,encoding='utf-8',xml_declaration=True)
 
-            # Create dummy node for commands nobody sends
-            if missingcommands and node in cmd_no_sender:
-                g.node(node+suffix_nocmd,'?',fontcolor=nocmdcol,color=nocmdcol)
+# *****************************************************************************
+def write_npy(filename, values):
+    """ Write an array in NumPy .npy format
 
-            # Create dummy node for required events nobody sends
-            if missingevents and node in ev_no_publisher:
-                g.node(node+suffix_noev,'?',fontcolor=noevcol,color=noevcol)
+    The data follow a fixed-size header, so numpy.load(filename,
+    mmap_mode='r') maps them without copying.
+
+    Args:
+        filename (str): output file
+        values (array): one-dimensional array.array of integers
+    """
+    order = '<' if sys.byteorder == 'little' else '>'
+    header = "{'descr': '%si%d', 'fortran_order': False, 'shape': (%d,), }" % \
+        (order,values.itemsize,len(values))
+    # magic (6) + version (2) + header length (2) + header, padded to 64
+    header += ' '*(63 - (10+len(header)) % 64) + '\n'
+    with open(filename,'wb') as f:
+        f.write(b'\x93NUMPY\x01\x00')
+        f.write(len(header).to_bytes(2,'little'))
+        f.write(header.encode('latin1'))
+        values.tofile(f)
+
+# *****************************************************************************
+def write_csr(graph, dirname):
+    """ Write a graph as integer-indexed CSR adjacency arrays
+
+    Nodes are numbered in sorted order. For each of commands and events
+    three .npy arrays are written: <kind>_indptr (int64, nodes+1 entries),
+    <kind>_indices (int32 destination node numbers) and <kind>_data (int32
+    number of items on each edge), so that row i lists the edges leaving
+    node i. With NumPy/SciPy:
+
+        n = len(json.load(open('nodes.json'))['nodes'])
+        a = [numpy.load(dirname+'/commands_'+k+'.npy', mmap_mode='r')
+             for k in ('data','indices','indptr')]
+        m = scipy.sparse.csr_matrix(tuple(a), shape=(n,n))
+
+    nodes.json holds the node list of graph_model() and the missing
+    commands/events.
+
+    Args:
+        graph (RelationshipGraph): relationships to write
+        dirname (str): output directory
+    """
+    os.makedirs(dirname,exist_ok=True)
+    model = graph_model(graph)
+    index = {node:i for i,node in enumerate(graph.sorted_nodes(graph.nodes))}
+
+    for kind,pairs in (('commands',graph.cmd_pairs),('events',graph.ev_pairs)):
+        rows = [[] for i in range(len(index))]
+        for (a,b),items in pairs.items():
+            rows[index[a]].append((index[b],len(items)))
+        indptr = array('q',[0])
+        indices = array('i')
+        data = array('i')
+        for row in rows:
+            row.sort()
+            indices.extend(j for j,n in row)
+            data.extend(n for j,n in row)
+            indptr.append(len(indices))
+        for name,values in (('indptr',indptr),('indices',indices),('data',data)):
+            write_npy(os.path.join(dirname,kind+'_'+name+'.npy'),values)
+
+    with open(os.path.join(dirname,'nodes.json'),'w') as f:
+        json.dump({'nodes':model['nodes'],
+                   'cmd_no_sender':model['cmd_no_sender'],
+                   'ev_no_publisher':model['ev_no_publisher']},f,indent=1)
+
+# *****************************************************************************
+def svg_source(dot):
+    """ Lay out and render a graph as SVG
+
+    Args:
+        dot (Digraph): the graph
+
+    Returns:
+        str: the <svg> element, without the XML prolog
+    """
+    with icdProfile.phase('dot.render') as p:
+        svg = dot.pipe(format='svg').decode()
+        p.add(len(dot.body))
+    return svg[svg.find('<svg'):]
+
+# *****************************************************************************
+def write_html(graph, filename, opts, jobs=1):
+    """ Write a self-contained interactive explorer of a graph
+
+    The page embeds graph_model() as JSON and one SVG per subsystem with
+    primary components, plotting all relationships of those primaries with
+    every label and missing item so that the browser can hide them. The
+    SVGs are only parsed when their subsystem is first shown, and
+    components can be filtered, selected to highlight their neighbours,
+    and inspected without running anything else (see icdExplorer.html).
+
+    Args:
+        graph (RelationshipGraph): relationships to explore
+        filename (str): HTML output file
+        opts (dict): plot options (see default_options())
+        jobs (int): number of subsystem plots rendered at once
+    """
+    primaries = {}
+    for node in graph.primary_nodes:
+        if node not in graph.groups:
+            p = graph.name(node)
+            primaries.setdefault(p.split('.')[0],set()).add(p)
+
+    view_opts = dict(opts,missingevents=True,missingcommands=True,
+        eventlabels=True,commandlabels=True)
+    with ThreadPoolExecutor(max_workers=max(1,jobs)) as pool:
+        futures = [(subsystem,pool.submit(svg_source,
+                        make_dot(build_graph(primaries[subsystem]),view_opts)))
+                   for subsystem in sorted(primaries)]
+        views = [(subsystem,future.result()) for subsystem,future in futures]
+
+    def embed(value):
+        # keep "</" and "<!--" (the SVG has comments) from ending or
+        # confusing the script element, by escaping them the JSON way
+        return json.dumps(value,separators=(',',':')).replace('</','<\\/')\
+            .replace('<!--','\\u003c!--')
+
+    data = {
+        'model': graph_model(graph),
+        'subsystems': [subsystem for subsystem,_ in views],
+        'show': {'evlabels':opts['eventlabels'], 'cmdlabels':opts['commandlabels'],
+                 'missingev':opts['missingevents'], 'missingcmd':opts['missingcommands']},
+        'cmdcol': cmdcol,
+        'suffix_nocmd': suffix_nocmd,
+        'suffix_noev': suffix_noev
+        }
+    fields = {
+        'TITLE': html.escape('ICD relationships: '+', '.join(data['subsystems'])),
+        'MODEL': embed(data),
+        'VIEWS': '\n'.join('<script type="application/json" id="view-%s">%s</script>' %
+                           (html.escape(subsystem),embed(svg)) for subsystem,svg in views)
+        }
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'icdExplorer.html')) as f:
+        page = re.sub('@(TITLE|MODEL|VIEWS)@',lambda m: fields[m.group(1)],f.read())
+    with open(filename,'w') as f:
+        f.write(page)
+
+# *****************************************************************************
+def export(graph, jsonfile=None, graphmlfile=None, csrdir=None):
+    """ Write a graph in each of the requested machine-readable formats
+
+    Args:
+        graph (RelationshipGraph): relationships to write
+        jsonfile (str): JSON output file (None to skip)
+        graphmlfile (str): GraphML output file (None to skip)
+        csrdir (str): CSR output directory (None to skip)
+    """
+    if jsonfile:
+        write_json(graph,jsonfile)
+    if graphmlfile:
+        write_graphml(graph,graphmlfile)
+    if csrdir:
+        write_csr(graph,csrdir)
+
+# *****************************************************************************
+def read_manifest(filename, opts):
+    """ Read a batch manifest of plot specifications
+
+    The manifest is a JSON list with one object per plot, e.g.
+
+        [{"components": "iris.rotator", "imagefile": "rotator"},
+         {"subsystems": ["iris","nfiraos"], "layout": "neato",
+          "eventlabels": false, "imagefile": "aos", "format": "png"}]
+
+    Each object may contain components, subsystems (comma-separated strings
+    or lists), imagefile, dotfile, format (graphviz output format),
+    jsonfile, graphmlfile, csrdir (see export()), htmlfile (see
+    write_html()), positions (see make_pinned_dot()), and any of
+    plot_options, which override the values in opts for that plot only.
+
+    Args:
+        filename (str): manifest file
+        opts (dict): default plot options
+
+    Returns:
+        list: one dict per plot with keys components, subsystems,
+            imagefile, dotfile, format, jsonfile, graphmlfile, csrdir,
+            htmlfile, positions, opts
+    """
+    with open(filename) as f:
+        manifest = json.load(f)
+
+    def aslist(value):
+        if isinstance(value,str):
+            return [v for v in value.split(',') if v]
+        return list(value)
+
+    specs = []
+    for i,entry in enumerate(manifest):
+        spec = {
+            'components': aslist(entry.get('components',[])),
+            'subsystems': aslist(entry.get('subsystems',[])),
+            'imagefile': entry.get('imagefile'),
+            'dotfile': entry.get('dotfile'),
+            'format': entry.get('format'),
+            'jsonfile': entry.get('jsonfile'),
+            'graphmlfile': entry.get('graphmlfile'),
+            'csrdir': entry.get('csrdir'),
+            'htmlfile': entry.get('htmlfile'),
+            'positions': entry.get('positions'),
+            'opts': dict(opts)
+        }
+        for key,value in entry.items():
+            if key in spec:
+                continue
+            if key not in plot_options:
+                raise Exception('Unknown key "%s" in plot %d of %s' % (key,i,filename))
+            if key in ('omittypes','expand'):
+                value = set(aslist(value))
+            elif isinstance(opts[key],bool) and isinstance(value,str):
+                value = str2bool(value)
+            elif isinstance(opts[key],int) and isinstance(value,str):
+                value = int(value)
+            spec['opts'][key] = value
+        if not spec['components'] and not spec['subsystems']:
+            raise Exception('Plot %d of %s has no components or subsystems' % (i,filename))
+        if not any(spec[k] for k in ('imagefile','dotfile','jsonfile',
+                                         'graphmlfile','csrdir','htmlfile')):
+            raise Exception('Plot %d of %s has no output files' % (i,filename))
+        specs.append(spec)
+    return specs
+
+# *****************************************************************************
+def run_batch(specs, jobs):
+    """ Produce many plots from the relationships already in memory
+
+    The graphs are built one after the other from the shared indexes, and
+    the graphviz layout/render subprocesses (including the layouts of plots
+    with node positions files) are run in a pool of jobs threads.
+
+    Args:
+        specs (list): output of read_manifest()
+        jobs (int): maximum number of concurrent renders
+
+    Returns:
+        int: number of plots that failed
+    """
+    def plot(graph, spec):
+        if spec['positions']:
+            dot = make_pinned_dot(graph,spec['opts'],spec['positions'])
+        else:
+            dot = make_dot(graph,spec['opts'])
+        if spec['format']:
+            dot.format = spec['format']
+        render(dot,spec['imagefile'],spec['dotfile'],False,rendercache)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1,jobs)) as pool:
+        futures = []
+        for spec in specs:
+            graph,distance = relationship_graph(spec['components'],
+                spec['subsystems'],spec['opts'])
+            graph = aggregate_graph(graph,spec['opts']['aggregate'],
+                spec['opts']['expand'],spec['opts']['expanddegree'])
+            export(graph,spec['jsonfile'],spec['graphmlfile'],spec['csrdir'])
+            if spec['htmlfile']:
+                futures.append((spec,pool.submit(write_html,graph,
+                    spec['htmlfile'],spec['opts'])))
+            if spec['imagefile'] or spec['dotfile']:
+                futures.append((spec,pool.submit(plot,graph,spec)))
+
+        for spec,future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print('Error: plot',spec['imagefile'] or spec['dotfile'] or
+                    spec['htmlfile'],'failed:',e)
+    return failed
 
 # *****************************************************************************
 def str2bool(s):
@@ -363,19 +2625,76 @@ icdRelationships.py --components iris.rotator --subsystems nfiraos,tcs \\
 icdRelationships.py --subsystems iris --layout neato --eventlabels false \\
     --overlap false
 
+# Plot a subsystem straight from a checkout of the model files, without
+# importing them into the database first
+
+icdRelationships.py --subsystems iris --modeldir ICD-Model-Files
+
+# Produce all of the plots listed in a manifest (see read_manifest()),
+# rendering up to 8 at a time
+
+icdRelationships.py --batch plots.json --jobs 8
+
+# Keep the layout of a large plot stable between model revisions: only
+# new or changed components are placed, the rest stay where they were
+
+icdRelationships.py --subsystems iris --layout neato --imagefile iris \\
+    --showplot false --positions iris-positions.json
+
+# Overview of the whole observatory with one node per subsystem, except
+# for the IRIS components and any component with more than 10 neighbours
+
+icdRelationships.py --subsystems nfiraos,iris,tcs,aoesw --aggregate subsystem \\
+    --expand iris --expanddegree 10
+
+# Show everything affected, within 3 hops, by a change to a component
+
+icdRelationships.py --components nfiraos.rtc --hops 3 --direction down
+
+# Estimate the event bandwidth between the AO subsystems, from the event
+# rates and attribute types in the models
+
+icdRelationships.py --subsystems nfiraos,aoesw --bandwidth true
+
+# Check every interface in the database, e.g. on each model file commit
+
+icdRelationships.py --modeldir ICD-Model-Files --lint lint.json
+
+# Export every relationship in the database for other tools, without
+# plotting
+
+icdRelationships.py --subsystems all --omittypes '' --showplot false \\
+    --jsonfile icd.json --graphmlfile icd.graphml --csrdir icd-csr
+
+# Explore every subsystem in a browser, filtering components, highlighting
+# neighbours and toggling labels without running anything again
+
+icdRelationships.py --subsystems all --showplot false --htmlfile icd.html
+
 """ % (cmdcol,evcol,nocmdcol,noevcol, \
     'subsystems:\n'+'\n'.join(['    '+k+' - '+v for k,v in subsystem_colours.items()])
     ))
     parser.add_argument("--components", type=str, nargs="?",
         help="Comma-separated list of primary component prefixes")
     parser.add_argument("--subsystems", type=str, nargs="?",
-        help="Comma-separated list of subsystem prefixes")
+        help="Comma-separated list of subsystem prefixes, or all")
     parser.add_argument("--showplot", default=str(showplot), nargs="?",
         help="Display plot in a window (default=%s)"%str(showplot) )
     parser.add_argument("--imagefile", default=imagefile, nargs="?",
         help="Write image to file (default=%s)"%str(imagefile) )
     parser.add_argument("--dotfile", default=dotfile, nargs="?",
         help="Write dot source to file (default=%s)"%str(dotfile) )
+    parser.add_argument("--jsonfile", default=jsonfile, nargs="?",
+        help="Write relationships as JSON to file (default=%s)"%str(jsonfile) )
+    parser.add_argument("--graphmlfile", default=graphmlfile, nargs="?",
+        help="Write relationships as GraphML to file (default=%s)"%str(graphmlfile) )
+    parser.add_argument("--csrdir", default=csrdir, nargs="?",
+        help="Write relationships as CSR adjacency arrays to directory (default=%s)"%str(csrdir) )
+    parser.add_argument("--htmlfile", default=htmlfile, nargs="?",
+        help="Write an interactive explorer of the relationships to this HTML file (default=%s)"%str(htmlfile) )
+    parser.add_argument("--lint", default=lintfile, nargs="?",
+        help="Check every component and write a JSON report to file, - for stdout.\n"
+             "Exits with status 1 if there are errors (default=%s)"%str(lintfile) )
     parser.add_argument("--ratio", default=ratio, nargs="?",
         help="Image aspect ratio (y/x) (default=%s)"%ratio )
     parser.add_argument("--missingevents", default=str(missingevents), nargs="?",
@@ -398,6 +2717,46 @@ icdRelationships.py --subsystems iris --layout neato --eventlabels false \\
         help="Comma-separated list of component types (%s) to omit as primaries (default=%s)" % \
             (','.join(possible_types),omittypes) ) 
 
+    parser.add_argument("--mongo", default=mongo_uri, nargs="?",
+        help="URI of the MongoDB server holding the ICD (default=%s)"%str(mongo_uri) )
+    parser.add_argument("--database", default=database, nargs="?",
+        help="Name of the ICD database (default=%s)"%database )
+    parser.add_argument("--fetchjobs", default=fetch_jobs, type=int, nargs="?",
+        help="Number of database queries in flight at once (default=%d)"%fetch_jobs )
+    parser.add_argument("--selective", default=str(selective), nargs="?",
+        help="Only read the collections needed for the primaries, when not using --hops, --lint or --batch,\n"
+             "and --cache-dir is empty (otherwise the complete snapshot is read or restored) (default=%s)"%str(selective) )
+    parser.add_argument("--modeldir", default=modeldir, nargs="?",
+        help="Read a model file tree instead of the icds database (default=%s)"%str(modeldir) )
+    parser.add_argument("--jobs", default=jobs, type=int, nargs="?",
+        help="Number of model file parsers and batch renders run at once (default=%d)"%jobs )
+    parser.add_argument("--bandwidth", default=str(bandwidth), nargs="?",
+        help="Label event edges and components with estimated bytes/s and list them (default=%s)"%str(bandwidth) )
+    parser.add_argument('--aggregate', default=aggregate, choices=possible_aggregates, nargs="?",
+        help="Collapse components into one node per subsystem or per component type (default=%s)"%aggregate)
+    parser.add_argument("--expand", default=','.join(expand), type=str, nargs="?",
+        help="Comma-separated list of subsystems not collapsed by --aggregate (default=%s)"%','.join(expand) )
+    parser.add_argument("--expanddegree", default=expanddegree, type=int, nargs="?",
+        help="Components with more neighbours are not collapsed by --aggregate, 0 to disable (default=%d)"%expanddegree )
+    parser.add_argument("--hops", default=hops, type=int, nargs="?",
+        help="Follow relationships this many hops from the primaries, 0 for direct only (default=%d)"%hops )
+    parser.add_argument('--direction', default=direction, choices=possible_directions, nargs="?",
+        help="Follow --hops downstream (to receivers/subscribers), upstream or both (default=%s)"%direction)
+    parser.add_argument("--rendercache", default=str(rendercache), nargs="?",
+        help="Skip graphviz when an image from identical dot source exists (default=%s)"%str(rendercache) )
+    parser.add_argument("--positions", default=positions, nargs="?",
+        help="Reuse node positions saved in this file by a previous neato/fdp/sfdp plot, and update it (default=%s)"%str(positions) )
+    parser.add_argument("--batch", default=batch, nargs="?",
+        help="JSON manifest of plots to produce from one database load (default=%s)"%str(batch) )
+    parser.add_argument("--cache-dir", default=cache_dir, nargs="?",
+        help="Directory for the database snapshot cache, empty to disable (default=%s)"%cache_dir )
+    parser.add_argument("--refresh-cache", action="store_true",
+        help="Ignore and rewrite the database snapshot cache")
+    parser.add_argument("--strict-cache", default=str(strict_cache), nargs="?",
+        help="Validate the snapshot cache with a dbHash checksum of every collection instead of collStats (default=%s)"%str(strict_cache) )
+    parser.add_argument("--profile", default=str(profile), nargs="?",
+        help="Report time and memory used by each phase on stderr; NIC_PROFILE can also select json or a file to append to (default=%s)"%str(profile) )
+
     args = parser.parse_args()
 
     components = set()
@@ -410,6 +2769,10 @@ icdRelationships.py --subsystems iris --layout neato --eventlabels false \\
     showplot = str2bool(args.showplot)
     imagefile = args.imagefile
     dotfile = args.dotfile
+    jsonfile = args.jsonfile
+    graphmlfile = args.graphmlfile
+    csrdir = args.csrdir
+    htmlfile = args.htmlfile
     ratio=args.ratio
     missingevents = str2bool(args.missingevents)
     missingcommands = str2bool(args.missingcommands)
@@ -419,223 +2782,105 @@ icdRelationships.py --subsystems iris --layout neato --eventlabels false \\
     layout = args.layout
     overlap = args.overlap
     splines = args.splines
-    if args.omittypes:
-        omittypes = set(args.omittypes.split(','))
-
-    if not components and not subsystems:
-        print("Need to specify at least --components or --subsystems. For help:\n"+\
+    if args.omittypes is not None:
+        omittypes = set(t for t in args.omittypes.split(',') if t)
+    cache_dir = args.cache_dir
+    refresh_cache = args.refresh_cache
+    strict_cache = str2bool(args.strict_cache)
+    mongo_uri = args.mongo
+    database = args.database
+    fetch_jobs = args.fetchjobs
+    selective = str2bool(args.selective)
+    modeldir = args.modeldir
+    jobs = args.jobs
+
+    positions = args.positions
+    batch = args.batch
+    lintfile = args.lint
+    rendercache = str2bool(args.rendercache)
+    aggregate = args.aggregate
+    if args.expand:
+        expand = set(args.expand.split(','))
+    expanddegree = args.expanddegree
+    hops = args.hops
+    direction = args.direction
+    bandwidth = str2bool(args.bandwidth)
+    profile = str2bool(args.profile)
+
+    if icdProfile.configure('true' if profile else None):
+        def edges(graph):
+            return len(graph.cmd_pairs)+len(graph.ev_pairs)
+        icdProfile.instrument(globals(),
+            ['read_database','read_selected','read_modeldir','build_indexes','lint',
+             'build_graph','impact_graph','aggregate_graph','make_dot','export',
+             'write_html'],
+            {'read_database': lambda r: len(all_prefixes),
+             'read_selected': lambda r: len(all_prefixes),
+             'read_modeldir': lambda r: len(all_prefixes),
+             'build_indexes': lambda r: len(store.items),
+             'build_graph': edges,
+             'impact_graph': lambda r: edges(r[0]),
+             'aggregate_graph': edges,
+             'make_dot': lambda dot: len(dot.body)})
+
+    if not batch and not lintfile and not components and not subsystems:
+        print("Need to specify at least --components, --subsystems or --batch. For help:\n"+\
             "  icdRelationships.py -h")
         sys.exit(0)
 
-    # Populate globals with information from the database
-    read_database()
-
-    # Add components from user-specified subsystems
-    if subsystems:
-        for p in all_prefixes:
-            subsystem = p.split('.')[0]
-            if subsystem in subsystems:
-                components.add(p)
+    opts = default_options()
+    if batch:
+        specs = read_manifest(batch,opts)
+    if lintfile:
+        # problems are reported by lint() instead
+        report_unresolved = False
+
+    # Populate globals with information from the database or model files
+    read_icd(components,subsystems,omittypes,
+             bool(lintfile or batch or hops or 'all' in subsystems))
+    build_indexes()
+
+    if lintfile:
+        report = lint()
+        if lintfile == '-':
+            json.dump(report,sys.stdout,indent=1)
+            print()
+        else:
+            with open(lintfile,'w') as f:
+                json.dump(report,f,indent=1)
+        print('%d errors, %d warnings' % (report['errors'],report['warnings']),
+            file=sys.stderr)
+        sys.exit(1 if report['errors'] else 0)
 
-    # Remove primary components if they are in omittypes
-    if omittypes:
-        components = {c for c in components if component_types[c] not in omittypes}
+    if batch:
+        failed = run_batch(specs,jobs)
+        sys.exit(1 if failed else 0)
 
     # ***************************************************************
     # Iterate over primary components and establish all of the 
     # relationships required to make the plots
-    for p in components:
-        if p not in all_prefixes:
-            print("Error: don't know",p)
-            continue
-        all_nodes.add(p)
-        primary_nodes.add(p)
-
-        # *************************************************
-        # edges for all commands sent to component
-        cmds_sent = set()
-        for comp in cmd_comp_dict:
-            if 'send' in cmd_comp_dict[comp]:
-                for cmd in cmd_comp_dict[comp]['send']:
-                    if (cmd in cmd_dict) and (cmd_dict[cmd] == p):
-                        c_name = cmd.split('.')[-1]
-                        pair = comp+','+p
-                        if pair not in cmd_pairs:
-                            cmd_pairs[pair] = []
-                        cmd_pairs[pair].append(c_name)
-                        all_nodes.add(comp)
-                        cmds_sent.add(cmd)
-                        #dot.edge(comp,p,label=c_name)
-
-        # *************************************************
-        # identify commands that no one sends to this component
-        if p in cmd_comp_dict and 'receive' in cmd_comp_dict[p]:
-            recv = set(cmd_comp_dict[p]['receive'])
-            diff = recv.difference(cmds_sent)
-            if diff:
-                cmd_no_sender[p] = set()
-                for cmd in diff:
-                    name = cmd.split('.')[-1]
-                    cmd_no_sender[p].add(name)
-
-        # *************************************************
-        # edges for all commands sent from component
-        if (p in cmd_comp_dict) and ('send' in cmd_comp_dict[p]):
-            for cmd in cmd_comp_dict[p]['send']:
-                if cmd in cmd_dict:
-                    c_name = cmd.split('.')[-1]
-                    pair = p+','+cmd_dict[cmd]
-                    if pair not in cmd_pairs:
-                        cmd_pairs[pair] = []
-                    cmd_pairs[pair].append(c_name)
-                    all_nodes.add(cmd_dict[cmd])
-                    #dot.edge(p,cmd_dict[cmd],label=c_name)
-                else:
-                    print('Error: command',cmd,'not in cmd_dict')
-
-        # *************************************************
-        # events that other components subscribe to from
-        # this component
-        for comp in sub_dict:
-            if 'events' in sub_dict[comp]:
-                for ev in sub_dict[comp]['events']:
-                    if (ev in pub_dict['events']) and (pub_dict['events'][ev] == p):
-                        e_name = ev.split('.')[-1]
-                        pair = p+','+comp
-                        if pair not in ev_pairs:
-                            ev_pairs[pair] = []
-                        ev_pairs[pair].append(e_name)
-                        all_nodes.add(comp)
-                        #dot.edge(p,comp,label=e_name)
-
-        # *************************************************
-        # events that this component subscrbes to
-        if p in sub_dict and 'events' in sub_dict[p]:
-            for ev in sub_dict[p]['events']:
-                if ev in pub_dict['events']:
-                    publisher = pub_dict['events'][ev]
-                    if publisher in all_prefixes:
-                        e_name = ev.split('.')[-1]
-                        pair = publisher+','+p
-                        if pair not in ev_pairs:
-                            ev_pairs[pair] = []
-                        ev_pairs[pair].append(e_name)
-                        all_nodes.add(publisher)
-                        #dot.edge(publisher,p,label=e_name)
-                else:
-                    # identify required events that no one publishes
-                    if p not in ev_no_publisher:
-                        ev_no_publisher[p] = set()
-                    name = ev.split('.')[-1]
-                    ev_no_publisher[p].add(name)
-
-    # ***************************************************************
-    # from all_nodes create a dictionary of nodes in each subsystem
-    all_subsystems = {}
-    for node in all_nodes:
-        subsystem=node.split('.')[0]
-        if subsystem not in all_subsystems:
-            all_subsystems[subsystem] = set()
-        all_subsystems[subsystem].add(node)
-
-    # ***************************************************************
-    # Create the graph
-
-    # Graph initialization
-    dot = Digraph()
-    dot.graph_attr['layout']=layout
-    dot.graph_attr['splines']=splines
-    dot.graph_attr['overlap']=overlap
-    #dot.graph_attr['sep']='+20'
-    dot.graph_attr['ratio']=ratio
-    dot.node_attr['fontsize']=node_fontsize
-    dot.edge_attr['fontsize']=edge_fontsize
-
-
-    # Define all of the nodes
-    for subsystem,nodes in all_subsystems.items():
-        if subsystem in subsystem_colours:
-            col = subsystem_colours[subsystem]
-            shortlabel = True
-        else:
-            # use a single colour for subsystems
-            # that don't have a specific colour,
-            # and also revert to specifying
-            # full prefix for nodes in those
-            # subsystems instead of the short name
-            col = subsystem_colours['others']
-            shortlabel = False
-
-        if groupsubsystems:
-            # Group nodes by subsystem
-            with dot.subgraph(name='cluster_'+subsystem) as c:
-                c.attr(label=subsystem)
-                c.attr(color=col)
-                c.attr(fontcolor=col)
-                c.attr(fontsize=subsystem_fontsize)
-                c.attr(style='rounded')
-                c.attr(penwidth='3')
-                c.attr(labelloc='b')
-
-                define_nodes(c,nodes,col,shortlabel)
-        else:
-            # No grouping
-            define_nodes(dot, nodes, col,shortlabel)
-            
-
-    # One edge for each unique command sender,receiver listing all commands in label
-    dot.attr('edge',fontcolor=cmdcol)
-    dot.attr('edge',color=cmdcol)
-    for pair,cmds in cmd_pairs.items():
-        sender,receiver = pair.split(',')
-        if commandlabels:
-            cmd_str = '\n'.join(sorted(cmds))
-        else:
-            cmd_str = None
-        dot.edge(sender,receiver,label=cmd_str)
-
-    # One edge showing all commands nobody sends to each component,
-    # using dummy nodes as the source
-    if missingcommands:
-        dot.attr('edge',fontcolor=nocmdcol)
-        dot.attr('edge',color=nocmdcol)
-        for p,cmds in cmd_no_sender.items():
-            if commandlabels:
-                cmd_str = '\n'.join(cmds)
-            else:
-                cmd_str = None
-            dot.edge(p+suffix_nocmd,p,label=cmd_str)
-
-    # One edge for each unique event publisher,receiver listing all items as the label
-    dot.attr('edge',fontcolor=evcol)
-    dot.attr('edge',color=evcol)
-    #dot.attr('edge',style='dotted')
-    for pair,events in ev_pairs.items():
-        publisher,receiver = pair.split(',')
-        if eventlabels:
-            ev_str = '\n'.join(sorted(events))
+    graph,distance = relationship_graph(components,subsystems,opts)
+    graph = aggregate_graph(graph,aggregate,expand,expanddegree)
+
+    # List everything reached when following relationships
+    if distance is not None:
+        print('Components within %d hops (%s):' % (hops,direction))
+        for p,hop in sorted(distance.items(),key=lambda d:(d[1],d[0])):
+            print('%3d %-40s %s' % (hop,p,component_types.get(p,'')))
+
+    # List the busiest publishers and subscribers
+    if bandwidth:
+        print_bandwidth(graph)
+
+    # Write machine-readable descriptions
+    export(graph,jsonfile,graphmlfile,csrdir)
+    if htmlfile:
+        write_html(graph,htmlfile,opts,jobs)
+
+    # Create and render the diagram
+    if showplot or imagefile or dotfile or not (jsonfile or graphmlfile or csrdir or htmlfile):
+        if positions:
+            dot = make_pinned_dot(graph,opts,positions)
         else:
-            ev_str = None
-        dot.edge(publisher,receiver,label=ev_str)
-
-    # One edge showing all events components need but nobody publishes,
-    # using dummy nodes as the source
-    if missingevents:
-        dot.attr('edge',fontcolor=nocmdcol)
-        dot.attr('edge',color=nocmdcol)
-        for p,evs in ev_no_publisher.items():
-            if eventlabels:
-                ev_str = '\n'.join(evs)
-            else:
-                ev_str = None
-            dot.edge(p+suffix_noev,p,label=ev_str,style='dashed')
-
-    # Render the diagram
-    if showplot or imagefile:
-        dot.render(cleanup=True,view=showplot,filename=imagefile)
-    else:
-        print("Neither --showplot nor --imagefile specified, no plot generated")
-
-    if dotfile:
-        with open(dotfile,'w') as f:
-            f.write(dot.source)
\ No newline at end of file
+            dot = make_dot(graph,opts)
+        render(dot,imagefile,dotfile,showplot,rendercache)
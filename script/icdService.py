@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+# ******************************************************************************
+# ****         D A O   I N S T R U M E N T A T I O N   G R O U P           *****
+# *
+# * (c) 2019                               (c) 2019
+# * National Research Council              Conseil national de recherches
+# * Ottawa, Canada, K1A 0R6                Ottawa, Canada, K1A 0R6
+# * All rights reserved                    Tous droits reserves
+# *
+# * NRC disclaims any warranties,          Le CNRC denie toute garantie
+# * expressed, implied, or statutory, of   enoncee, implicite ou legale, de
+# * any kind with respect to the soft-     quelque nature que se soit, concer-
+# * ware, including without limitation     nant le logiciel, y compris sans
+# * any warranty of merchantability or     restriction toute garantie de valeur
+# * fitness for a particular purpose.      marchande u de pertinence pour un
+# * NRC shall not be liable in any event   usage particulier. Le CNRC ne pourra
+# * for any damages, whether direct or     en aucun cas etre tenu responsable
+# * indirect, special or general, conse-   de tout dommage, direct ou indirect,
+# * quential or incidental, arising from   particulier ou general, accessoire
+# * the use of the software.               ou fortuit, resultant de l'utili-
+# *                                        sation du logiciel.
+# *
+# *****************************************************************************
+
+"""Serve relationships stored in TMT software ICD database over HTTP"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import os
+import socketserver
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import icdRelationships as icd
+
+# service defaults
+host = '127.0.0.1'
+port = 8765
+socket_path = None
+poll = 10.0            # seconds between checks for changed collections
+modeldir = None
+jobs = os.cpu_count() or 1
+verbose = False
+
+# *****************************************************************************
+def doc_hash(doc):
+    """ Checksum of a model document
+
+    Args:
+        doc (dict): model document
+
+    Returns:
+        str: hex digest
+    """
+    return hashlib.sha1(json.dumps(doc,sort_keys=True,default=str).encode()).hexdigest()
+
+# *****************************************************************************
+class DatabaseSource:
+    """ Model documents read from the icds database
+
+    Entries are keyed by collection name. Collections are checked for
+    changes with icdRelationships.collection_hashes(). If the server does
+    not support collStats (e.g. mongomock), the projected
+    documents themselves are fetched and hashed.
+    """
+
+    def __init__(self, db, jobs=1):
+        self.db = db
+        self.jobs = jobs
+        self.prefetched = {}
+
+    def hashes(self):
+        """ Current checksum of every model collection
+
+        Returns:
+            dict: collection name -> checksum
+        """
+        names,hashes = icd.collection_hashes(self.db,self.jobs)
+        if hashes is None:
+            self.prefetched = {}
+            self.prefetched = self.fetch(names)
+            hashes = {k:doc_hash(e[-1]) for k,e in self.prefetched.items()}
+        return hashes
+
+    def fetch(self, keys):
+        """ Fetch the model documents of some collections
+
+        Args:
+            keys (iterable): collection names
+
+        Returns:
+            dict: name -> (name, subsystem, component, modeltype, doc)
+        """
+        if self.prefetched:
+            entries = {k:self.prefetched[k] for k in keys if k in self.prefetched}
+            self.prefetched = {}
+            return entries
+
+        collections = icd.classify_collections(keys)
+        docs = icd.fetch_models(self.db,collections,self.jobs)
+        entries = {}
+        for modeltype in icd.model_types:
+            for name,subsystem,component in collections[modeltype]:
+                if name in docs:
+                    entries[name] = (name,subsystem,component,modeltype,docs[name])
+        return entries
+
+# *****************************************************************************
+class ModelDirSource:
+    """ Model documents parsed from a model file tree
+
+    Entries are keyed by file name, and files are checked for changes
+    through their size and modification time.
+    """
+
+    def __init__(self, modeldir, jobs=1):
+        self.modeldir = modeldir
+        self.jobs = jobs
+
+    def hashes(self):
+        """ Current size and modification time of every model file
+
+        Returns:
+            dict: file name -> checksum
+        """
+        hashes = {}
+        for filename in icd.find_model_files(self.modeldir):
+            st = os.stat(filename)
+            hashes[filename] = '%d:%d' % (st.st_size,st.st_mtime_ns)
+        return hashes
+
+    def fetch(self, keys):
+        """ Parse some of the model files
+
+        Args:
+            keys (iterable): file names
+
+        Returns:
+            dict: file name -> (name, subsystem, component, modeltype, doc)
+        """
+        entries = {}
+        for filename,model,failed in icd.parse_model_files(sorted(keys),self.jobs):
+            if failed:
+                print('Error: unable to parse',filename,failed)
+                continue
+            c = icd.model_file_collection(filename,model)
+            if c:
+                entries[filename] = c+(model,)
+        return entries
+
+# *****************************************************************************
+class RelationshipService:
+    """ Relationship queries answered from indexes held in memory
+
+    The model documents from a source (DatabaseSource or ModelDirSource)
+    are loaded once into the icdRelationships globals. refresh() fetches
+    only the collections/files whose checksums changed, rebuilds the
+    globals and indexes from the documents in memory, and drops the cached
+    responses that involve the affected components.
+
+    Queries (see query()) and refreshes are serialized with a lock.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.lock = threading.RLock()
+        self.hashes = {}
+        self.entries = {}    # key -> (name, subsystem, component, modeltype, doc)
+        self.responses = {}  # normalized query -> (status, type, body, nodes, subsystems)
+        self.loaded = None
+        self.refreshes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _rebuild(self):
+        icd.clear_database()
+        collections = {t:[] for t in icd.model_types}
+        docs = {}
+        for name,subsystem,component,modeltype,doc in self.entries.values():
+            collections[modeltype].append((name,subsystem,component))
+            docs[name] = doc
+        for modeltype in icd.model_types:
+            collections[modeltype].sort()
+        icd.parse_models(collections,docs)
+        icd.build_indexes()
+
+    def _affected(self, components):
+        """ Components, and all of their neighbours, in the current indexes """
+        affected = set()
+        for subsystem,component in components:
+            p,failed = icd.prefix(subsystem,component)
+            if failed:
+                continue
+            affected.add(p)
+            affected.update(icd.neighbours(p))
+        return affected
+
+    def refresh(self):
+        """ Reload whatever changed in the source since the last refresh
+
+        Returns:
+            bool: True if anything changed
+        """
+        hashes = self.source.hashes()
+        changed = {k for k,h in hashes.items() if self.hashes.get(k) != h}
+        removed = set(self.hashes).difference(hashes)
+        if not changed and not removed:
+            return False
+        fetched = self.source.fetch(changed)
+
+        with self.lock:
+            old = [self.entries[k] for k in changed|removed if k in self.entries]
+            touched = old+list(fetched.values())
+            components = {(e[1],e[2]) for e in touched}
+            prefix_changed = any(e[3] == 'component' for e in touched)
+
+            affected = self._affected(components)
+            for k in changed|removed:
+                self.entries.pop(k,None)
+            self.entries.update(fetched)
+            self.hashes = hashes
+            self._rebuild()
+            affected.update(self._affected(components))
+
+            if prefix_changed:
+                # prefixes are used to resolve references everywhere
+                self.responses.clear()
+            else:
+                subsystems = {p.split('.')[0] for p in affected}
+                for key,response in list(self.responses.items()):
+                    nodes,subs = response[3],response[4]
+                    if not nodes.isdisjoint(affected) or 'all' in subs or \
+                        not subs.isdisjoint(subsystems):
+                        del self.responses[key]
+
+            self.loaded = time.time()
+            self.refreshes += 1
+        return True
+
+    def _options(self, params):
+        opts = icd.default_options()
+        for key,values in params.items():
+            if key in ('components','subsystems','format'):
+                continue
+            if key not in icd.plot_options:
+                raise ValueError('unknown parameter "%s"' % key)
+            value = values[-1]
+            if key in ('omittypes','expand'):
+                value = set(v for v in value.split(',') if v)
+            elif isinstance(opts[key],bool):
+                value = icd.str2bool(value)
+            elif isinstance(opts[key],int):
+                value = int(value)
+            opts[key] = value
+        return opts
+
+    def _graph(self, params):
+        def aslist(key):
+            return [v for value in params.get(key,[]) for v in value.split(',') if v]
+        components = aslist('components')
+        subsystems = aslist('subsystems')
+        if not components and not subsystems:
+            raise ValueError('need components or subsystems')
+        fmt = params.get('format',['json'])[-1]
+        if fmt not in ('json','dot'):
+            raise ValueError('unknown format "%s"' % fmt)
+        opts = self._options(params)
+
+        graph,distance = icd.relationship_graph(components,subsystems,opts)
+        nodes = {graph.name(n) for n in graph.nodes}
+        graph = icd.aggregate_graph(graph,opts['aggregate'],opts['expand'],
+            opts['expanddegree'])
+        if fmt == 'dot':
+            body = icd.make_dot(graph,opts).source
+            ctype = 'text/vnd.graphviz'
+        else:
+            body = json.dumps(icd.graph_model(graph))
+            ctype = 'application/json'
+        return 200,ctype,body.encode(),nodes,set(subsystems)
+
+    def query(self, path, params):
+        """ Answer a request
+
+        Paths:
+            /status      service statistics
+            /components  all component prefixes and their types
+            /lint        interface problems (see icdRelationships.lint())
+            /graph       relationships of primary components; parameters
+                         components, subsystems, format (json or dot) and
+                         any of icdRelationships.plot_options
+
+        Args:
+            path (str): request path
+            params (dict): parameter -> list of values
+
+        Returns:
+            status (int): HTTP status
+            ctype (str): content type
+            body (bytes): response
+        """
+        with self.lock:
+            if path == '/status':
+                return 200,'application/json',json.dumps({
+                    'entries': len(self.entries),
+                    'components': len(icd.all_prefixes),
+                    'cached': len(self.responses),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'refreshes': self.refreshes,
+                    'loaded': self.loaded
+                    }).encode()
+
+            key = (path,tuple(sorted((k,tuple(v)) for k,v in params.items())))
+            if key in self.responses:
+                self.hits += 1
+                return self.responses[key][:3]
+            self.misses += 1
+
+            try:
+                if path == '/components':
+                    body = json.dumps({p:icd.component_types.get(p)
+                        for p in sorted(icd.all_prefixes)})
+                    response = 200,'application/json',body.encode(),set(),{'all'}
+                elif path == '/lint':
+                    body = json.dumps(icd.lint())
+                    response = 200,'application/json',body.encode(),set(),{'all'}
+                elif path == '/graph':
+                    response = self._graph(params)
+                else:
+                    return 404,'text/plain',b'unknown path\n'
+            except Exception as e:
+                return 400,'text/plain',(str(e)+'\n').encode()
+
+            self.responses[key] = response
+            return response[:3]
+
+# *****************************************************************************
+class RequestHandler(BaseHTTPRequestHandler):
+    """ HTTP front end for the RelationshipService in self.server.service """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        status,ctype,body = self.server.service.query(url.path,parse_qs(url.query))
+        self.send_response(status)
+        self.send_header('Content-Type',ctype)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # client_address is empty for Unix sockets
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if verbose:
+            super().log_message(format,*args)
+
+# *****************************************************************************
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ HTTP server listening on a Unix socket """
+    daemon_threads = True
+
+# *****************************************************************************
+def poller(service, interval):
+    """ Refresh the service every interval seconds (runs in a thread)
+
+    Args:
+        service (RelationshipService): service to refresh
+        interval (float): seconds between refreshes
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            if service.refresh():
+                print('Reloaded changed model files/collections')
+        except Exception as e:
+            print('Error: refresh failed:',e)
+
+# *****************************************************************************
+# Entrypoint
+
+if __name__ == '__main__':
+
+    # parse the command line
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description="Serve relationships stored in TMT ICDDB over HTTP",
+        epilog="""The database is read once and kept in memory. It is checked for changes
+every --poll seconds, and only changed collections are read again.
+
+Requests:
+
+  /status
+  /components
+  /lint
+  /graph?components=...&subsystems=...&format=json|dot&<plot option>=...
+
+where the plot options are those of icdRelationships.py, e.g.
+
+  curl 'http://127.0.0.1:%d/graph?components=iris.rotator&format=dot'
+  curl --unix-socket /tmp/icd.sock 'http://localhost/graph?subsystems=iris'
+""" % port)
+    parser.add_argument("--host", default=host, nargs="?",
+        help="Address to listen on (default=%s)"%host )
+    parser.add_argument("--port", default=port, type=int, nargs="?",
+        help="Port to listen on (default=%d)"%port )
+    parser.add_argument("--socket", default=socket_path, nargs="?",
+        help="Listen on this Unix socket instead of --host/--port (default=%s)"%str(socket_path) )
+    parser.add_argument("--poll", default=poll, type=float, nargs="?",
+        help="Seconds between checks for changes, 0 to disable (default=%g)"%poll )
+    parser.add_argument("--mongo", default=icd.mongo_uri, nargs="?",
+        help="URI of the MongoDB server holding the ICD (default=%s)"%str(icd.mongo_uri) )
+    parser.add_argument("--database", default=icd.database, nargs="?",
+        help="Name of the ICD database (default=%s)"%icd.database )
+    parser.add_argument("--fetchjobs", default=icd.fetch_jobs, type=int, nargs="?",
+        help="Number of database queries in flight at once (default=%d)"%icd.fetch_jobs )
+    parser.add_argument("--modeldir", default=modeldir, nargs="?",
+        help="Serve a model file tree instead of the icds database (default=%s)"%str(modeldir) )
+    parser.add_argument("--jobs", default=jobs, type=int, nargs="?",
+        help="Number of processes used to parse model files (default=%d)"%jobs )
+    parser.add_argument("--verbose", action="store_true",
+        help="Log every request")
+
+    args = parser.parse_args()
+    verbose = args.verbose
+
+    if args.modeldir:
+        source = ModelDirSource(args.modeldir,args.jobs)
+    else:
+        source = DatabaseSource(icd.connect(args.mongo)[args.database],args.fetchjobs)
+
+    service = RelationshipService(source)
+    service.refresh()
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = UnixHTTPServer(args.socket,RequestHandler)
+        where = args.socket
+    else:
+        server = ThreadingHTTPServer((args.host,args.port),RequestHandler)
+        where = '%s:%d' % (args.host,args.port)
+    server.service = service
+
+    if args.poll > 0:
+        threading.Thread(target=poller,args=(service,args.poll),daemon=True).start()
+
+    print('Serving',len(icd.all_prefixes),'components on',where)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# ******************************************************************************
+# ****         D A O   I N S T R U M E N T A T I O N   G R O U P           *****
+# *
+# * (c) 2019                               (c) 2019
+# * National Research Council              Conseil national de recherches
+# * Ottawa, Canada, K1A 0R6                Ottawa, Canada, K1A 0R6
+# * All rights reserved                    Tous droits reserves
+# *
+# * NRC disclaims any warranties,          Le CNRC denie toute garantie
+# * expressed, implied, or statutory, of   enoncee, implicite ou legale, de
+# * any kind with respect to the soft-     quelque nature que se soit, concer-
+# * ware, including without limitation     nant le logiciel, y compris sans
+# * any warranty of merchantability or     restriction toute garantie de valeur
+# * fitness for a particular purpose.      marchande u de pertinence pour un
+# * NRC shall not be liable in any event   usage particulier. Le CNRC ne pourra
+# * for any damages, whether direct or     en aucun cas etre tenu responsable
+# * indirect, special or general, conse-   de tout dommage, direct ou indirect,
+# * quential or incidental, arising from   particulier ou general, accessoire
+# * the use of the software.               ou fortuit, resultant de l'utili-
+# *                                        sation du logiciel.
+# *
+# *****************************************************************************
+
+"""Generate synthetic ICD model files and icds collections for benchmarks"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+# generator defaults
+subsystems = 4          # number of subsystems
+components = 10         # components per subsystem
+events = 5              # events published by each component
+attributes = 4          # attributes of each event (and arguments of commands)
+commands = 5            # commands received by each component
+alarms = 1              # alarms published by each component
+fanout = 3              # events subscribed to and commands sent by each component
+missing = 0.02          # fraction of subscriptions/commands with no other end
+seed = 1                # random seed, so that trees are reproducible
+database = 'icds_synthetic'
+
+component_types = ['Assembly', 'HCD', 'HCD', 'Sequencer', 'Application']
+attribute_types = ['double', 'float', 'integer', 'short', 'long', 'boolean',
+    'string', 'array', 'enum']
+rates = [1, 10, 20, 100]
+
+# model type -> model file name, as in icdRelationships.modelfile_types
+model_files = {
+    'component': 'component-model.conf',
+    'publish': 'publish-model.conf',
+    'subscribe': 'subscribe-model.conf',
+    'command': 'command-model.conf'
+}
+
+# *****************************************************************************
+def attribute(rng, name):
+    """ Random attribute/argument description
+
+    Args:
+        rng (Random): random number generator
+        name (str): attribute name
+
+    Returns:
+        dict: attribute model
+    """
+    t = rng.choice(attribute_types)
+    a = {'name':name, 'description':'Synthetic attribute '+name}
+    if t == 'array':
+        a['type'] = 'array'
+        a['dimensions'] = [rng.choice([2,3,4,16,64])]
+        a['items'] = {'type':rng.choice(['double','float','short'])}
+    elif t == 'enum':
+        a['enum'] = ['STATE%d' % i for i in range(rng.randint(2,6))]
+    else:
+        a['type'] = t
+        if t in ('double','float','integer','short','long'):
+            a['minimum'] = 0
+            a['maximum'] = rng.choice([1,10,100,1000])
+            a['units'] = rng.choice(['deg','mm','s','K'])
+    return a
+
+# *****************************************************************************
+def synthetic_models(subsystems=subsystems, components=components,
+                     events=events, attributes=attributes, commands=commands,
+                     alarms=alarms, fanout=fanout, missing=missing, seed=seed):
+    """ Build the models of a synthetic set of subsystems
+
+    Each component publishes events and alarms and receives commands, and
+    subscribes to fanout events and sends fanout commands chosen at random
+    from the other components. A fraction missing of those refer to items
+    nobody publishes/receives.
+
+    Args:
+        subsystems (int): number of subsystems
+        components (int): components per subsystem
+        events (int): events published by each component
+        attributes (int): attributes of each event and arguments of each
+            command
+        commands (int): commands received by each component
+        alarms (int): alarms published by each component
+        fanout (int): subscriptions and sent commands of each component
+        missing (float): fraction of subscriptions/commands with no other end
+        seed (int): random seed
+
+    Returns:
+        dict: collection name (SUBSYSTEM.component.modeltype) -> model
+    """
+    rng = random.Random(seed)
+    comps = [('SYN%02d' % s,'c%03d' % c) for s in range(subsystems)
+             for c in range(components)]
+
+    docs = {}
+    for i,(subsystem,component) in enumerate(comps):
+        base = {'subsystem':subsystem, 'component':component}
+        docs[subsystem+'.'+component+'.component'] = dict(base,
+            modelVersion='1.0',
+            prefix=subsystem.lower()+'.'+component,
+            componentType=component_types[i % len(component_types)],
+            title='Synthetic '+subsystem+' '+component,
+            description='Synthetic component %d of %d' % (i+1,len(comps)))
+
+        publish = {'events':[], 'alarms':[]}
+        for e in range(events):
+            rate = rng.choice(rates)
+            publish['events'].append({'name':'ev%03d' % e,
+                'description':'Synthetic event %d' % e,
+                'maxRate':rate, 'minRate':rng.choice([r for r in rates if r <= rate]),
+                'archive':rng.random() < 0.5,
+                'attributes':[attribute(rng,'a%02d' % a) for a in range(attributes)]})
+        for a in range(alarms):
+            publish['alarms'].append({'name':'alarm%02d' % a,
+                'description':'Synthetic alarm %d' % a,
+                'severityLevels':['Warning','Major'],
+                'probableCause':'Synthetic cause',
+                'operatorResponse':'Synthetic response'})
+        docs[subsystem+'.'+component+'.publish'] = dict(base,publish=publish)
+
+        receive = []
+        for c in range(commands):
+            args = [attribute(rng,'arg%02d' % a) for a in range(attributes)]
+            cmd = {'name':'cmd%03d' % c, 'description':'Synthetic command %d' % c,
+                'args':args}
+            if args:
+                cmd['requiredArgs'] = [args[0]['name']]
+            receive.append(cmd)
+
+        def other():
+            # any component but this one
+            j = rng.randrange(len(comps)-1)
+            return comps[j+1 if j >= i else j]
+
+        subscribe = []
+        send = []
+        for f in range(fanout if len(comps) > 1 else 0):
+            s,c = other()
+            if events and rng.random() >= missing:
+                name = 'ev%03d' % rng.randrange(events)
+            else:
+                name = 'noev%03d' % f
+            subscribe.append({'subsystem':s, 'component':c, 'name':name,
+                'requiredRate':rng.choice(rates), 'usage':'Synthetic usage'})
+            s,c = other()
+            if commands and rng.random() >= missing:
+                name = 'cmd%03d' % rng.randrange(commands)
+            else:
+                name = 'nocmd%03d' % f
+            send.append({'subsystem':s, 'component':c, 'name':name})
+        docs[subsystem+'.'+component+'.subscribe'] = dict(base,
+            subscribe={'events':subscribe})
+        docs[subsystem+'.'+component+'.command'] = dict(base,
+            receive=receive, send=send)
+
+    return docs
+
+# *****************************************************************************
+def component_dir(modeldir, subsystem, component):
+    """ Directory holding the model files of a component
+
+    Args:
+        modeldir (str): root of the model file tree
+        subsystem (str): subsystem name
+        component (str): component name
+
+    Returns:
+        str: <modeldir>/<subsystem>-Model-Files/<component>
+    """
+    return os.path.join(modeldir,subsystem+'-Model-Files',
+        component.replace('.','-'))
+
+# *****************************************************************************
+def write_models(docs, modeldir):
+    """ Write models as a model file tree
+
+    The files are written as JSON, which is valid HOCON.
+
+    Args:
+        docs (dict): output of synthetic_models()
+        modeldir (str): root of the model file tree
+    """
+    for name,doc in docs.items():
+        modeltype = name.split('.')[-1]
+        d = component_dir(modeldir,doc['subsystem'],doc['component'])
+        os.makedirs(d,exist_ok=True)
+        with open(os.path.join(d,model_files[modeltype]),'w') as f:
+            json.dump(doc,f,indent=1)
+
+# *****************************************************************************
+def write_database(docs, db, drop=False):
+    """ Write models as icds-style collections, one document each
+
+    Args:
+        docs (dict): output of synthetic_models()
+        db (Database): pymongo (or mongomock) database
+        drop (bool): drop all existing collections first
+    """
+    if drop:
+        for name in db.list_collection_names():
+            db.drop_collection(name)
+    for name,doc in docs.items():
+        db[name].insert_one(dict(doc))
+
+# *****************************************************************************
+# Entrypoint
+
+if __name__ == '__main__':
+
+    # parse the command line
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description="Generate a synthetic ICD as model files and/or icds collections",
+        epilog="""Subsystems are called SYN00, SYN01... and their components c000, c001...
+The same arguments always produce the same ICD.
+
+example:
+  icdSynthetic.py --subsystems 10 --components 50 --modeldir /tmp/syn
+  icdRelationships.py --modeldir /tmp/syn --subsystems syn00 --showplot false
+""")
+    parser.add_argument("--subsystems", default=subsystems, type=int, nargs="?",
+        help="Number of subsystems (default=%d)"%subsystems )
+    parser.add_argument("--components", default=components, type=int, nargs="?",
+        help="Components per subsystem (default=%d)"%components )
+    parser.add_argument("--events", default=events, type=int, nargs="?",
+        help="Events published by each component (default=%d)"%events )
+    parser.add_argument("--attributes", default=attributes, type=int, nargs="?",
+        help="Attributes of each event/arguments of each command (default=%d)"%attributes )
+    parser.add_argument("--commands", default=commands, type=int, nargs="?",
+        help="Commands received by each component (default=%d)"%commands )
+    parser.add_argument("--alarms", default=alarms, type=int, nargs="?",
+        help="Alarms published by each component (default=%d)"%alarms )
+    parser.add_argument("--fanout", default=fanout, type=int, nargs="?",
+        help="Events subscribed to and commands sent by each component (default=%d)"%fanout )
+    parser.add_argument("--missing", default=missing, type=float, nargs="?",
+        help="Fraction of subscriptions/commands with no other end (default=%g)"%missing )
+    parser.add_argument("--seed", default=seed, type=int, nargs="?",
+        help="Random seed (default=%d)"%seed )
+    parser.add_argument("--modeldir", default=None, nargs="?",
+        help="Write a model file tree here")
+    parser.add_argument("--jsonfile", default=None, nargs="?",
+        help="Write all models as one JSON object (collection name->model)")
+    parser.add_argument("--mongo", default=None, nargs="?",
+        help="Write collections to the MongoDB server at this URI")
+    parser.add_argument("--database", default=database, nargs="?",
+        help="Database written by --mongo (default=%s)"%database )
+    parser.add_argument("--drop", action="store_true",
+        help="Drop every collection in --database before writing")
+
+    args = parser.parse_args()
+
+    if not args.modeldir and not args.jsonfile and not args.mongo:
+        print("Need to specify at least --modeldir, --jsonfile or --mongo. For help:\n"+\
+            "  icdSynthetic.py -h")
+        sys.exit(0)
+
+    docs = synthetic_models(args.subsystems,args.components,args.events,
+        args.attributes,args.commands,args.alarms,args.fanout,args.missing,
+        args.seed)
+
+    if args.modeldir:
+        write_models(docs,args.modeldir)
+    if args.jsonfile:
+        with open(args.jsonfile,'w') as f:
+            json.dump(docs,f,indent=1)
+    if args.mongo:
+        from pymongo import MongoClient
+        write_database(docs,MongoClient(args.mongo)[args.database],args.drop)
+
+    print('%d components, %d collections' %
+        (args.subsystems*args.components,len(docs)))
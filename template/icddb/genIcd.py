@@ -11,9 +11,17 @@ import re
 import fnmatch
 from pyhocon import ConfigFactory
 
+# phase timing shared with the other ICD tools in ${NIC_ROOT}/script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'script'))
+import icdProfile
+
 ## main
 #
 
+# --profile or NIC_PROFILE reports the time spent walking/parsing the tree
+icdProfile.configure(icdProfile.strip_option(sys.argv))
+
 if (len(sys.argv) < 4):
     print("""genIcd: Generate command-model.conf that sends all commands, and subscribe-model.conf that subscribes to all events, for assemblies under the input model path.
 
@@ -72,6 +80,7 @@ for type in types:
             "({0}): {1}".format(e.errno, e.strerror))
         sys.exit(1)
 
+walk = icdProfile.phase('walk').start()
 for root, dirs, files in os.walk(in_dir):
     # skip hidden
     files = [f for f in files if not f[0] == '.']
@@ -85,7 +94,9 @@ for root, dirs, files in os.walk(in_dir):
         if d['inname'] in files:
             f = root+'/'+d['inname']
             try:
+                parse = icdProfile.phase('parse').start()
                 conf = ConfigFactory.parse_file(f)
+                parse.stop()
                 subsystem = conf['subsystem']
                 component = conf['component']
 
@@ -93,6 +104,7 @@ for root, dirs, files in os.walk(in_dir):
                     a = conf[d['root']][d['key']]
                 else:
                     a = conf[d['key']]
+                parse.add(len(a))
 
                 outfile.write('\n%s// %s %s\n' % (spc,subsystem,component))
                 for r in a:
@@ -121,6 +133,7 @@ for root, dirs, files in os.walk(in_dir):
             except Exception as e:
                 pass
 
+walk.stop()
 
 for type in types:
     try:
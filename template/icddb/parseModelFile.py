@@ -4,13 +4,30 @@
 import os
 import sys
 import re
+import hashlib
+import json
+import locale
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pyhocon import ConfigFactory
 
+## phase timing and event size estimates shared with the other ICD tools
+## in ${NIC_ROOT}/script
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','..','script'))
+import icdBandwidth
+import icdProfile
+
+## output formats, see renderModel.py
+import renderModel
+from renderModel import Inline, Join
+
 # Configurations for subsections that render information from model files:
 #
 #   modelfile: refers to the input model file from which the data are parsed
 #   secfile  : section that will be included in a doxygen file
 #   tagprefix: prefix that will be added to item names to create tags
+#   title    : heading of the section in the document formats
 #
 # Note that a number of ALIASES have been added to template.doxconf that
 # make use of the tags to simplify cross-referencing.
@@ -18,37 +35,211 @@ from pyhocon import ConfigFactory
 command_c = {
   'modelfile' : 'command-model.conf',
   'secfile'   : 'command.sec',
+  'title'     : 'Commands',
   'tagprefix' : 'cmd'   # should match "icdcmd" ALIAS in template.doxconf
 }
 
 pubevent_c = {
   'modelfile' : 'publish-model.conf',
   'secfile'   : 'publishEvent.sec',
+  'title'     : 'Published Events',
   'tagprefix' : 'pubev' # should match "icdpubev" ALIAS in template.doxconf
 }
 
 subevent_c = {
   'modelfile' : 'subscribe-model.conf',
   'secfile'   : 'subscribeEvent.sec',
+  'title'     : 'Subscribed Events',
   'tagprefix' : 'subev' # should match "icdsubbev" ALIAS in template.doxconf
 }
 
 component_c = {
   'modelfile' : 'component-model.conf',
-  'secfile'   : 'component.sec'
+  'secfile'   : 'component.sec',
+  'title'     : 'Component'
 }
 
 alarm_c = {
   'modelfile' : 'publish-model.conf',
   'secfile'   : 'alarm.sec',
+  'title'     : 'Alarms',
   'tagprefix' : 'alarm' # should match "icdalarm" ALIAS in template.doxconf
 }
 
-## Sanitize a string so that it displays correctly with latex
-def latexStr(str):
-  # Underscores need to be escaped.
-  str_sanitized = str.replace('_','\_')
-  return str_sanitized
+## model files of a component
+modelFiles = sorted(set(c['modelfile'] for c in
+  [component_c,pubevent_c,subevent_c,command_c,alarm_c]))
+
+## Parsed model files are cached on disk, keyed on a hash of their contents,
+## so that the many parseModelFile.py runs of one build (and later builds)
+## only parse each file once. NIC_MODEL_CACHE overrides the directory, set it
+## to an empty string to disable the cache.
+modelCacheDir = os.environ.get('NIC_MODEL_CACHE',
+  os.path.join(os.environ.get('XDG_CACHE_HOME',
+    os.path.join(os.path.expanduser('~'),'.cache')),'nic','models'))
+modelCacheVersion = 1   # bump when the cached representation changes
+modelCacheMaxAge = 30*24*3600  # remove entries unused for this long (s)
+
+## HOCON include statements; the key only covers the including file, so
+## files that include others are parsed every time
+includeRe = re.compile(rb'\binclude\s+(required\s*\(\s*)?("|(url|file|classpath|package)\s*\()')
+
+## models of the component being processed, by file name; None if missing
+models = {}
+
+## Parse a model file into plain dictionaries and lists, going through the
+## content-addressed cache
+def parseModel(filename):
+  with open(filename,'rb') as f:
+    data = f.read()
+
+  cacheFile = None
+  if modelCacheDir and not includeRe.search(data):
+    key = hashlib.sha1(str(modelCacheVersion).encode()+b'\0'+data).hexdigest()
+    cacheFile = os.path.join(modelCacheDir,key[:2],key+'.pickle')
+    try:
+      with open(cacheFile,'rb') as f:
+        conf = pickle.load(f)
+      ## the modification time records the last use, see pruneModelCache()
+      os.utime(cacheFile)
+      return conf
+    except (OSError,EOFError,pickle.UnpicklingError):
+      pass
+
+  conf = ConfigFactory.parse_file(filename).as_plain_ordered_dict()
+
+  if cacheFile:
+    ## written to a temporary name and moved into place, so that concurrent
+    ## make jobs never read a partial file; a read-only cache is not an error
+    try:
+      os.makedirs(os.path.dirname(cacheFile),exist_ok=True)
+      tmpFile = '{0}.{1}.tmp'.format(cacheFile,os.getpid())
+      with open(tmpFile,'wb') as f:
+        pickle.dump(conf,f,protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmpFile,cacheFile)
+    except OSError:
+      pass
+
+  return conf
+
+## Remove cache entries that have not been used for modelCacheMaxAge, such
+## as those of model files that have since been edited. The cache directory
+## is scanned at most once a day.
+def pruneModelCache():
+  if not modelCacheDir:
+    return
+  stamp = os.path.join(modelCacheDir,'.pruned')
+  now = time.time()
+  try:
+    if now - os.path.getmtime(stamp) < 24*3600:
+      return
+  except OSError:
+    pass
+  try:
+    with open(stamp,'w'):
+      pass
+    for entry in os.scandir(modelCacheDir):
+      if not entry.is_dir():
+        continue
+      for cached in os.scandir(entry.path):
+        if now - cached.stat().st_mtime > modelCacheMaxAge:
+          os.remove(cached.path)
+  except OSError:
+    pass
+
+## Get the model of a component from one of its model files. Each file is
+## parsed at most once and shared by all the write*() functions.
+def getModel(compDir,model_c):
+  filename = compDir+"/"+model_c['modelfile']
+  if filename not in models:
+    models[filename] = parseModel(filename) if os.path.isfile(filename) else None
+  return models[filename]
+
+## Section files are only replaced when their contents change, so that make
+## does not redo the doxygen and LaTeX stages of an unchanged tech note. The
+## manifest in each output directory records the hashes of the model files,
+## of this generator and of the sections written from them, so that a
+## component whose inputs and outputs are unchanged is skipped altogether.
+manifestName = '.parseModelFile.manifest'
+manifestVersion = 1
+
+## output file -> hash of the outputs written for the component being processed
+outputs = {}
+
+## hash of a file's contents, None if the file does not exist
+def fileHash(filename):
+  try:
+    with open(filename,'rb') as f:
+      return hashlib.sha1(f.read()).hexdigest()
+  except FileNotFoundError:
+    return None
+
+## hash of the code generating the sections, computed once
+generator = None
+def generatorHash():
+  global generator
+  if generator is None:
+    h = hashlib.sha1()
+    for module in [__file__,icdBandwidth.__file__,renderModel.__file__]:
+      with open(module,'rb') as f:
+        h.update(f.read())
+    generator = h.hexdigest()
+  return generator
+
+## Replace a file with new contents unless it already holds them. The new
+## file is written to a temporary name and moved into place, so that readers
+## never see a partial file. Returns True if the file was replaced.
+def replaceFile(filename,data):
+  try:
+    with open(filename,'rb') as f:
+      if f.read() == data:
+        return False
+  except FileNotFoundError:
+    pass
+  tmpFile = '{0}.{1}.tmp'.format(filename,os.getpid())
+  with open(tmpFile,'wb') as f:
+    f.write(data)
+  os.replace(tmpFile,filename)
+  return True
+
+## write an output of the component being processed, in one write
+def writeOutput(outDir,name,text):
+  data = text.encode(locale.getpreferredencoding(False))
+  replaceFile(outDir+"/"+name,data)
+  outputs[name] = hashlib.sha1(data).hexdigest()
+
+## read the manifest of an output directory, empty if missing or unreadable
+def readManifest(outDir):
+  try:
+    with open(outDir+"/"+manifestName) as f:
+      manifest = json.load(f)
+  except (OSError,ValueError):
+    return {}
+  return manifest if isinstance(manifest,dict) else {}
+
+## write the manifest of an output directory
+def writeManifest(outDir,manifest):
+  replaceFile(outDir+"/"+manifestName,
+    (json.dumps(manifest,indent=1,sort_keys=True)+"\n").encode())
+
+## Key identifying what the sections of a component are generated from
+def manifestKey(compDir,formatNames):
+  return {
+    'version'   : manifestVersion,
+    'generator' : generatorHash(),
+    'formats'   : list(formatNames),
+    'models'    : dict((m,fileHash(compDir+"/"+m)) for m in modelFiles)
+  }
+
+## True if the sections in outDir were generated from the same inputs and
+## have not been modified since
+def upToDate(outDir,key,manifest):
+  if manifest.get('key') != key or not manifest.get('outputs'):
+    return False
+  for secfile,digest in manifest['outputs'].items():
+    if fileHash(outDir+"/"+secfile) != digest:
+      return False
+  return True
 
 ## Sanitize a string so that it can be used as a target label
 def targetStr(str):
@@ -56,14 +247,10 @@ def targetStr(str):
   str_sanitized = str.replace('_','')
   return str_sanitized
 
-## Generate tag string for both LaTex and HTML output using prefix
-## specified in the various subsection *_c configuration dictionaries
-def getTag(model_c,name):
-  latex_tag = model_c['tagprefix']+targetStr(name)
-  html_tag = model_c['tagprefix']+targetStr(name)
-  tagstr = "\latexonly\n\label{"+latex_tag+"}\n\endlatexonly\n" + \
-    "\htmlonly<a id="+html_tag+"></a>\endhtmlonly\n"
-  return tagstr
+## Generate the label of an item for both LaTeX and HTML output, using the
+## prefix specified in the various subsection *_c configuration dictionaries
+def getLabel(model_c,name):
+  return model_c['tagprefix']+targetStr(name)
 
 ## get a value from the directory, if not present then an empty string is returned
 def getVal(dir,name):
@@ -73,17 +260,11 @@ def getVal(dir,name):
   
   return val
 
-## parse an enum and build enum list string separated by '|'
-def getEnumStr(enum):
-  str = ''
-  for k in range(0, len(enum)):
-    if k == len(enum)-1:
-      str += "{0}".format(enum[k])
-    else:
-      str += "{0} <br> | ".format(enum[k])
-  return str
+## build a rendering operation, see renderModel
+def op(template, **args):
+  return (template, args)
 
-## parse data type and build output string
+## parse data type and build the data type string and range value
 def getDtStr(elem):
   dt = ''
   rangeStr = ''
@@ -111,8 +292,8 @@ def getDtStr(elem):
       # write array type and array dimension 
       dt = "{0}{1}".format(subType,dim)
           
-      if enum != '':
-        enumRange = getEnumStr(enum)
+      if enum:
+        enumRange = Join('enum',enum)
    
     # if not array then write the type
     else:
@@ -121,14 +302,15 @@ def getDtStr(elem):
   # if not type then check if enum 
   elif 'enum' in elem:
     dt = "enum"
-    enumRange = getEnumStr(elem['enum'])
+    if elem['enum']:
+      enumRange = Join('enum',elem['enum'])
   
   # get min/max range
   minMaxRange = getRangeStr(elem)
 
   ## write min/max and enum range
   if minMaxRange != '' and enumRange != '':
-    rangeStr = "{0} ({1})".format(enumRange,minMaxRange)
+    rangeStr = Inline('enumRange',{'enum':enumRange,'range':minMaxRange})
   elif minMaxRange != '':
     rangeStr = minMaxRange
   elif enumRange != '':
@@ -137,21 +319,21 @@ def getDtStr(elem):
   return dt, rangeStr
 
 
-## parse range and build output string
+## parse range and build the range value
 def getRangeStr(elem):
   str = ''
 
   if 'maximum' in elem and 'minimum' in elem:
-    str = "{0} to {1}".format(elem['minimum'],elem['maximum'])
+    str = Inline('between',{'min':elem['minimum'],'max':elem['maximum']})
   elif 'maximum' in elem:
-    str = "&le; {0}".format(elem['maximum']) 
+    str = Inline('le',{'max':elem['maximum']})
   elif 'minimum' in elem:
-    str = "&ge; {0}".format(elem['minimum'])
+    str = Inline('ge',{'min':elem['minimum']})
 
   return str
 
 
-## parse rate and build output string
+## parse rate and build the rate value
 def getRateStr(elem):
   str = ''
 
@@ -159,19 +341,23 @@ def getRateStr(elem):
     maxRate = elem['maxRate']
     minRate = elem['minRate']
     if maxRate == minRate:
-      str = "{0}".format(maxRate)
+      str = Inline('value',{'value':maxRate})
     else:
-      str = "{0} to {1}".format(minRate,maxRate)
+      str = Inline('between',{'min':minRate,'max':maxRate})
   elif 'maxRate' in elem:
-    str = "&le; {0}".format(elem['maxRate']) 
+    str = Inline('le',{'max':elem['maxRate']})
   elif 'minRate' in elem:
-    str = "&ge; {0}".format(elem['minRate'])
-
-  if str != '':
-    str = "<b>Rate:</b> "+str+" Hz<br>\n"
+    str = Inline('ge',{'min':elem['minRate']})
 
   return str
 
+## estimated bytes/s of an attribute at the event rate (bytes if no rate)
+def getBandwidthStr(attr, rate):
+  size = icdBandwidth.attribute_size(attr)
+  if rate is None:
+    return icdBandwidth.format_bytes(size)
+  return icdBandwidth.format_bytes(size*rate,'/s')
+
 ## get subsystem string and rate 
 def getSubTableStr(tel):
   subsystem = getVal(tel,'subsystem')
@@ -184,254 +370,366 @@ def getSubTableStr(tel):
   return item, rate
 
 
-## write component section
-def writeComp(compDir, outDir):
-  file = open(outDir+"/"+component_c['secfile'], 'w')
+## Each build*() function below turns a section of the documentation into
+## a list of rendering operations, in one pass over the parsed model. The
+## templates of each output format are in renderModel.py.
 
-  filename = compDir+"/"+component_c['modelfile']
-  if not os.path.isfile(filename):
-    file.write("N/A<br>\n")
-    file.close()
-    return
-  conf = ConfigFactory.parse_file(filename)
+## build component section
+def buildComp(conf):
+  if conf is None:
+    return [op('na')], None
 
   subsys = getVal(conf,'subsystem')
   comp = getVal(conf,'component')
   title = getVal(conf,'title')
   prefix = subsys+'.'+comp
 
-  file.write("The prefix for the {0} is: <em>{1}</em>\n\n".format(title,prefix))
-  file.write("{0}<br>\n".format(getVal(conf,'description')))
-  
-  file.close()
+  ops = [
+    op('prefix',title=title,prefix=prefix),
+    op('compDescription',description=getVal(conf,'description'))
+  ]
 
-  return prefix, title
+  return ops, (prefix, title)
 
 
-## write published event section 
-def writePubEvent(compDir, outDir, prefix, title):
-  file = open(outDir+"/"+pubevent_c['secfile'], 'w')
-
-  filename = compDir+"/"+pubevent_c['modelfile']
-  if not os.path.isfile(filename):
-    file.write("N/A<br>\n")
-    file.close()
-    return
-  conf = ConfigFactory.parse_file(filename)
+## build published event section 
+def buildPubEvent(conf, prefix, title):
+  if conf is None:
+    return [op('na')]
 
   if 'publish' not in conf:
-    return
+    return []
   pub = conf['publish']
 
-  if 'events' in pub:
-    tel = pub['events']
-
-    file.write("The {0} publishes the following event items:\n\n".format(title))
-
-    for i in range(0, len(tel)):
-      name = getVal(tel[i],'name')
-      file.write("<hr>\n")
-
-      ##  Enable linking to published event subsections.
-      ##  In the doxygen file, add the following to lines to link to an event foo.
-      ##  \latexonly \hyperref[foo]{foo}\endlatexonly
-      ##  \htmlonly<a href="#foo">foo</a>\endhtmlonly
-      ##
-      ##  Linking only works within the document that included the publishEvent.sec file.
-      file.write("\latexonly\n\subsection{"+latexStr(name)+" Event}\n\endlatexonly\n")
-      file.write(getTag(pubevent_c,name))
-
-      file.write("<b>Event item:</b> {0}.{1}<br>\n".format(prefix,name))  
-
-      if 'archive' in tel[i]:
-        file.write("<b>Archived:</b> {0}<br>\n".format(tel[i]['archive']))
-
-      str = getRateStr(tel[i])
-      if str != '':
-        file.write(str)
-
-      file.write("{0}<br>\n\n".format(getVal(tel[i],'description')))
-
-      if 'attributes' in tel[i]:
-        file.write("<table>\n<tr><th> Attribute <th> Data Type <th> Units <th> Range <th> Description\n")
-        attr = tel[i]['attributes']
-        for j in range(0, len(attr)):
-          file.write("<tr><td> "+getVal(attr[j],'name'))
-          dateType, rangeStr = getDtStr(attr[j])
-          file.write("<td> "+dateType)
-          file.write("<td> "+getVal(attr[j],'units'))
-          file.write("<td> "+rangeStr)
-          file.write("<td> "+getVal(attr[j],'description'))
-        file.write("\n</table>\n\n")
-  else:
-    file.write("N/A<br>\n")
+  if 'events' not in pub:
+    return [op('na')]
 
-  file.close()
+  tel = pub['events']
+  icdProfile.items(len(tel))
 
+  ops = [op('intro',text="The {0} publishes the following event items:".format(title))]
 
-## write published alarms section
-def writeAlarm(compDir, outDir, prefix, title):
-  file = open(outDir+"/"+alarm_c['secfile'], 'w')
+  for ev in tel:
+    name = getVal(ev,'name')
+
+    ##  Enable linking to published event subsections.
+    ##  In the doxygen file, add the following to lines to link to an event foo.
+    ##  \latexonly \hyperref[foo]{foo}\endlatexonly
+    ##  \htmlonly<a href="#foo">foo</a>\endhtmlonly
+    ##
+    ##  Linking only works within the document that included the publishEvent.sec file.
+    ops.append(op('event',name=name,label=getLabel(pubevent_c,name),prefix=prefix))
+
+    if 'archive' in ev:
+      ops.append(op('archived',archive=ev['archive']))
+
+    rateStr = getRateStr(ev)
+    if rateStr != '':
+      ops.append(op('rate',rate=rateStr))
+
+    ## estimated size and bandwidth at the maximum rate, see icdBandwidth
+    rate = icdBandwidth.event_rate(ev)
+    ops.append(op('bandwidth',
+      bandwidth=icdBandwidth.format_bandwidth(icdBandwidth.event_size(ev),rate)))
+
+    ops.append(op('itemDescription',description=getVal(ev,'description')))
+
+    if 'attributes' in ev:
+      ops.append(op('attrTable'))
+      for attr in ev['attributes']:
+        dataType, rangeStr = getDtStr(attr)
+        ops.append(op('attrRow',name=getVal(attr,'name'),type=dataType,
+          units=getVal(attr,'units'),range=rangeStr,
+          bandwidth=getBandwidthStr(attr,rate),description=getVal(attr,'description')))
+      ops.append(op('tableEnd'))
+
+  return ops
 
-  filename = compDir+"/"+alarm_c['modelfile']
-  if not os.path.isfile(filename):
-    file.write("N/A<br>\n")
-    file.close()
-    return
-  conf = ConfigFactory.parse_file(filename)
+
+## build published alarms section
+def buildAlarm(conf, prefix, title):
+  if conf is None:
+    return [op('na')]
 
   if 'publish' not in conf:
-    return
+    return []
   pub = conf['publish']
 
-  if 'alarms' in pub:
-    alarm = pub['alarms']
-
-    file.write("The {0} publishes the following alarms:\n\n".format(title))
-    
-    file.write("<table>\n<tr><th> Alarm <th> Severity Levels <th> Description <th> Probable Cause <th> Operator Response\n")
-    for i in range(0, len(alarm)):
-      name = getVal(alarm[i],'name')
-      
-      ##  Enable linking to published alarms.
-      ##  See ALIASES in template.doxconf to see how to reference alarm tags.
-      ##
-      ##  Linking only works within the document that included the alarm.sec file.
-      file.write(getTag(alarm_c,name.split('.')[-1]))
-
-      file.write("<tr><td> "+name)
-      file.write("<td> "+','.join(getVal(alarm[i],'severityLevels')))
-      file.write("<td> "+getVal(alarm[i],'description'))
-      file.write("<td> "+getVal(alarm[i],'probableCause'))
-      file.write("<td> "+getVal(alarm[i],'operatorResponse'))
-    file.write("\n</table>\n\n")
-
-  file.close()
-
-## write subscribed event section
-def writeSubEvent(compDir, outDir, title):
-  file = open(outDir+"/"+subevent_c['secfile'], 'w')
-
-  filename = compDir+"/"+subevent_c['modelfile']
-  if not os.path.isfile(filename):
-    file.write("N/A<br>\n")
-    file.close()
-    return
-  conf = ConfigFactory.parse_file(filename)
+  if 'alarms' not in pub:
+    return []
+
+  alarm = pub['alarms']
+  icdProfile.items(len(alarm))
+
+  ops = [
+    op('intro',text="The {0} publishes the following alarms:".format(title)),
+    op('alarmTable')
+  ]
+  for al in alarm:
+    name = getVal(al,'name')
+
+    ##  Enable linking to published alarms.
+    ##  See ALIASES in template.doxconf to see how to reference alarm tags.
+    ##
+    ##  Linking only works within the document that included the alarm.sec file.
+    ops.append(op('alarmRow',name=name,label=getLabel(alarm_c,name.split('.')[-1]),
+      severity=Join('severity',getVal(al,'severityLevels')),
+      description=getVal(al,'description'),cause=getVal(al,'probableCause'),
+      response=getVal(al,'operatorResponse')))
+  ops.append(op('tableEnd'))
+
+  return ops
+
+## build subscribed event section
+def buildSubEvent(conf, title):
+  if conf is None:
+    return [op('na')]
  
   if 'subscribe' not in conf:
-    return
+    return []
   sub = conf['subscribe']
 
-  if 'events' in sub:
-    tel = sub['events']
+  if 'events' not in sub:
+    return [op('na')]
 
-    file.write("The {0} subscribes to the following event items:\n\n".format(title))
+  tel = sub['events']
+  icdProfile.items(len(tel))
 
-    file.write("<table>\n<tr><th> Subscription <th> Rate (Hz)\n")
-    for i in range(0, len(tel)):
-      item, rate = getSubTableStr(tel[i])
-      
-      ##  Enable linking to subscribed events.
-      ##  See ALIASES in template.doxconf to see how to reference subscribed events.
-      ##
-      ##  Linking only works within the document that included the subscribeEvent.sec file.
-      file.write(getTag(subevent_c,item))
-
-      file.write("<tr><td> {0} <td> {1}".format(item,rate))
-      if 'usage' in tel[i]:
-        file.write("<br><b>Usage:</b><br>"+tel[i]['usage'])
-      file.write("\n")
-    file.write("</table>\n")
-  else:
-    file.write("N/A<br>\n")
+  ops = [
+    op('intro',text="The {0} subscribes to the following event items:".format(title)),
+    op('subTable')
+  ]
+  for ev in tel:
+    item, rate = getSubTableStr(ev)
 
-  file.close()
+    ##  Enable linking to subscribed events.
+    ##  See ALIASES in template.doxconf to see how to reference subscribed events.
+    ##
+    ##  Linking only works within the document that included the subscribeEvent.sec file.
+    ops.append(op('subRow',item=item,rate=rate,label=getLabel(subevent_c,item)))
+    if 'usage' in ev:
+      ops.append(op('usage',usage=ev['usage']))
+    ops.append(op('subRowEnd'))
+  ops.append(op('subTableEnd'))
 
+  return ops
 
-## write commands section
-def writeCmd(compDir, outDir, prefix, title):
-  file = open(outDir+"/"+command_c['secfile'], 'w')
 
-  filename = compDir+"/"+command_c['modelfile']
-  if not os.path.isfile(filename):
-    file.write("N/A<br>\n")
-    file.close()
-    return
-  conf = ConfigFactory.parse_file(filename)
+## build commands section
+def buildCmd(conf, prefix, title):
+  if conf is None:
+    return [op('na')]
 
   if 'receive' not in conf:
-    return
+    return []
   rec = conf['receive']
+  icdProfile.items(len(rec))
+
+  ops = [
+    op('intro',text="The {0} accepts the following commands:".format(title)),
+    op('cmdIndex')
+  ]
+  for cmd in rec:
+    name = getVal(cmd,'name')
+    ops.append(op('cmdIndexItem',name=name,label=getLabel(command_c,name)))
+  ops.append(op('cmdIndexEnd'))
+
+  for cmd in rec:
+    name = getVal(cmd,'name')
+
+    ##  Enable linking to command subsections.
+    ##  See ALIASES in template.doxconf to see how to reference command tags.
+    ##
+    ##  Linking only works within the document that included the command.sec file.
+    ops.append(op('command',name=name,label=getLabel(command_c,name),prefix=prefix))
+    ops.append(op('itemDescription',description=getVal(cmd,'description')))
+
+    if 'args' in cmd:
+      ops.append(op('argTable'))
+      for arg in cmd['args']:
+        dataType, rangeStr = getDtStr(arg)
+        ops.append(op('argRow',name=getVal(arg,'name'),type=dataType,
+          units=getVal(arg,'units'),range=rangeStr,description=getVal(arg,'description')))
+      ops.append(op('tableEnd'))
+
+    if 'requiredArgs' in cmd:
+      if cmd['requiredArgs']:
+        ops.append(op('requiredArgs',args=Join('args',cmd['requiredArgs'])))
+      else:
+        ops.append(op('noRequiredArgs'))
+
+  return ops
+
+## Render the sections of a component, a list of (model_c, ops), in each
+## format and write the outputs
+def writeOutputs(outDir, compName, title, sections, formatNames):
+  for name in formatNames:
+    fmt = renderModel.formats[name]
+    if fmt.perSection:
+      for model_c,ops in sections:
+        writeOutput(outDir,model_c['secfile'],''.join(fmt.render(ops)))
+    else:
+      writeOutput(outDir,compName+fmt.ext,fmt.renderDocument(title,
+        [(model_c['title'],ops) for model_c,ops in sections]))
+
+## write all the outputs of a component unless they are up to date
+## (force: even then), returns False on failure
+def writeComponent(compDir, outDir, force=False, formatNames=['sec']):
+  key = manifestKey(compDir,formatNames)
+  if not force and upToDate(outDir,key,readManifest(outDir)):
+    return True
+
+  models.clear()
+  outputs.clear()
+  try:
+    ops, comp = buildComp(getModel(compDir,component_c))
+    if comp is None:
+      writeOutputs(outDir,os.path.basename(compDir),'N/A',[(component_c,ops)],formatNames)
+      print("No component model in {0}".format(compDir))
+      return False
+    prefix, title = comp
+    sections = [
+      (component_c, ops),
+      (subevent_c, buildSubEvent(getModel(compDir,subevent_c),title)),
+      (pubevent_c, buildPubEvent(getModel(compDir,pubevent_c),prefix,title)),
+      (alarm_c, buildAlarm(getModel(compDir,alarm_c),prefix,title)),
+      (command_c, buildCmd(getModel(compDir,command_c),prefix,title))
+    ]
+    writeOutputs(outDir,os.path.basename(compDir),title or prefix,sections,formatNames)
+    writeManifest(outDir,{'key':key,'outputs':outputs})
+  except IOError as e:
+    print("I/O error({0}): {1}".format(e.errno, e.strerror))
+    return False
+  return True
+
+## pool worker: (compDir, outDir, force, formatNames) -> success
+def writeComponentJob(job):
+  return writeComponent(*job)
+
+## functions timed as phases when profiling
+def instrumentModel():
+  icdProfile.instrument(globals(),
+    ['parseModel','buildComp','buildSubEvent','buildPubEvent','buildAlarm','buildCmd',
+     'writeOutputs'])
+
+## set up profiling in a pool worker; a forked worker inherits it from main()
+def initWorker(profile):
+  if profile and not icdProfile.enabled:
+    icdProfile.configure(profile,worker=True)
+    instrumentModel()
+
+## pool worker when profiling: job -> (success, phases measured in the worker)
+def writeComponentProfiled(job):
+  icdProfile.collect()
+  ok = writeComponent(*job)
+  return ok,icdProfile.collect()
+
+## component directories of an ICDDB tree, i.e. those holding model files
+def findComponents(inDir):
+  return sorted(d for d in os.listdir(inDir)
+    if os.path.isdir(inDir+"/"+d) and
+      any(os.path.isfile(inDir+"/"+d+"/"+f) for f in modelFiles))
+
+## write the outputs of many components, fanning them out over a pool
+## of processes; returns the number of components that failed
+def writeComponents(jobs, processes):
+  with icdProfile.phase('writeComponents') as p:
+    p.add(len(jobs))
+    if processes > 1 and len(jobs) > 1 and icdProfile.enabled:
+      with ProcessPoolExecutor(max_workers=min(processes,len(jobs)),
+                               initializer=initWorker,
+                               initargs=(icdProfile.target,)) as pool:
+        ok = []
+        for success,measured in pool.map(writeComponentProfiled,jobs):
+          ok.append(success)
+          icdProfile.merge(measured)
+    elif processes > 1 and len(jobs) > 1:
+      with ProcessPoolExecutor(max_workers=min(processes,len(jobs))) as pool:
+        ok = list(pool.map(writeComponentJob,jobs))
+    else:
+      ok = [writeComponentJob(job) for job in jobs]
+  return ok.count(False)
 
-  file.write("The {0} accepts the following commands:\n\n".format(title))
-    
-  file.write("\latexonly \\begin{itemize}\n")
-
-  for i in range(0, len(rec)):
-      name = getVal(rec[i],'name')
-      file.write("\\item ")
-      file.write("\hyperref[" + command_c['tagprefix']+targetStr(name) + "]{" + latexStr(name) + "}\n")
-
-  file.write("\\end{itemize} \endlatexonly\n")
-
-  for i in range(0, len(rec)):
-      name = getVal(rec[i],'name')
-
-      file.write("<hr>\n")
-
-      ##  Enable linking to command subsections.
-      ##  See ALIASES in template.doxconf to see how to reference command tags.
-      ##
-      ##  Linking only works within the document that included the command.sec file.
-      file.write("\latexonly\n\subsection{"+latexStr(name)+" Command}\n\endlatexonly\n")
-      file.write(getTag(command_c,name))
-
-      file.write("<b>Command:</b> {0}.{1}<br>\n".format(prefix,name))  
-      file.write("{0}<br>\n\n".format(getVal(rec[i],'description')))
-
-      if 'args' in rec[i]:
-        file.write("<table>\n<tr><th> Argument <th> Data Type <th> Units <th> Range <th> Description\n")
-        arg = rec[i]['args']
-        for j in range(0, len(arg)):
-          file.write("<tr><td> "+getVal(arg[j],'name'))
-          dateType, rangeStr = getDtStr(arg[j])
-          file.write("<td> "+dateType)
-          file.write("<td> "+getVal(arg[j],'units'))
-          file.write("<td> "+rangeStr)
-          file.write("<td> "+getVal(arg[j],'description'))
-        file.write("\n</table>\n\n")
-
-      if 'requiredArgs' in rec[i]:
-        arg = rec[i]['requiredArgs']
-        file.write("<b>Required Args:</b> ")
-        for j in range(0, len(arg)):
-          if j == len(arg)-1:
-            file.write("{0}<br>\n".format(arg[j]))
-          else:
-            file.write("{0}, ".format(arg[j]))
-
-  file.close()
+usage = """usage: parseModelFile.py [--profile[=VALUE]] [--jobs N] [--force] [--formats LIST] inDir compName outDir [compName outDir ...]
+       parseModelFile.py [--profile[=VALUE]] [--jobs N] [--force] [--formats LIST] --all inDir outRoot
 
-## main
-#
+Write the doxygen sections (.sec) documenting components of a subsystem
+from its model files in inDir, e.g. ICD-Model-Files/NFIRAOS-Model-Files.
+
+--formats is a comma-separated list of output formats (default: sec):
+  sec   doxygen sections included by the tech notes
+  html  standalone HTML page, compName.html
+  md    Markdown document, compName.md
+  tex   LaTeX fragment to \\input, compName.tex
+All the formats are rendered from a single parse of the model files.
 
-inDir = sys.argv[1]
-compName = sys.argv[2]
-outDir = sys.argv[3]
+Each compName is written to the outDir following it. With --all, every
+component of inDir is written to outRoot/compName. Components are written
+in parallel by --jobs processes (default: number of CPUs).
 
-try:
+Output files are only replaced when their contents change. A component
+whose model files are unchanged since the last run, according to the
+.parseModelFile.manifest of its outDir, is skipped unless --force is given."""
+
+## main
+#
+def main(argv):
+  ## --profile or NIC_PROFILE reports the time spent in parsing the model
+  ## files, in each build*() function and in rendering the outputs, including
+  ## the measurements of the pool workers
+  icdProfile.configure(icdProfile.strip_option(argv))
+  instrumentModel()
+
+  args = argv[1:]
+  processes = os.cpu_count() or 1
+  tree = False
+  force = False
+  formatNames = ['sec']
+  while args and args[0].startswith('-'):
+    opt = args.pop(0)
+    if opt in ('-h','--help'):
+      print(usage)
+      return 0
+    elif opt == '--all':
+      tree = True
+    elif opt == '--force':
+      force = True
+    elif opt in ('-j','--jobs') and args and args[0].isdigit():
+      processes = int(args.pop(0))
+    elif opt.startswith('--jobs=') and opt[7:].isdigit():
+      processes = int(opt[7:])
+    elif opt == '--formats' and args:
+      formatNames = args.pop(0).split(',')
+    elif opt.startswith('--formats='):
+      formatNames = opt[10:].split(',')
+    else:
+      args = []
+      break
+
+  unknown = [f for f in formatNames if f not in renderModel.formats]
+  if unknown or not formatNames:
+    args = []
+
+  if tree and len(args) == 2:
+    inDir, outRoot = args
+    jobs = []
+    for compName in findComponents(inDir):
+      os.makedirs(outRoot+"/"+compName,exist_ok=True)
+      jobs.append((inDir+"/"+compName,outRoot+"/"+compName,force,formatNames))
+  elif not tree and len(args) >= 3 and len(args) % 2 == 1:
+    inDir = args[0]
+    jobs = [("{0}/{1}".format(inDir,compName),outDir,force,formatNames)
+      for compName,outDir in zip(args[1::2],args[2::2])]
+  else:
+    sys.stderr.write(usage+"\n")
+    return 2
 
-  compDir = "{0}/{1}".format(inDir,compName)
-  prefix, title = writeComp(compDir,outDir)
-  writeSubEvent(compDir,outDir,title)
-  writePubEvent(compDir,outDir,prefix,title)
-  writeAlarm(compDir,outDir,prefix,title)
-  writeCmd(compDir,outDir,prefix,title)
+  failed = writeComponents(jobs,processes)
+  pruneModelCache()
+  return 1 if failed else 0
 
-except IOError as e:
-  print("I/O error({0}): {1}".format(e.errno, e.strerror))
-  file.close()
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
 
 # end of file
 
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+#
+
+import collections
+import html
+import re
+from string import Formatter
+
+## Rendering of the model file documentation in several formats.
+##
+## parseModelFile.py turns each section of a component into a list of
+## operations, (template name, arguments) pairs, in one pass over the parsed
+## model. A format is a table of templates, one per operation, compiled once
+## when this module is loaded. Rendering a section is a single pass over its
+## operations that appends strings to a list, joined and written at once, so
+## adding a format needs neither another parse nor another pass over the
+## model.
+##
+## Template fields are {name} or {name:filter}. The filter escapes the value
+## for the format ('' is the format's default, 'raw' leaves it untouched).
+## A value can also be:
+##   Inline(template,args) - rendered with another template of the format,
+##                           e.g. a range "0 to 10"
+##   Join(separator,items) - items rendered with the field's filter and
+##                           joined with one of the format's separators
+
+Inline = collections.namedtuple('Inline','template args')
+Join = collections.namedtuple('Join','separator items')
+
+## a value as a string, as "{0}".format() would print it
+def plain(val):
+  return val if isinstance(val,str) else "{0}".format(val)
+
+## Sanitize a string so that it displays correctly with latex
+def latexStr(str):
+  # Underscores need to be escaped.
+  str_sanitized = plain(str).replace('_','\\_')
+  return str_sanitized
+
+## Escape a string for pure LaTeX, dropping any HTML markup of the model
+latexChars = {
+  '\\' : '\\textbackslash{}',
+  '&'  : '\\&',
+  '%'  : '\\%',
+  '$'  : '\\$',
+  '#'  : '\\#',
+  '_'  : '\\_',
+  '{'  : '\\{',
+  '}'  : '\\}',
+  '~'  : '\\textasciitilde{}',
+  '^'  : '\\textasciicircum{}',
+  '|'  : '\\textbar{}',
+  '<'  : '\\textless{}',
+  '>'  : '\\textgreater{}'
+}
+latexSpecial = re.compile(r'[\\&%$#_{}~^|<>]')
+htmlTag = re.compile(r'<[^>]*>')
+def latexEscape(val):
+  str = html.unescape(htmlTag.sub(' ',plain(val)))
+  return latexSpecial.sub(lambda m: latexChars[m.group()],str)
+
+## Markdown table cells must fit on one line and not contain bars
+def markdownCell(val):
+  return plain(val).replace('|','\\|').replace('\n',' ')
+
+## compile a template into a list of (literal, field, filter) parts
+def compileTemplate(template,filters):
+  parts = []
+  for literal,field,spec,conversion in Formatter().parse(template):
+    if field is not None and (spec or '') not in filters:
+      raise ValueError("unknown filter '{0}' in template {1!r}".format(spec,template))
+    parts.append((literal,field,filters[spec or ''] if field is not None else None))
+  return parts
+
+
+## An output format. Formats with perSection set write one file per section
+## (named after the section's secfile); the others write one document per
+## component with its sections under headings.
+class Format:
+  def __init__(self,ext,perSection,filters,separators,templates):
+    self.ext = ext
+    self.perSection = perSection
+    self.separators = separators
+    self.templates = dict((name,compileTemplate(template,filters))
+      for name,template in templates.items())
+
+  ## append the expansion of a template to out
+  def expand(self,out,name,args):
+    for literal,field,filter in self.templates[name]:
+      if literal:
+        out.append(literal)
+      if field is None:
+        continue
+      val = args[field]
+      kind = type(val)
+      if kind is str and filter is plain:
+        out.append(val)
+      elif kind is Inline:
+        self.expand(out,val.template,val.args)
+      elif kind is Join:
+        out.append(self.separators[val.separator].join(map(filter,val.items)))
+      else:
+        out.append(filter(val))
+
+  ## render a list of operations, appending to out
+  def render(self,ops,out=None):
+    if out is None:
+      out = []
+    for name,args in ops:
+      self.expand(out,name,args)
+    return out
+
+  ## render the sections of a component, a list of (title, ops), as a
+  ## document
+  def renderDocument(self,title,sections):
+    out = []
+    self.expand(out,'document',{'title':title})
+    for sectionTitle,ops in sections:
+      self.expand(out,'section',{'title':sectionTitle})
+      self.render(ops,out)
+    self.expand(out,'documentEnd',{})
+    return ''.join(out)
+
+
+## Doxygen sections (.sec), the HTML and \latexonly blocks included by the
+## tech notes. The tags must match the ALIASES in template.doxconf.
+secLabel = "\\latexonly\n\\label{{{label}}}\n\\endlatexonly\n\\htmlonly<a id={label}></a>\\endhtmlonly\n"
+sec = Format('.sec', True,
+  { '' : plain, 'raw' : plain, 'latex' : latexStr },
+  { 'enum' : " <br> | ", 'severity' : ",", 'args' : ", " },
+  {
+  'na'              : "N/A<br>\n",
+  'prefix'          : "The prefix for the {title} is: <em>{prefix}</em>\n\n",
+  'compDescription' : "{description}<br>\n",
+  'intro'           : "{text}\n\n",
+  'event'           : "<hr>\n\\latexonly\n\\subsection{{{name:latex} Event}}\n\\endlatexonly\n" +
+                      secLabel + "<b>Event item:</b> {prefix}.{name}<br>\n",
+  'archived'        : "<b>Archived:</b> {archive}<br>\n",
+  'rate'            : "<b>Rate:</b> {rate} Hz<br>\n",
+  'bandwidth'       : "<b>Bandwidth:</b> {bandwidth}<br>\n",
+  'itemDescription' : "{description}<br>\n\n",
+  'attrTable'       : "<table>\n<tr><th> Attribute <th> Data Type <th> Units <th> Range <th> Bandwidth <th> Description\n",
+  'attrRow'         : "<tr><td> {name}<td> {type}<td> {units}<td> {range}<td> {bandwidth}<td> {description}",
+  'tableEnd'        : "\n</table>\n\n",
+  'alarmTable'      : "<table>\n<tr><th> Alarm <th> Severity Levels <th> Description <th> Probable Cause <th> Operator Response\n",
+  'alarmRow'        : secLabel + "<tr><td> {name}<td> {severity}<td> {description}<td> {cause}<td> {response}",
+  'subTable'        : "<table>\n<tr><th> Subscription <th> Rate (Hz)\n",
+  'subRow'          : secLabel + "<tr><td> {item} <td> {rate}",
+  'usage'           : "<br><b>Usage:</b><br>{usage}",
+  'subRowEnd'       : "\n",
+  'subTableEnd'     : "</table>\n",
+  'cmdIndex'        : "\\latexonly \\begin{{itemize}}\n",
+  'cmdIndexItem'    : "\\item \\hyperref[{label}]{{{name:latex}}}\n",
+  'cmdIndexEnd'     : "\\end{{itemize}} \\endlatexonly\n",
+  'command'         : "<hr>\n\\latexonly\n\\subsection{{{name:latex} Command}}\n\\endlatexonly\n" +
+                      secLabel + "<b>Command:</b> {prefix}.{name}<br>\n",
+  'argTable'        : "<table>\n<tr><th> Argument <th> Data Type <th> Units <th> Range <th> Description\n",
+  'argRow'          : "<tr><td> {name}<td> {type}<td> {units}<td> {range}<td> {description}",
+  'requiredArgs'    : "<b>Required Args:</b> {args}<br>\n",
+  'noRequiredArgs'  : "<b>Required Args:</b> ",
+  'between'         : "{min} to {max}",
+  'le'              : "&le; {max}",
+  'ge'              : "&ge; {min}",
+  'value'           : "{value}",
+  'enumRange'       : "{enum} ({range})"
+  })
+
+## Standalone HTML page per component. Model descriptions may hold HTML
+## markup and are copied as they are, as in the doxygen sections.
+htmlDoc = Format('.html', False,
+  { '' : plain, 'raw' : plain, 'attr' : lambda v: html.escape(plain(v)) },
+  { 'enum' : " | ", 'severity' : ", ", 'args' : ", " },
+  {
+  'document'        : "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+                      "<title>{title:attr}</title>\n</head>\n<body>\n<h1>{title}</h1>\n",
+  'section'         : "<h2>{title}</h2>\n",
+  'documentEnd'     : "</body>\n</html>\n",
+  'na'              : "<p>N/A</p>\n",
+  'prefix'          : "<p>The prefix for the {title} is: <em>{prefix}</em></p>\n",
+  'compDescription' : "<p>{description}</p>\n",
+  'intro'           : "<p>{text}</p>\n",
+  'event'           : "<hr>\n<h3 id=\"{label:attr}\">{name} Event</h3>\n<b>Event item:</b> {prefix}.{name}<br>\n",
+  'archived'        : "<b>Archived:</b> {archive}<br>\n",
+  'rate'            : "<b>Rate:</b> {rate} Hz<br>\n",
+  'bandwidth'       : "<b>Bandwidth:</b> {bandwidth}<br>\n",
+  'itemDescription' : "<p>{description}</p>\n",
+  'attrTable'       : "<table border=\"1\">\n<tr><th>Attribute</th><th>Data Type</th><th>Units</th><th>Range</th><th>Bandwidth</th><th>Description</th></tr>\n",
+  'attrRow'         : "<tr><td>{name}</td><td>{type}</td><td>{units}</td><td>{range}</td><td>{bandwidth}</td><td>{description}</td></tr>\n",
+  'tableEnd'        : "</table>\n",
+  'alarmTable'      : "<table border=\"1\">\n<tr><th>Alarm</th><th>Severity Levels</th><th>Description</th><th>Probable Cause</th><th>Operator Response</th></tr>\n",
+  'alarmRow'        : "<tr id=\"{label:attr}\"><td>{name}</td><td>{severity}</td><td>{description}</td><td>{cause}</td><td>{response}</td></tr>\n",
+  'subTable'        : "<table border=\"1\">\n<tr><th>Subscription</th><th>Rate (Hz)</th></tr>\n",
+  'subRow'          : "<tr id=\"{label:attr}\"><td>{item}</td><td>{rate}",
+  'usage'           : "<br><b>Usage:</b><br>{usage}",
+  'subRowEnd'       : "</td></tr>\n",
+  'subTableEnd'     : "</table>\n",
+  'cmdIndex'        : "<ul>\n",
+  'cmdIndexItem'    : "<li><a href=\"#{label:attr}\">{name}</a></li>\n",
+  'cmdIndexEnd'     : "</ul>\n",
+  'command'         : "<hr>\n<h3 id=\"{label:attr}\">{name} Command</h3>\n<b>Command:</b> {prefix}.{name}<br>\n",
+  'argTable'        : "<table border=\"1\">\n<tr><th>Argument</th><th>Data Type</th><th>Units</th><th>Range</th><th>Description</th></tr>\n",
+  'argRow'          : "<tr><td>{name}</td><td>{type}</td><td>{units}</td><td>{range}</td><td>{description}</td></tr>\n",
+  'requiredArgs'    : "<p><b>Required Args:</b> {args}</p>\n",
+  'noRequiredArgs'  : "",
+  'between'         : "{min} to {max}",
+  'le'              : "&le; {max}",
+  'ge'              : "&ge; {min}",
+  'value'           : "{value}",
+  'enumRange'       : "{enum} ({range})"
+  })
+
+## Markdown document per component, with HTML anchors for the tags
+md = Format('.md', False,
+  { '' : plain, 'raw' : plain, 'cell' : markdownCell },
+  { 'enum' : " \\| ", 'severity' : ", ", 'args' : ", " },
+  {
+  'document'        : "# {title}\n\n",
+  'section'         : "## {title}\n\n",
+  'documentEnd'     : "",
+  'na'              : "N/A\n\n",
+  'prefix'          : "The prefix for the {title} is: *{prefix}*\n\n",
+  'compDescription' : "{description}\n\n",
+  'intro'           : "{text}\n\n",
+  'event'           : "---\n\n### <a id=\"{label}\"></a>{name} Event\n\n**Event item:** {prefix}.{name}  \n",
+  'archived'        : "**Archived:** {archive}  \n",
+  'rate'            : "**Rate:** {rate} Hz  \n",
+  'bandwidth'       : "**Bandwidth:** {bandwidth}  \n",
+  'itemDescription' : "\n{description}\n\n",
+  'attrTable'       : "| Attribute | Data Type | Units | Range | Bandwidth | Description |\n|---|---|---|---|---|---|\n",
+  'attrRow'         : "| {name:cell} | {type:cell} | {units:cell} | {range:cell} | {bandwidth:cell} | {description:cell} |\n",
+  'tableEnd'        : "\n",
+  'alarmTable'      : "| Alarm | Severity Levels | Description | Probable Cause | Operator Response |\n|---|---|---|---|---|\n",
+  'alarmRow'        : "| <a id=\"{label}\"></a>{name:cell} | {severity:cell} | {description:cell} | {cause:cell} | {response:cell} |\n",
+  'subTable'        : "| Subscription | Rate (Hz) |\n|---|---|\n",
+  'subRow'          : "| <a id=\"{label}\"></a>{item:cell} | {rate:cell}",
+  'usage'           : "<br>**Usage:** {usage:cell}",
+  'subRowEnd'       : " |\n",
+  'subTableEnd'     : "\n",
+  'cmdIndex'        : "",
+  'cmdIndexItem'    : "- [{name}](#{label})\n",
+  'cmdIndexEnd'     : "\n",
+  'command'         : "---\n\n### <a id=\"{label}\"></a>{name} Command\n\n**Command:** {prefix}.{name}  \n",
+  'argTable'        : "| Argument | Data Type | Units | Range | Description |\n|---|---|---|---|---|\n",
+  'argRow'          : "| {name:cell} | {type:cell} | {units:cell} | {range:cell} | {description:cell} |\n",
+  'requiredArgs'    : "**Required Args:** {args}\n\n",
+  'noRequiredArgs'  : "",
+  'between'         : "{min} to {max}",
+  'le'              : "&le; {max}",
+  'ge'              : "&ge; {min}",
+  'value'           : "{value}",
+  'enumRange'       : "{enum} ({range})"
+  })
+
+## LaTeX fragment per component, to be \input in a document using the
+## hyperref package. Model text is escaped and its HTML markup dropped.
+tex = Format('.tex', False,
+  { '' : latexEscape, 'raw' : plain },
+  { 'enum' : " $|$ ", 'severity' : ", ", 'args' : ", " },
+  {
+  'document'        : "\\section{{{title}}}\n\n",
+  'section'         : "\\subsection{{{title}}}\n\n",
+  'documentEnd'     : "",
+  'na'              : "N/A\n\n",
+  'prefix'          : "The prefix for the {title} is: \\emph{{{prefix}}}\n\n",
+  'compDescription' : "{description}\n\n",
+  'intro'           : "{text}\n\n",
+  'event'           : "\\subsubsection{{{name} Event}}\n\\label{{{label:raw}}}\n\\begin{{description}}\n\\item[Event item] {prefix}.{name}\n",
+  'archived'        : "\\item[Archived] {archive}\n",
+  'rate'            : "\\item[Rate] {rate} Hz\n",
+  'bandwidth'       : "\\item[Bandwidth] {bandwidth}\n",
+  'itemDescription' : "\\end{{description}}\n{description}\n\n",
+  'attrTable'       : "\\begin{{tabular}}{{|l|l|l|p{{3cm}}|l|p{{4cm}}|}}\n\\hline\n"
+                      "Attribute & Data Type & Units & Range & Bandwidth & Description \\\\\n\\hline\n",
+  'attrRow'         : "{name} & {type} & {units} & {range} & {bandwidth} & {description} \\\\\n",
+  'tableEnd'        : "\\hline\n\\end{{tabular}}\n\n",
+  'alarmTable'      : "\\begin{{tabular}}{{|l|l|p{{3cm}}|p{{3cm}}|p{{3cm}}|}}\n\\hline\n"
+                      "Alarm & Severity Levels & Description & Probable Cause & Operator Response \\\\\n\\hline\n",
+  'alarmRow'        : "{name}\\label{{{label:raw}}} & {severity} & {description} & {cause} & {response} \\\\\n",
+  'subTable'        : "\\begin{{tabular}}{{|l|p{{6cm}}|}}\n\\hline\nSubscription & Rate (Hz) \\\\\n\\hline\n",
+  'subRow'          : "{item}\\label{{{label:raw}}} & {rate}",
+  'usage'           : " \\newline \\textbf{{Usage:}} {usage}",
+  'subRowEnd'       : " \\\\\n",
+  'subTableEnd'     : "\\hline\n\\end{{tabular}}\n\n",
+  'cmdIndex'        : "\\begin{{itemize}}\n",
+  'cmdIndexItem'    : "\\item \\hyperref[{label:raw}]{{{name}}}\n",
+  'cmdIndexEnd'     : "\\end{{itemize}}\n",
+  'command'         : "\\subsubsection{{{name} Command}}\n\\label{{{label:raw}}}\n\\begin{{description}}\n\\item[Command] {prefix}.{name}\n",
+  'argTable'        : "\\begin{{tabular}}{{|l|l|l|p{{3cm}}|p{{5cm}}|}}\n\\hline\n"
+                      "Argument & Data Type & Units & Range & Description \\\\\n\\hline\n",
+  'argRow'          : "{name} & {type} & {units} & {range} & {description} \\\\\n",
+  'requiredArgs'    : "\\noindent\\textbf{{Required Args:}} {args}\n\n",
+  'noRequiredArgs'  : "",
+  'between'         : "{min} to {max}",
+  'le'              : "$\\le$ {max}",
+  'ge'              : "$\\ge$ {min}",
+  'value'           : "{value}",
+  'enumRange'       : "{enum} ({range})"
+  })
+
+## output formats by name
+formats = collections.OrderedDict([
+  ('sec'  , sec),
+  ('html' , htmlDoc),
+  ('md'   , md),
+  ('tex'  , tex)
+])
+
+# end of file